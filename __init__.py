@@ -1 +1,7 @@
-from .bin.biomedical_concepts import process_usdm_biomedical_concepts_to_csv
+# Imported on first use so importing the package stays cheap, see PEP 562
+def __getattr__(name):
+    if name == "process_usdm_biomedical_concepts_to_csv":
+        from .bin.biomedical_concepts import process_usdm_biomedical_concepts_to_csv
+
+        return process_usdm_biomedical_concepts_to_csv
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
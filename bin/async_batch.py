@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from batch import BatchResult, convert_study, study_output_dirs
+from instrumentation import RUN_REPORT
+
+# Input files copied from, and output files written to, the shared filesystem at a time
+DEFAULT_READ_CONCURRENCY = 8
+DEFAULT_WRITE_CONCURRENCY = 8
+
+
+def copy_atomic(source, target):
+    """Copy source to target through a temporary file next to it, so target is never seen half written."""
+    tmp_file = f"{target}.{os.getpid()}.tmp"
+    try:
+        shutil.copyfile(source, tmp_file)
+        os.replace(tmp_file, target)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def _publish(local_dir, output_dir, usdm_file, report_only=False):
+    """
+    Copy the files under local_dir atomically to the same place under
+    output_dir, only the run report with report_only.
+    Returns:
+        list: The relative paths copied.
+    """
+    report_file = os.path.join(local_dir, RUN_REPORT)
+    if os.path.exists(report_file):
+        # The run read the scratch copy; name the file the batch was given
+        with open(report_file) as f:
+            report = json.load(f)
+        report["usdm_file"] = usdm_file
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+    published = []
+    for root, _, files in os.walk(local_dir):
+        names = sorted(files) if not report_only else [RUN_REPORT] if root == local_dir and RUN_REPORT in files else []
+        if not names:
+            continue
+        target_dir = os.path.join(output_dir, os.path.relpath(root, local_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in names:
+            copy_atomic(os.path.join(root, name), os.path.join(target_dir, name))
+            published.append(os.path.relpath(os.path.join(root, name), local_dir))
+    return published
+
+
+class _Pipeline:
+    """The pools, limits and scratch directory shared by the studies of one batch."""
+
+    def __init__(self, scratch, pool, io_pool, read_limit, write_limit, study_limit, options):
+        self.scratch = scratch
+        self.pool = pool
+        self.io_pool = io_pool
+        self.read_limit = read_limit
+        self.write_limit = write_limit
+        self.study_limit = study_limit
+        self.options = options
+
+    async def convert(self, number, usdm_file, output_dir):
+        loop = asyncio.get_running_loop()
+        async with self.study_limit:
+            start = time.perf_counter()
+            work_dir = os.path.join(self.scratch, str(number))
+            local_file = os.path.join(work_dir, "input", os.path.basename(usdm_file))
+            local_dir = os.path.join(work_dir, "output")
+            try:
+                os.makedirs(os.path.dirname(local_file))
+                async with self.read_limit:
+                    await loop.run_in_executor(self.io_pool, shutil.copyfile, usdm_file, local_file)
+                result = await loop.run_in_executor(self.pool, convert_study, local_file, local_dir,
+                                                    *self.options)
+                async with self.write_limit:
+                    await loop.run_in_executor(self.io_pool, _publish, local_dir, output_dir, usdm_file,
+                                               not result.ok)
+                error = result.error
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            finally:
+                await loop.run_in_executor(self.io_pool, shutil.rmtree, work_dir, True)
+            return BatchResult(usdm_file, output_dir, not error, time.perf_counter() - start, error)
+
+
+async def run_batch_async(usdm_files, output_root, workers=None, domains=None,
+                          tsparm_spec_file="spec/TSPARM_spec.csv", max_tasks_per_child=20, on_result=None,
+                          stream=False, validate=None, formats=("csv",), read_concurrency=DEFAULT_READ_CONCURRENCY,
+                          write_concurrency=DEFAULT_WRITE_CONCURRENCY, max_in_flight=None, scratch_dir=None):
+    """
+    Convert many USDM files with their reads and writes overlapped, for
+    inputs and outputs on a slow (e.g. network) filesystem.
+    Each study goes through three steps: its file is copied to a local
+    scratch directory by an I/O thread, parsed and converted there by a
+    worker process (see batch.convert_study), and the files written are
+    copied to the study's output folder (see batch.study_output_dirs) by
+    an I/O thread, each through a temporary file renamed into place.
+    Studies move through the steps independently, so one slow read or
+    write holds up only its own study while the others keep the workers
+    busy. A study that fails only gets
+    its run report, leaving its earlier output files as they were.
+    Incremental runs are not supported: they compare against the output
+    directory, which the workers do not write to.
+    Args:
+        usdm_files, output_root, workers, domains, tsparm_spec_file,
+        max_tasks_per_child, on_result, stream, validate, formats: As for
+            batch.run_batch.
+        read_concurrency (int): Input files read at a time.
+        write_concurrency (int): Studies whose output is written at a time.
+        max_in_flight (int): Studies between their read and their write at
+            a time, which bounds the scratch space; defaults to two per
+            worker.
+        scratch_dir (str): Local directory for the scratch copies, defaults
+            to the system temporary directory.
+    Returns:
+        list: BatchResult for every input file, in input order.
+    Raises:
+        ValueError: When two files would share an output folder.
+    """
+    workers = workers or os.cpu_count() or 1
+    options = (domains, tsparm_spec_file, stream, validate, False, formats)
+    output_dirs = study_output_dirs(output_root, usdm_files)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="usdm-batch-", dir=scratch_dir) as scratch, \
+            ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=max_tasks_per_child) as pool, \
+            ThreadPoolExecutor(max_workers=read_concurrency + write_concurrency, thread_name_prefix="usdm-io") as io_pool:
+        pipeline = _Pipeline(scratch, pool, io_pool, asyncio.Semaphore(read_concurrency),
+                             asyncio.Semaphore(write_concurrency), asyncio.Semaphore(max_in_flight or workers * 2),
+                             options)
+        tasks = [
+            asyncio.ensure_future(pipeline.convert(number, usdm_file, output_dir))
+            for number, (usdm_file, output_dir) in enumerate(zip(usdm_files, output_dirs))
+        ]
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            results[result.usdm_file] = result
+            if on_result:
+                on_result(result)
+    return [results[f] for f in usdm_files]
+
+
+def run_batch_concurrent(usdm_files, output_root, **kwargs):
+    """run_batch_async from synchronous code, in a new event loop."""
+    return asyncio.run(run_batch_async(usdm_files, output_root, **kwargs))
@@ -0,0 +1,131 @@
+import glob
+import os
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from create_trial_design import main as create_trial_design
+
+BatchResult = namedtuple(
+    "BatchResult", ["usdm_file", "output_dir", "ok", "elapsed", "error"]
+)
+
+
+def find_usdm_files(inputs):
+    """
+    Expand directories and glob patterns into a sorted list of USDM JSON files.
+    Args:
+        inputs (list): Directories, glob patterns or file paths.
+    Returns:
+        list: Unique file paths in a stable order.
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(glob.glob(os.path.join(item, "*.json")))
+        else:
+            files.extend(glob.glob(item) or ([item] if os.path.exists(item) else []))
+    return sorted(set(files))
+
+
+def study_output_dirs(output_root, usdm_files):
+    """
+    The output folder of each study: <output_root>/<file stem>, or, for
+    files sharing a stem, <output_root>/<path relative to the directory
+    common to all the files, without extension>, so that no two studies
+    write to the same folder.
+    Args:
+        output_root (str): Root directory of the batch output.
+        usdm_files (list): USDM JSON files of the batch.
+    Returns:
+        list: Output folder of each file, in the order of usdm_files.
+    Raises:
+        ValueError: When two files would still share a folder, e.g.
+            study.json and study.JSON.
+    """
+    stems = [os.path.splitext(os.path.basename(usdm_file))[0] for usdm_file in usdm_files]
+    counts = Counter(stems)
+    if any(count > 1 for count in counts.values()):
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in usdm_files])
+    folders = []
+    for usdm_file, stem in zip(usdm_files, stems):
+        if counts[stem] > 1:
+            stem = os.path.splitext(os.path.relpath(os.path.abspath(usdm_file), root))[0]
+        folders.append(os.path.join(output_root, stem))
+    seen = {}
+    for usdm_file, folder in zip(usdm_files, folders):
+        if folder in seen:
+            raise ValueError(f"{seen[folder]} and {usdm_file} would both be written to {folder}")
+        seen[folder] = usdm_file
+    return folders
+
+
+def convert_study(usdm_file, output_dir, domains=None, tsparm_spec_file="spec/TSPARM_spec.csv", stream=False,
+                  validate=None, incremental=False, formats=("csv",)):
+    """Convert one study, returning a BatchResult instead of raising."""
+    start = time.perf_counter()
+    try:
+        create_trial_design(usdm_file, output_dir, domains, tsparm_spec_file, stream, validate=validate,
+                            incremental=incremental, formats=formats)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        return BatchResult(usdm_file, output_dir, False, time.perf_counter() - start, error)
+    return BatchResult(usdm_file, output_dir, True, time.perf_counter() - start, "")
+
+
+def run_batch(usdm_files, output_root, workers=None, domains=None,
+              tsparm_spec_file="spec/TSPARM_spec.csv", max_tasks_per_child=20,
+              on_result=None, stream=False, validate=None, incremental=False, formats=("csv",)):
+    """
+    Convert many USDM files across a process pool.
+    At most two tasks per worker are in flight at any time so memory stays
+    bounded however many files are queued, and workers are recycled after
+    max_tasks_per_child studies to release memory held by large documents.
+    Args:
+        usdm_files (list): USDM JSON files to convert.
+        output_root (str): Each study is written to <output_root>/<file stem>/
+            (see study_output_dirs).
+        workers (int): Pool size, defaults to the number of CPUs.
+        domains (list): Trial design domains to write, defaults to all.
+        tsparm_spec_file (str): Path to the TSPARM spec used for TS.
+        max_tasks_per_child (int): Studies a worker converts before it is replaced.
+        on_result (callable): Called with each BatchResult as it completes.
+        stream (bool): Parse only the USDM subtrees the domains read.
+        validate (str): "full" or "subset" schema validation before each
+            conversion; invalid studies fail.
+        incremental (bool): Only rewrite the domains of each study whose
+            inputs changed since its last conversion.
+        formats (list): Output formats written for each study, see
+            create_trial_design.write_domains.
+    Returns:
+        list: BatchResult for every input file, in input order.
+    Raises:
+        ValueError: When two files would share an output folder.
+    """
+    workers = workers or os.cpu_count() or 1
+    results = {}
+    pending = set()
+    queue = iter(zip(usdm_files, study_output_dirs(output_root, usdm_files)))
+
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=max_tasks_per_child) as pool:
+        def submit_next():
+            usdm_file, output_dir = next(queue, (None, None))
+            if usdm_file is None:
+                return False
+            pending.add(pool.submit(convert_study, usdm_file, output_dir, domains, tsparm_spec_file, stream,
+                                    validate, incremental, formats))
+            return True
+
+        while len(pending) < workers * 2 and submit_next():
+            pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                result = future.result()
+                results[result.usdm_file] = result
+                if on_result:
+                    on_result(result)
+                submit_next()
+
+    return [results[f] for f in usdm_files]
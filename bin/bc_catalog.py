@@ -0,0 +1,134 @@
+import csv
+from functools import lru_cache
+
+from file_cache import load_cached
+
+DEFAULT_CATALOG_FILE = "files/cdisc_biomedical_concepts_latest.csv"
+DEFAULT_CACHE_DIR = ".cache/bc_catalog"
+
+# Bump when the cached record layout changes
+CACHE_FORMAT = 1
+
+# Per-data element concept columns of the catalog CSV, everything else is per BC
+DEC_COLUMNS = ["dec_id", "ncit_dec_code", "dec_label", "data_type", "example_set"]
+
+
+def _split(value):
+    return [part.strip() for part in value.split(";") if part.strip()]
+
+
+def read_bc_catalog_csv(path):
+    """
+    Collapse the CDISC biomedical concepts CSV (one row per BC and data
+    element concept) into one record per bc_id.
+    Returns:
+        dict: bc_id -> record with the BC columns, "categories" and
+        "synonyms" as lists and "decs" as a list of DEC dicts.
+    """
+    records = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            bc_id = row["bc_id"]
+            record = records.get(bc_id)
+            if record is None:
+                record = {
+                    "bc_id": bc_id,
+                    "short_name": row["short_name"],
+                    "ncit_code": row["ncit_code"],
+                    "parent_bc_id": row["parent_bc_id"],
+                    "package_date": row["package_date"],
+                    "categories": _split(row["bc_categories"]),
+                    "synonyms": _split(row["synonyms"]),
+                    "result_scales": _split(row["result_scales"]),
+                    "definition": row["definition"],
+                    "system": row["system"],
+                    "system_name": row["system_name"],
+                    "code": row["code"],
+                    "decs": [],
+                }
+                records[bc_id] = record
+            if row["dec_id"]:
+                record["decs"].append({col: row[col] for col in DEC_COLUMNS})
+    return records
+
+
+class BcCatalog:
+    """
+    CDISC biomedical concept catalog indexed by bc_id, NCIt code, parent
+    bc_id, category and case-insensitive synonym (short names included).
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.by_ncit_code = {}
+        self.children = {}
+        self.by_category = {}
+        self.by_synonym = {}
+        for bc_id, record in records.items():
+            self.by_ncit_code.setdefault(record["ncit_code"], []).append(bc_id)
+            if record["parent_bc_id"]:
+                self.children.setdefault(record["parent_bc_id"], []).append(bc_id)
+            for category in record["categories"]:
+                self.by_category.setdefault(category.casefold(), []).append(bc_id)
+            for name in [record["short_name"]] + record["synonyms"]:
+                ids = self.by_synonym.setdefault(name.casefold(), [])
+                if bc_id not in ids:
+                    ids.append(bc_id)
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, bc_id):
+        return self.records.get(bc_id)
+
+    def _records(self, bc_ids):
+        return [self.records[bc_id] for bc_id in bc_ids]
+
+    def by_code(self, ncit_code):
+        return self._records(self.by_ncit_code.get(ncit_code, []))
+
+    def child_concepts(self, parent_bc_id):
+        return self._records(self.children.get(parent_bc_id, []))
+
+    def in_category(self, category):
+        return self._records(self.by_category.get(category.casefold(), []))
+
+    def by_name(self, name):
+        """Concepts whose short name or synonym matches name, ignoring case."""
+        return self._records(self.by_synonym.get(name.casefold(), []))
+
+    def match(self, study_bc):
+        """
+        Find the catalog record for a USDM BiomedicalConcept.
+        The bc_id at the end of the BC reference is tried first, then the
+        standard code and finally the name and synonyms.
+        Returns:
+            tuple: (record, how) with how one of "reference", "code",
+            "synonym", or (None, "") when nothing matches.
+        """
+        reference = study_bc.get("reference") or ""
+        if reference:
+            record = self.records.get(reference.rstrip("/").rsplit("/", 1)[-1])
+            if record:
+                return record, "reference"
+        standard_code = ((study_bc.get("code") or {}).get("standardCode") or {}).get("code")
+        if standard_code:
+            found = self.by_ncit_code.get(standard_code)
+            if found:
+                return self.records[found[0]], "code"
+        for name in [study_bc.get("name") or ""] + list(study_bc.get("synonyms") or []):
+            found = self.by_synonym.get(name.casefold()) if name else None
+            if found:
+                return self.records[found[0]], "synonym"
+        return None, ""
+
+
+def load_bc_catalog(path=DEFAULT_CATALOG_FILE, cache_dir=DEFAULT_CACHE_DIR):
+    """Load the catalog CSV through the on-disk cache in file_cache."""
+    return BcCatalog(load_cached(path, cache_dir, read_bc_catalog_csv, CACHE_FORMAT))
+
+
+@lru_cache(maxsize=None)
+def default_bc_catalog():
+    """Catalog from DEFAULT_CATALOG_FILE, loaded once per process."""
+    return load_bc_catalog()
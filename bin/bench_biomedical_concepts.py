@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from biomedical_concepts import (
+    biomedical_concept_columns,
+    biomedical_concepts_frame,
+    iter_biomedical_concept_rows,
+    write_biomedical_concepts_csv,
+)
+from synthetic_usdm import synthetic_usdm
+
+
+def _materialized_csv(usdm, out_file):
+    # The pre-streaming approach: collect every value, build a frame, then write
+    import pandas as pd
+
+    rows = list(iter_biomedical_concept_rows(usdm))
+    df = pd.DataFrame.from_records(rows, columns=biomedical_concept_columns())
+    df.to_csv(out_file, index=False)
+
+
+def _typed_frame(usdm, out_file):
+    biomedical_concepts_frame(usdm)
+
+
+CASES = {
+    "materialized_frame_csv": _materialized_csv,
+    "streaming_csv": write_biomedical_concepts_csv,
+    "typed_frame": _typed_frame,
+}
+
+
+def run(usdm):
+    n_rows = sum(1 for _ in iter_biomedical_concept_rows(usdm))
+    results = {"rows": n_rows, "cases": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        out_file = os.path.join(tmp, "bc.csv")
+        for name, case in CASES.items():
+            tracemalloc.start()
+            start = time.perf_counter()
+            case(usdm, out_file)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results["cases"][name] = {
+                "seconds": round(elapsed, 3),
+                "rows_per_second": int(n_rows / elapsed) if elapsed else None,
+                "peak_mb": round(peak / 1e6, 1),
+            }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark biomedical concept extraction on a synthetic document.")
+    parser.add_argument("--concepts", type=int, default=1000, help="Number of biomedical concepts")
+    parser.add_argument("--properties", type=int, default=100, help="Properties per concept")
+    parser.add_argument("--codes", type=int, default=2, help="Response codes per property")
+    args = parser.parse_args()
+    usdm = synthetic_usdm(bcs=args.concepts, properties_per_bc=args.properties, codes_per_property=args.codes)
+    print(json.dumps(run(usdm), indent=2))
@@ -0,0 +1,85 @@
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from conformance import conform
+from create_trial_design import DOMAIN_SPEC_FILES, domain_columns, domain_rows
+from row_records import record_type, write_records
+from study_context import iter_study_contexts
+from synthetic_usdm import synthetic_usdm
+
+
+def _dict_csv(output_file, columns, rows):
+    # The pre-record writer: one dict per row, looked up by name
+    with open(output_file, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _per_row_bytes(make, values):
+    tracemalloc.start()
+    rows = [make(row) for row in values]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(size / len(rows), 1) if rows else None
+
+
+def _timed(case, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(usdm, domain="TV", repeat=3):
+    columns = domain_columns(domain, keyed=True)
+    contexts = list(iter_study_contexts(usdm))
+    records = list(domain_rows(contexts, domain, keyed=True))
+    dicts = [row._asdict() for row in records]
+    values = [tuple(row) for row in records]
+    record = record_type(columns)
+    n_rows = len(records)
+
+    def rate(seconds):
+        return int(n_rows / seconds) if seconds else None
+
+    results = {
+        "domain": domain,
+        "rows": n_rows,
+        "bytes_per_row": {
+            "dict": _per_row_bytes(lambda row: dict(zip(columns, row)), values),
+            "record": _per_row_bytes(record._make, values),
+        },
+        "rows_per_second": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, f"{domain}.CSV")
+        cases = {
+            "dict_writer": lambda: _dict_csv(output_file, columns, dicts),
+            "record_writer": lambda: write_records(output_file, columns, records),
+            "conform_dicts": lambda: conform(domain, dicts, columns, DOMAIN_SPEC_FILES[domain]),
+            "conform_records": lambda: conform(domain, records, columns, DOMAIN_SPEC_FILES[domain]),
+        }
+        for name, case in cases.items():
+            results["rows_per_second"][name] = rate(_timed(case, repeat))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare dict rows with records: memory per row and writer throughput.")
+    parser.add_argument("--domain", default="TV", choices=["TA", "TE", "TV", "TI", "TS"], help="Domain whose rows are measured")
+    parser.add_argument("--arms", type=int, default=20, help="Arms per study design")
+    parser.add_argument("--encounters", type=int, default=100, help="Encounters per study design")
+    parser.add_argument("--designs", type=int, default=50, help="Study designs")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, the fastest is kept")
+    args = parser.parse_args()
+    usdm = synthetic_usdm(arms=args.arms, encounters=args.encounters, designs=args.designs)
+    print(json.dumps(run(usdm, args.domain, args.repeat), indent=2))
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from bench_suite import REPO_ROOT, git_commit
+from cli import COMMAND_MODULES
+
+BIN_DIR = os.path.join(REPO_ROOT, "bin")
+
+# Modules no subcommand should import before it needs them
+HEAVY_MODULES = ["pandas", "numpy", "xlrd", "pyarrow", "ijson", "jsonata"]
+
+# Imports what running the subcommand imports, then reports the heavy modules loaded
+_PROBE = """
+import sys
+sys.path.insert(0, {bin_dir!r})
+import cli
+{imports}
+print(",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def _time_process(code):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout.strip()
+
+
+def measure(commands=None, repeat=10):
+    """
+    Time a fresh interpreter importing what each CLI subcommand imports.
+    Args:
+        commands (list): Names from cli.COMMAND_MODULES, defaults to all.
+        repeat (int): Processes started per command.
+    Returns:
+        dict: Run metadata, the bare interpreter start time and, per command,
+        min and median wall time (ms) and the heavy modules it imported.
+    """
+    commands = commands or list(COMMAND_MODULES)
+    interpreter = [_time_process("pass")[0] for _ in range(repeat)]
+    results = []
+    for command in commands + ["help"]:
+        imports = f"cli.import_command({command!r})" if command != "help" else "cli.build_parser()"
+        code = _PROBE.format(bin_dir=BIN_DIR, imports=imports, heavy=HEAVY_MODULES)
+        runs = [_time_process(code) for _ in range(repeat)]
+        seconds = [elapsed for elapsed, _ in runs]
+        results.append({
+            "command": command,
+            "ms_min": round(min(seconds) * 1e3, 1),
+            "ms_median": round(statistics.median(seconds) * 1e3, 1),
+            "heavy_modules": [m for m in runs[0][1].split(",") if m],
+        })
+    return {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "interpreter_ms_min": round(min(interpreter) * 1e3, 1),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of each CLI subcommand.")
+    parser.add_argument("--commands", nargs="+", choices=list(COMMAND_MODULES), help="Subcommands to time (default: all)")
+    parser.add_argument("--repeat", type=int, default=10, help="Processes started per subcommand")
+    parser.add_argument("--output_file", help="Path to the JSON results file (default: output/benchmarks/startup-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--max_ms", type=float, help="Fail when a subcommand's minimum startup time exceeds this")
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    report = measure(args.commands, args.repeat)
+    output_file = args.output_file or os.path.join("output", "benchmarks", f"startup-{report['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump(report, f, indent=2)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {r["command"]: r for r in json.load(f)["results"]}
+    print(f"interpreter {report['interpreter_ms_min']:>8.1f} ms")
+    failed = False
+    for result in report["results"]:
+        line = f"{result['command']:<11} {result['ms_min']:>8.1f} ms"
+        before = previous.get(result["command"])
+        if before and before["ms_min"]:
+            line += f"  x{result['ms_min'] / before['ms_min']:.2f}"
+        if result["heavy_modules"]:
+            line += f"  imports {', '.join(result['heavy_modules'])}"
+            failed = True
+        if args.max_ms is not None and result["ms_min"] > args.max_ms:
+            line += "  (over budget)"
+            failed = True
+        print(line)
+    print(f"Results written to {output_file}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,188 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import create_ta_csv
+import create_te_csv
+import create_ti_csv
+import create_trial_design
+import create_ts_csv
+import create_tv_csv
+from biomedical_concepts import process_usdm_biomedical_concepts_to_csv
+from synthetic_usdm import synthetic_usdm
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# synthetic_usdm() arguments per document size
+SIZES = {
+    "small": {},
+    "medium": {
+        "arms": 6, "epochs": 8, "encounters": 60, "timeline_instances": 300,
+        "criteria": 100, "activities": 100, "bcs": 200, "properties_per_bc": 10,
+    },
+    "large": {
+        "arms": 12, "epochs": 12, "encounters": 250, "timeline_instances": 2000, "timelines": 3,
+        "criteria": 300, "activities": 300, "bcs": 1000, "properties_per_bc": 20, "codes_per_property": 3,
+    },
+}
+
+# Each case runs one entry point on a USDM file, writing into output_dir
+CASES = {
+    "TA": lambda usdm_file, output_dir: create_ta_csv.main(usdm_file, os.path.join(output_dir, "TA.CSV")),
+    "TE": lambda usdm_file, output_dir: create_te_csv.main(usdm_file, os.path.join(output_dir, "TE.CSV")),
+    "TV": lambda usdm_file, output_dir: create_tv_csv.main(usdm_file, os.path.join(output_dir, "TV.CSV")),
+    "TI": lambda usdm_file, output_dir: create_ti_csv.main(usdm_file, os.path.join(output_dir, "TI.CSV")),
+    "TS": lambda usdm_file, output_dir: create_ts_csv.main(
+        usdm_file, "spec/TS_spec.csv", "spec/TSPARM_spec.csv", os.path.join(output_dir, "TS.CSV")),
+    "BC": lambda usdm_file, output_dir: process_usdm_biomedical_concepts_to_csv(
+        usdm_file, os.path.join(output_dir, "BC.CSV")),
+    "TRIAL_DESIGN": lambda usdm_file, output_dir: create_trial_design.main(usdm_file, output_dir),
+}
+
+
+def _reset_peak_rss():
+    # Linux keeps the high-water mark of the parent across fork/exec; writing 5
+    # to clear_refs restarts VmHWM from the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1e3
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def _run_case(case, usdm_file):
+    # Runs in a fresh process so peak RSS and per-process caches belong to this case only
+    _reset_peak_rss()
+    start_rss = _peak_rss_mb()
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        CASES[case](usdm_file, output_dir)
+        elapsed = time.perf_counter() - start
+    peak_rss = _peak_rss_mb()
+    return elapsed, start_rss, peak_rss
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_suite(sizes=None, cases=None, repeat=3):
+    """
+    Time each case on synthetic documents of each size.
+    Every run happens in its own spawned process, so timings include
+    per-process work such as loading terminology but not the imports.
+    Args:
+        sizes (list): Names from SIZES, defaults to all.
+        cases (list): Names from CASES, defaults to all.
+        repeat (int): Runs per case and size.
+    Returns:
+        dict: Run metadata and one result per size and case with min and
+        median wall time and peak resident memory (MB).
+    """
+    sizes = sizes or list(SIZES)
+    cases = cases or list(CASES)
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            usdm_file = os.path.join(tmp, f"{size}.json")
+            with open(usdm_file, "w") as f:
+                json.dump(synthetic_usdm(**SIZES[size]), f)
+            for case in cases:
+                runs = []
+                for _ in range(repeat):
+                    with context.Pool(1) as pool:
+                        runs.append(pool.apply(_run_case, (case, usdm_file)))
+                seconds = [elapsed for elapsed, _, _ in runs]
+                peak = max(run[2] for run in runs) if runs[0][2] is not None else None
+                start = min(run[1] for run in runs) if runs[0][1] is not None else None
+                results.append({
+                    "size": size,
+                    "case": case,
+                    "document_mb": round(os.path.getsize(usdm_file) / 1e6, 2),
+                    "seconds_min": round(min(seconds), 4),
+                    "seconds_median": round(statistics.median(seconds), 4),
+                    "peak_rss_mb": round(peak, 1) if peak is not None else None,
+                    "rss_growth_mb": round(peak - start, 1) if peak is not None else None,
+                })
+    return {
+        "commit": git_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "sizes": {size: SIZES[size] for size in sizes},
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    """Print the median time and peak memory of report relative to baseline."""
+    previous = {(r["size"], r["case"]): r for r in baseline["results"]}
+    for result in report["results"]:
+        before = previous.get((result["size"], result["case"]))
+        if before is None:
+            continue
+        time_ratio = result["seconds_median"] / before["seconds_median"] if before["seconds_median"] else 0
+        line = f"{result['size']:<7} {result['case']:<13} time x{time_ratio:.2f}"
+        if result["peak_rss_mb"] and before["peak_rss_mb"]:
+            line += f"  peak RSS x{result['peak_rss_mb'] / before['peak_rss_mb']:.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SDTM trial design and BC converters on synthetic USDM documents.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), help="Document sizes (default: all)")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), help="Entry points to time (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case and size")
+    parser.add_argument("--output_file", help="Path to the JSON results file (default: output/benchmarks/<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    # Spec and terminology paths are relative to the repository root
+    os.chdir(REPO_ROOT)
+    report = run_suite(args.sizes, args.cases, args.repeat)
+    output_file = args.output_file or os.path.join("output", "benchmarks", f"{report['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump(report, f, indent=2)
+    for result in report["results"]:
+        print(f"{result['size']:<7} {result['case']:<13} {result['seconds_median']:>9.4f}s  "
+              f"peak RSS {result['peak_rss_mb']} MB")
+    print(f"Results written to {output_file}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
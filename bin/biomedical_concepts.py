@@ -1,116 +1,177 @@
+import csv
 import json
-import pandas as pd
+import os
 
+from instrumentation import RUN_REPORT, RunReport
+from study_context import study_versions
 
-def process_usdm_biomedical_concepts_to_csv(usdm_file: str, out_file: str):
+BC_COLUMNS = ["id", "parent_id", "name", "label", "synonyms", "reference", "code", "decode"]
+CATALOG_COLUMNS = ["catalog_bc_id", "catalog_match", "catalog_categories"]
+
+# Columns stored as pandas categoricals in the columnar output, their values
+# repeat heavily (one parent per property/response code, shared codes)
+CATEGORICAL_COLUMNS = ["parent_id", "code", "decode", "catalog_bc_id", "catalog_match"]
+
+
+def _standard_code(obj):
+    standard_code = (obj.get("code") or {}).get("standardCode") or {}
+    return standard_code.get("code", ""), standard_code.get("decode", "")
+
+
+def iter_biomedical_concept_rows(usdm: dict, catalog=None):
     """
-    Process a USDM JSON file and output biomedical concepts to a CSV file.
+    Yield one tuple per biomedical concept, property, response code and BC
+    surrogate of the first study version, in BC_COLUMNS order (followed by
+    CATALOG_COLUMNS when a catalog is given).
     Args:
-        usdm_file (str): Path to the input USDM JSON file.
-        out_file (str): Path to the output CSV file.
+        usdm (dict): Loaded USDM document.
+        catalog (BcCatalog): Optional CDISC BC catalog (see bc_catalog.py)
+            used to match concepts and check property codes against DECs.
     """
-    try:
-        with open(usdm_file, "r") as file:
-            usdm = json.load(file)
-    except FileNotFoundError:
-        print(f"The input JSON file {usdm_file} does not exist")
-        return
-
-    # Prepare lists for all concepts and surrogates
-    ids = []
-    names = []
-    labels = []
-    synonyms = []
-    references = []
-    codes = []
-    decodes = []
-    parent_ids = []
-
-    version = usdm["study"]["versions"][0]
-    bcs = version.get("biomedicalConcepts", [])
-    surrogates = version.get("bcSurrogates", [])
+    version = study_versions(usdm)[0]
+    with_catalog = catalog is not None
+    no_catalog = ("", "", "")
 
     # Extract biomedicalConcepts and their properties
-    for bc in bcs:
-        # Parent concept row
-        ids.append(bc.get("id", ""))
-        names.append(bc.get("name", ""))
-        labels.append(bc.get("label", ""))
-        synonyms.append(", ".join(bc.get("synonyms", [])) if bc.get("synonyms") else "")
-        references.append(bc.get("reference", ""))
-        code = ""
-        decode = ""
-        if "code" in bc and "standardCode" in bc["code"]:
-            code = bc["code"]["standardCode"].get("code", "")
-            decode = bc["code"]["standardCode"].get("decode", "")
-        codes.append(code)
-        decodes.append(decode)
-        parent_ids.append("")
+    for bc in version.get("biomedicalConcepts", []):
+        bc_id = bc.get("id", "")
+        code, decode = _standard_code(bc)
+        row = (
+            bc_id,
+            "",
+            bc.get("name", ""),
+            bc.get("label", ""),
+            ", ".join(bc["synonyms"]) if bc.get("synonyms") else "",
+            bc.get("reference", ""),
+            code,
+            decode,
+        )
+        if with_catalog:
+            record, how = catalog.match(bc)
+            dec_codes = {dec["ncit_dec_code"] for dec in record["decs"]} if record else set()
+            catalog_bc_id = record["bc_id"] if record else ""
+            row += (catalog_bc_id, how, "; ".join(record["categories"]) if record else "")
+        yield row
 
         # Properties as additional rows
         for prop in bc.get("properties", []):
             prop_id = prop.get("id", "")
-            ids.append(prop_id)
-            names.append(prop.get("name", ""))
-            labels.append(prop.get("label", ""))
-            synonyms.append("")
-            references.append(prop.get("reference", ""))
-            pcode = ""
-            pdecode = ""
-            if "code" in prop and "standardCode" in prop["code"]:
-                pcode = prop["code"]["standardCode"].get("code", "")
-                pdecode = prop["code"]["standardCode"].get("decode", "")
-            codes.append(pcode)
-            decodes.append(pdecode)
-            parent_ids.append(bc.get("id", ""))
+            pcode, pdecode = _standard_code(prop)
+            row = (
+                prop_id,
+                bc_id,
+                prop.get("name", ""),
+                prop.get("label", ""),
+                "",
+                prop.get("reference", ""),
+                pcode,
+                pdecode,
+            )
+            if with_catalog:
+                # A property is valid for the concept when its code is one of the catalog DECs
+                row += (catalog_bc_id, "dec" if pcode and pcode in dec_codes else "", "")
+            yield row
 
             # Extract ResponseCodes as child rows
             for rc in prop.get("responseCodes", []):
-                rc_id = rc.get("id", "")
-                ids.append(rc_id)
-                names.append(rc.get("name", ""))
-                labels.append(rc.get("label", ""))
-                synonyms.append("")
-                references.append("")
-                rccode = ""
-                rcdecode = ""
-                if "code" in rc:
-                    if "code" in rc["code"]:
-                        # Nested code object
-                        rccode = rc["code"].get("code", "")
-                        rcdecode = rc["code"].get("decode", "")
-                    else:
-                        rccode = rc["code"].get("code", "")
-                        rcdecode = rc["code"].get("decode", "")
-                codes.append(rccode)
-                decodes.append(rcdecode)
-                parent_ids.append(prop_id)
+                rc_code = rc.get("code") or {}
+                row = (
+                    rc.get("id", ""),
+                    prop_id,
+                    rc.get("name", ""),
+                    rc.get("label", ""),
+                    "",
+                    "",
+                    rc_code.get("code", ""),
+                    rc_code.get("decode", ""),
+                )
+                yield row + no_catalog if with_catalog else row
 
     # Extract bcSurrogates
-    for surr in surrogates:
-        ids.append(surr.get("id", ""))
-        names.append(surr.get("name", ""))
-        labels.append(surr.get("label", ""))
-        synonyms.append("")
-        references.append(surr.get("reference", ""))
-        codes.append("")
-        decodes.append("")
-        parent_ids.append("")
-
-    concepts = {
-        "id": ids,
-        "parent_id": parent_ids,
-        "name": names,
-        "label": labels,
-        "synonyms": synonyms,
-        "reference": references,
-        "code": codes,
-        "decode": decodes,
-    }
-
-    df = pd.DataFrame(concepts)
-    df = df[["id", "parent_id", "name", "label", "synonyms", "reference", "code", "decode"]]
-    df.to_csv(out_file, index=False)
-
-
-# All logic is now inside process_usdm_biomedical_concepts_to_csv. No top-level code is needed here.
+    for surr in version.get("bcSurrogates", []):
+        row = (
+            surr.get("id", ""),
+            "",
+            surr.get("name", ""),
+            surr.get("label", ""),
+            "",
+            surr.get("reference", ""),
+            "",
+            "",
+        )
+        yield row + no_catalog if with_catalog else row
+
+
+def biomedical_concept_columns(catalog=None):
+    return BC_COLUMNS + CATALOG_COLUMNS if catalog is not None else list(BC_COLUMNS)
+
+
+def _write_csv(rows, out_file: str, catalog=None):
+    with open(out_file, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(biomedical_concept_columns(catalog))
+        writer.writerows(rows)
+
+
+def _frame(rows, catalog=None):
+    import pandas as pd
+
+    columns = biomedical_concept_columns(catalog)
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    return df.astype({
+        col: "category" if col in CATEGORICAL_COLUMNS else "string" for col in columns
+    })
+
+
+def write_biomedical_concepts_csv(usdm: dict, out_file: str, catalog=None):
+    """Stream the concept rows of usdm straight into a CSV file."""
+    _write_csv(iter_biomedical_concept_rows(usdm, catalog), out_file, catalog)
+
+
+def biomedical_concepts_frame(usdm: dict, catalog=None):
+    """
+    Return the concept rows as a typed pandas DataFrame for downstream joins,
+    with CATEGORICAL_COLUMNS stored as categoricals and text as strings.
+    """
+    return _frame(iter_biomedical_concept_rows(usdm, catalog), catalog)
+
+
+def process_usdm_biomedical_concepts_to_csv(usdm_file: str, out_file: str, catalog=None,
+                                            output_format: str = "csv", report_file: str = None):
+    """
+    Process a USDM JSON file and output biomedical concepts to a CSV file.
+    Args:
+        usdm_file (str): Path to the input USDM JSON file.
+        out_file (str): Path to the output CSV file.
+        catalog (BcCatalog): Optional CDISC BC catalog (see bc_catalog.py). When
+            given, concepts are matched against it and catalog_bc_id,
+            catalog_match and catalog_categories columns are added.
+        output_format (str): "csv" (streamed) or "parquet" (columnar, typed
+            frame from biomedical_concepts_frame; requires pyarrow).
+        report_file (str): Where the time, rows and peak memory of the load,
+            derive and write stages are written (see instrumentation.py),
+            also when the run fails; defaults to <out_file stem>.run_report.json.
+    Raises:
+        FileNotFoundError: If usdm_file does not exist.
+        ValueError: If the format is not supported or usdm_file is not a
+            USDM document.
+    """
+    if output_format not in ("csv", "parquet"):
+        raise ValueError(f"Unsupported output format: {output_format}")
+    report = RunReport(usdm_file=usdm_file, output_format=output_format, catalog=catalog is not None)
+    try:
+        with report.stage("load"):
+            with open(usdm_file, "r") as file:
+                usdm = json.load(file)
+            study_versions(usdm)
+        # Rows are produced while being written, so the derive time is taken out of the write stage
+        derive = report.add_stage("derive", "BC")
+        with report.stage("write", "BC") as write:
+            rows = derive.time_rows(iter_biomedical_concept_rows(usdm, catalog))
+            if output_format == "parquet":
+                _frame(rows, catalog).to_parquet(out_file, index=False)
+            else:
+                _write_csv(rows, out_file, catalog)
+        write.subtract(derive)
+    finally:
+        report.write(report_file or f"{os.path.splitext(out_file)[0]}.{RUN_REPORT}")
@@ -0,0 +1,161 @@
+import argparse
+import importlib
+import sys
+
+DEFAULT_USDM_FILE = "files/usdm_sdw_v4.0.0_amendment.json"
+
+# Same as create_trial_design.DOMAINS, repeated so building the parser imports nothing
+DOMAINS = ["TA", "TE", "TV", "TI", "TS"]
+
+# Modules each subcommand needs, imported only when it runs. pandas, numpy,
+# xlrd, ijson and jsonata are imported further down, on the code paths that use them
+COMMAND_MODULES = {
+    "ta": ["create_ta_csv"],
+    "te": ["create_te_csv"],
+    "tv": ["create_tv_csv"],
+    "ti": ["create_ti_csv"],
+    "ts": ["create_ts_csv"],
+    "bc": ["biomedical_concepts", "bc_catalog"],
+    "soa": ["soa"],
+    "diff": ["usdm_diff"],
+    "serve": ["service"],
+    "all": ["create_trial_design"],
+}
+
+
+def import_command(command):
+    """Import and return the modules of a subcommand, in COMMAND_MODULES order."""
+    return [importlib.import_module(name) for name in COMMAND_MODULES[command]]
+
+
+def _run_domain(args):
+    (module,) = import_command(args.command)
+    module.main(args.usdm_file, args.output_file)
+
+
+def _run_ts(args):
+    (create_ts_csv,) = import_command("ts")
+    create_ts_csv.main(args.usdm_file, args.ts_spec_file, args.tsparm_spec_file, args.output_file)
+
+
+def _run_bc(args):
+    biomedical_concepts, bc_catalog = import_command("bc")
+    catalog = bc_catalog.load_bc_catalog(args.catalog_file) if args.catalog_file else None
+    try:
+        biomedical_concepts.process_usdm_biomedical_concepts_to_csv(args.usdm_file, args.out_file, catalog,
+                                                                    args.format)
+    except (OSError, ValueError) as e:
+        sys.exit(f"bc: error: {e}")
+
+
+def _run_soa(args):
+    (soa,) = import_command("soa")
+    try:
+        soa.main(args.usdm_file, args.output_file, args.layout, args.timeline, args.stream)
+    except ValueError as e:
+        sys.exit(f"soa: error: {e}")
+
+
+def _run_diff(args):
+    (usdm_diff,) = import_command("diff")
+    usdm_diff.main(args.old_file, args.new_file, args.old_version, args.new_version, args.domains, args.output_file,
+                   args.tsparm_spec_file)
+
+
+def _run_serve(args):
+    (service,) = import_command("serve")
+    service.main(args.host, args.port, args.workers, args.queue_size, args.max_tasks_per_child)
+
+
+def _run_all(args):
+    (create_trial_design,) = import_command("all")
+    create_trial_design.main(args.usdm_file, args.output_dir, args.domains, args.tsparm_spec_file,
+                             args.stream, args.all_designs, args.changed_only, args.derivations, args.validate,
+                             args.incremental, args.formats, args.profile)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Create SDTM trial design domains and biomedical concepts from USDM JSON.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for domain in DOMAINS[:4]:
+        command = commands.add_parser(domain.lower(), help=f"Create the {domain} domain CSV")
+        command.add_argument("--usdm_file", default=DEFAULT_USDM_FILE, help="Path to USDM JSON file")
+        command.add_argument("--output_file", default=f"output/{domain}.CSV", help=f"Path to output {domain} CSV file")
+        command.set_defaults(run=_run_domain)
+
+    command = commands.add_parser("ts", help="Create the TS domain CSV")
+    command.add_argument("--usdm_file", default=DEFAULT_USDM_FILE, help="Path to USDM JSON file")
+    command.add_argument("--output_file", default="output/TS.CSV", help="Path to output TS CSV file")
+    command.add_argument("--ts_spec_file", default="spec/TS_spec.csv", help="TS spec file")
+    command.add_argument("--tsparm_spec_file", default="spec/TSPARM_spec.csv", help="TSPARM spec file")
+    command.set_defaults(run=_run_ts)
+
+    command = commands.add_parser("bc", help="Create the biomedical concepts CSV")
+    command.add_argument("--usdm_file", default=DEFAULT_USDM_FILE, help="Path to USDM JSON file")
+    command.add_argument("--out_file", default="output/BC.CSV", help="Path to the output file")
+    # const is bc_catalog.DEFAULT_CATALOG_FILE
+    command.add_argument("--catalog_file", nargs="?", const="files/cdisc_biomedical_concepts_latest.csv",
+                         help="Match concepts against a CDISC biomedical concepts catalog CSV")
+    command.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                         help="Output format; parquet writes a typed, columnar file (requires pyarrow)")
+    command.set_defaults(run=_run_bc)
+
+    command = commands.add_parser("soa", help="Create the Schedule of Activities (activity x encounter) CSV")
+    command.add_argument("--usdm_file", default=DEFAULT_USDM_FILE, help="Path to USDM JSON file")
+    command.add_argument("--output_file", default="output/SOA.CSV", help="Path to output CSV file")
+    command.add_argument("--layout", choices=["grid", "long"], default="grid",
+                         help="grid: one row per activity and column per encounter; long: one row per scheduled activity")
+    command.add_argument("--timeline", help="With the grid layout, only this schedule timeline id (default: all timelines)")
+    command.add_argument("--stream", action="store_true", help="Parse only the activities, encounters and timelines of the USDM file")
+    command.set_defaults(run=_run_soa)
+
+    command = commands.add_parser("diff", help="Report the USDM objects and trial design rows changed between two versions")
+    command.add_argument("old_file", help="USDM JSON file before the change")
+    command.add_argument("new_file", nargs="?", help="USDM JSON file after the change (default: compare two versions of old_file)")
+    command.add_argument("--old_version", type=int, default=0, help="Index of the study version compared in old_file")
+    command.add_argument("--new_version", type=int,
+                         help="Index of the study version compared in new_file (default: 0, or the last version of old_file)")
+    command.add_argument("--domains", nargs="+", choices=DOMAINS, default=DOMAINS, help="Domains to compare (default: all)")
+    command.add_argument("--tsparm_spec_file", default="spec/TSPARM_spec.csv", help="TSPARM spec file")
+    command.add_argument("--output_file", help="Path to a JSON report of every change")
+    command.set_defaults(run=_run_diff)
+
+    # Defaults are service.DEFAULT_HOST and DEFAULT_PORT
+    command = commands.add_parser("serve", help="Serve conversions over HTTP from worker processes with warm caches")
+    command.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: localhost only)")
+    command.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    command.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    command.add_argument("--queue_size", type=int, default=None,
+                         help="Conversions accepted at once before requests are refused with 503 (default: twice the workers)")
+    command.add_argument("--max_tasks_per_child", type=int, default=None,
+                         help="Conversions a worker runs before it is recycled (default: never)")
+    command.set_defaults(run=_run_serve)
+
+    command = commands.add_parser("all", help="Create all trial design domains from one load of the USDM file")
+    command.add_argument("--usdm_file", default=DEFAULT_USDM_FILE, help="Path to USDM JSON file")
+    command.add_argument("--output_dir", default="output", help="Directory for the <DOMAIN>.CSV files")
+    command.add_argument("--domains", nargs="+", choices=DOMAINS, default=DOMAINS, help="Domains to create (default: all)")
+    command.add_argument("--tsparm_spec_file", default="spec/TSPARM_spec.csv", help="TSPARM spec file")
+    command.add_argument("--stream", action="store_true", help="Parse only the parts of the USDM file the domains read")
+    command.add_argument("--all_designs", action="store_true", help="Cover every study version and design, keyed by VERSID/DESIGNID")
+    command.add_argument("--changed_only", action="store_true", help="With --all_designs, skip designs unchanged since the previous version")
+    command.add_argument("--derivations", help="JSON file of custom JSONata derivations per domain and variable")
+    command.add_argument("--validate", choices=["full", "subset"], help="Check the USDM file against the schema first, all of it or only what the domains read")
+    command.add_argument("--incremental", action="store_true", help="Only rewrite domains whose part of the USDM file, spec or options changed since the last run")
+    command.add_argument("--formats", nargs="+", choices=["csv", "json", "xpt"], default=["csv"], help="Output formats: csv (<DOMAIN>.CSV), json (Dataset-JSON), xpt (SAS V5 transport)")
+    command.add_argument("--profile", action="store_true", help="Write cProfile stats of the load and of each domain to <output_dir>/profile")
+    command.set_defaults(run=_run_all)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "all" and args.changed_only and not args.all_designs:
+        parser.error("--changed_only requires --all_designs")
+    args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
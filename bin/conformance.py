@@ -0,0 +1,263 @@
+import json
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from row_records import as_record, is_record, record_type
+from spec_mapping import read_domain_spec
+
+# row is the 1-based position of the record in the domain
+# rule is one of: "required", "numeric", "length", "bytes", "charset", "code"
+Violation = namedtuple("Violation", ["domain", "variable", "row", "rule", "value", "detail"])
+
+ConformanceResult = namedtuple("ConformanceResult", ["rows", "violations"])
+
+# Rows normalized and checked together by conform_stream
+CHUNK_SIZE = 10000
+
+# SAS V5 transport limit for character values
+MAX_TEXT_BYTES = 200
+
+# Variables with a shorter limit (characters) than MAX_TEXT_BYTES
+MAX_LENGTHS = {
+    "ARMCD": 20,
+    "ACTARMCD": 20,
+    "ETCD": 8,
+    "TSPARMCD": 8,
+    "TSPARM": 40,
+}
+
+# --TESTCD / --TEST are limited like TSPARMCD / TSPARM
+_TESTCD_LENGTH = 8
+_TEST_LENGTH = 40
+
+# Short codes: letters, digits and underscores, not starting with a digit
+_CODE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_PRINTABLE_ASCII = re.compile(r"[\x20-\x7E]*")
+
+# Text normalization: special and control whitespace to spaces, typographic quotes to plain
+# ones, double quotes dropped
+_TEXT = str.maketrans({
+    "\t": " ", "\n": " ", "\r": " ",
+    "\u00A0": " ", "\u2007": " ", "\u202F": " ",
+    "\u200B": " ", "\uFEFF": " ",
+    "\u2018": "'", "\u2019": "'",
+    "\u201C": None, "\u201D": None, '"': None,
+})
+
+
+def normalize_text(value):
+    """Normalized text of one value; see normalize_column."""
+    return value.translate(_TEXT).strip() if isinstance(value, str) else value
+
+
+def normalize_column(values):
+    """
+    Normalize a character column: special whitespace (non-breaking, zero
+    width, tabs and line breaks) becomes a space, typographic single quotes
+    plain ones, double quotes are dropped and values are stripped. Values
+    that are not strings are returned unchanged.
+    """
+    translate = str.translate
+    return [translate(v, _TEXT).strip() if v.__class__ is str else v for v in values]
+
+
+def _max_length(name):
+    if name in MAX_LENGTHS:
+        return MAX_LENGTHS[name]
+    if name.endswith("TESTCD"):
+        return _TESTCD_LENGTH
+    if name.endswith("TEST"):
+        return _TEST_LENGTH
+    return None
+
+
+def _is_code(name):
+    return name.endswith("TESTCD") or name == "TSPARMCD"
+
+
+def _is_number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return True
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+@lru_cache(maxsize=None)
+def column_rules(spec_file):
+    """
+    Checks for each variable of a domain spec, from its Type and Core columns.
+    Returns:
+        dict: variable -> {"numeric", "required", "max_length", "code"}.
+    """
+    rules = {}
+    for variable in read_domain_spec(spec_file):
+        name = variable["name"]
+        rules[name] = {
+            "numeric": variable["type"].strip().lower() == "num",
+            "required": variable["core"].strip().lower() == "req",
+            "max_length": _max_length(name),
+            "code": _is_code(name),
+        }
+    return rules
+
+
+def check_column(domain, name, values, rules):
+    """
+    Violations of one normalized column. Each rule is a single pass over
+    the column; the common case (a valid value) costs one C-level check.
+    """
+    violations = []
+    if rules["required"]:
+        violations.extend(
+            Violation(domain, name, i, "required", v, "required value is missing")
+            for i, v in enumerate(values, 1) if v is None or v == ""
+        )
+    present = [(i, v) for i, v in enumerate(values, 1) if v is not None and v != ""]
+    if rules["numeric"]:
+        violations.extend(
+            Violation(domain, name, i, "numeric", v, "value is not numeric")
+            for i, v in present if not _is_number(v)
+        )
+        return violations
+    text = [(i, v) for i, v in present if v.__class__ is str]
+    max_length = rules["max_length"]
+    if max_length is not None:
+        violations.extend(
+            Violation(domain, name, i, "length", v, f"longer than {max_length} characters")
+            for i, v in text if len(v) > max_length
+        )
+    # Only non-ASCII text can be longer in bytes than in characters
+    violations.extend(
+        Violation(domain, name, i, "bytes", v, f"longer than {MAX_TEXT_BYTES} bytes")
+        for i, v in text if len(v) > MAX_TEXT_BYTES or (not v.isascii() and len(v.encode()) > MAX_TEXT_BYTES)
+    )
+    violations.extend(
+        Violation(domain, name, i, "charset", v, "contains characters outside printable ASCII")
+        for i, v in text if not (v.isascii() and _PRINTABLE_ASCII.fullmatch(v))
+    )
+    if rules["code"]:
+        violations.extend(
+            Violation(domain, name, i, "code", v, "not letters, digits and underscores starting with a letter")
+            for i, v in text if not _CODE.fullmatch(v)
+        )
+    return violations
+
+
+def conform(domain, rows, columns, spec_file):
+    """
+    Normalize and check a whole domain table column by column.
+    Character columns (Type Char in the spec, or not in the spec) are
+    normalized with normalize_column; every spec variable is then checked
+    for Req values, numeric Num values, SDTM length limits and the
+    character set of SAS V5 transport files.
+    Args:
+        domain (str): Domain code used in the violations.
+        rows (list): One record per row (see row_records.py), or dicts
+            keyed by variable name.
+        columns (list): Variables written for the domain.
+        spec_file (str): Domain spec CSV giving each variable's Type and Core.
+    Returns:
+        ConformanceResult: The normalized rows, as new records of columns,
+        and the list of Violation found, by column then row.
+    """
+    rules = column_rules(spec_file)
+    record = record_type(columns)
+    if rows and is_record(rows[0], columns):
+        # Records already in column order are transposed in one step
+        table = dict(zip(columns, map(list, zip(*rows))))
+    else:
+        rows = [as_record(record, row) for row in rows]
+        table = dict(zip(columns, map(list, zip(*rows)))) if rows else {name: [] for name in columns}
+    violations = []
+    for name in columns:
+        rule = rules.get(name)
+        if rule is None or not rule["numeric"]:
+            table[name] = normalize_column(table[name])
+        if rule is not None:
+            violations.extend(check_column(domain, name, table[name], rule))
+    normalized = list(map(record._make, zip(*(table[name] for name in columns)))) if rows else []
+    return ConformanceResult(normalized, violations)
+
+
+def conform_stream(domain, rows, columns, spec_file, violations=None, chunk_size=CHUNK_SIZE):
+    """
+    Generator form of conform for rows that are themselves generated: rows
+    are normalized and checked chunk_size at a time, so only one chunk is
+    held in memory, and yielded in order. Violations (with row numbers
+    counted over the whole domain) are appended to violations.
+    """
+    chunk = []
+    offset = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from _conform_chunk(domain, chunk, columns, spec_file, violations, offset)
+            offset += len(chunk)
+            chunk = []
+    if chunk:
+        yield from _conform_chunk(domain, chunk, columns, spec_file, violations, offset)
+
+
+def _conform_chunk(domain, rows, columns, spec_file, violations, offset):
+    result = conform(domain, rows, columns, spec_file)
+    if violations is not None:
+        violations.extend(v._replace(row=v.row + offset) if offset else v for v in result.violations)
+    return result.rows
+
+
+def summarize(violations, examples=3):
+    """
+    Group violations by domain, variable and rule.
+    Returns:
+        list: dicts with "domain", "variable", "rule", "count", "detail" and
+        the first few "rows", in the order they were first found.
+    """
+    groups = {}
+    for violation in violations:
+        key = (violation.domain, violation.variable, violation.rule)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "domain": violation.domain, "variable": violation.variable, "rule": violation.rule,
+                "count": 0, "detail": violation.detail, "rows": [],
+            }
+        group["count"] += 1
+        if len(group["rows"]) < examples:
+            group["rows"].append(violation.row)
+    return list(groups.values())
+
+
+def print_summary(violations):
+    for group in summarize(violations):
+        rows = ", ".join(str(row) for row in group["rows"])
+        more = ", ..." if group["count"] > len(group["rows"]) else ""
+        print(f"Conformance: {group['domain']}.{group['variable']} {group['rule']}: {group['detail']} "
+              f"({group['count']} record(s): {rows}{more})")
+
+
+def write_report(report_file, domains, violations):
+    """
+    Write violations to a JSON report mapping each domain to its list of
+    violations. Entries of domains not in domains (e.g. skipped by an
+    incremental run) are kept from an existing report.
+    """
+    report = {}
+    if os.path.exists(report_file):
+        try:
+            with open(report_file) as f:
+                report = json.load(f)
+        except ValueError:
+            report = {}
+    for domain in domains:
+        report[domain] = []
+    for violation in violations:
+        report.setdefault(violation.domain, []).append(violation._asdict())
+    tmp_file = report_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_file, report_file)
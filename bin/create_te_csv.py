@@ -1,49 +1,51 @@
-import csv
-import json
+from conformance import conform, print_summary
+from spec_mapping import DomainMapping
+from study_context import load_study_context, write_domain_csv
 
 COLUMNS = [
     "STUDYID","DOMAIN","ETCD","ELEMENT","TESTRL","TEENRL","TEDUR"
 ]
 
+# Parts of the USDM document this domain reads
+USDM_SUBTREES = [
+    "study.versions[*].studyDesigns[*].elements",
+    "study.versions[*].studyDesigns[*].epochs",
+    "study.versions[*].studyDesigns[*].studyCells",
+    "study.versions[*].studyDesigns[*].scheduleTimelines",
+]
+
+SPEC_FILE = "spec/TE_spec.csv"
+
+# One row per study element
+ROW_PATH = "Study/@versions/StudyVersion/@studyDesigns/StudyDesign/@elements/StudyElement"
+
+def _tedur(ctx, row):
+    # From the start of the element's epochs to the start of the next epoch
+    return ctx.timelines.element_duration(row["StudyElement"]["id"]) or ""
+
+DERIVATIONS = {
+    "TEDUR": _tedur,
+}
+
+def domain_mapping(spec_file=SPEC_FILE, derivations=None):
+    return DomainMapping(spec_file, ROW_PATH, DERIVATIONS, overrides=derivations)
+
+
+def iter_rows(ctx, spec_file=SPEC_FILE, derivations=None):
+    return domain_mapping(spec_file, derivations).iter_rows(ctx)
+
+
+def build_rows(ctx, spec_file=SPEC_FILE, derivations=None):
+    return list(iter_rows(ctx, spec_file, derivations))
+
+def write_csv(ctx, output_file):
+    # Shared text normalization and SDTM checks, see conformance.py
+    result = conform("TE", build_rows(ctx), COLUMNS, SPEC_FILE)
+    print_summary(result.violations)
+    write_domain_csv(output_file, COLUMNS, result.rows)
+
 def main(usdm_file, output_file):
-    with open(usdm_file) as f:
-        usdm = json.load(f)
-
-    study_version = usdm["study"]["versions"][0]
-    study_id = ''
-    if "studyIdentifiers" in study_version and study_version["studyIdentifiers"]:
-        study_id = study_version["studyIdentifiers"][0].get("text", "")
-
-    study_design = study_version["studyDesigns"][0] if study_version.get("studyDesigns") else {}
-    elements = study_design.get("elements", [])
-
-    rows = []
-    import re
-    for element in elements:
-        testrl = (element.get("transitionStartRule") or {}).get("text", "")
-        teenrl = (element.get("transitionEndRule") or {}).get("text", "")
-        # Remove non-breaking spaces and other special whitespace
-        testrl = re.sub(r'[\u00A0\u200B\u202F\uFEFF]', ' ', testrl)
-        teenrl = re.sub(r'[\u00A0\u200B\u202F\uFEFF]', ' ', teenrl)
-        # Remove all double quotes and strip whitespace
-        testrl = testrl.replace('"', '').strip()
-        teenrl = teenrl.replace('"', '').strip()
-        row = {
-            "STUDYID": study_id,
-            "DOMAIN": "TE",
-            "ETCD": element.get("name", ""),
-            "ELEMENT": element.get("description", ""),
-            "TESTRL": testrl,
-            "TEENRL": teenrl,
-            "TEDUR": ""  # Not implemented: requires scheduleTimelines traversal
-        }
-        rows.append(row)
-
-    with open(output_file, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=COLUMNS)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
+    write_csv(load_study_context(usdm_file), output_file)
 
 if __name__ == "__main__":
     main('files/usdm_sdw_v4.0.0_amendment.json', 'output/TE.CSV')
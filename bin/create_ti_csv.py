@@ -1,5 +1,6 @@
-import csv
-import json
+from conformance import conform, print_summary
+from spec_mapping import DomainMapping
+from study_context import load_study_context, write_domain_csv
 
 COLUMNS = [
     "STUDYID",
@@ -12,83 +13,78 @@ COLUMNS = [
     "TIVERS",
 ]
 
+# Parts of the USDM document this domain reads
+USDM_SUBTREES = [
+    "study.versions[*].studyDesigns[*].population",
+    "study.versions[*].studyDesigns[*].eligibilityCriteria",
+    "study.versions[*].documentVersionIds",
+    "study.documentedBy",
+]
+
+
+SPEC_FILE = "spec/TI_spec.csv"
+
+# One row per eligibility criterion of the population and its cohorts
+ROW_PATH = (
+    "Study/@versions/StudyVersion/@studyDesigns/StudyDesign/@population(/StudyDesignPopulation/@cohorts)"
+    "/StudyDesignPopulation|StudyCohort/@criteria/EligibilityCriteria"
+)
+
+
+def _ietestcd(identifier):
+    identifier = identifier or ""
+    return identifier if identifier.startswith("IE") else f"IE{identifier}"
+
+
+def _iecat(decode):
+    decode = (decode or "").lower()
+    if decode.startswith("inclusion"):
+        return "INCLUSION"
+    if decode.startswith("exclusion"):
+        return "EXCLUSION"
+    return ""
+
+
+def _ietest(ctx, row):
+    # The criterion label, without an 'IE' prefix
+    ietest = row["EligibilityCriteria"].get("label", "")
+    return ietest[2:] if ietest.startswith("IE") else ietest
+
+
+# Protocol version: static string for now as cannot determine from where this is mapped.
+DERIVATIONS = {
+    "IETEST": _ietest,
+    "TIRL": lambda ctx, row: row["EligibilityCriteria"].get("label", ""),
+    "TIVERS": lambda ctx, row: "1",
+}
+
+TRANSFORMS = {
+    "IETESTCD": _ietestcd,
+    "IECAT": _iecat,
+}
+
+
+def domain_mapping(spec_file=SPEC_FILE, derivations=None):
+    return DomainMapping(spec_file, ROW_PATH, DERIVATIONS, TRANSFORMS, overrides=derivations)
+
+
+def iter_rows(ctx, spec_file=SPEC_FILE, derivations=None):
+    return domain_mapping(spec_file, derivations).iter_rows(ctx)
+
+
+def build_rows(ctx, spec_file=SPEC_FILE, derivations=None):
+    return list(iter_rows(ctx, spec_file, derivations))
+
+
+def write_csv(ctx, output_file):
+    # Shared text normalization and SDTM checks, see conformance.py
+    result = conform("TI", build_rows(ctx), COLUMNS, SPEC_FILE)
+    print_summary(result.violations)
+    write_domain_csv(output_file, COLUMNS, result.rows)
+
 
 def main(usdm_file, output_file):
-    with open(usdm_file) as f:
-        usdm = json.load(f)
-
-    study_version = usdm["study"]["versions"][0]
-    study_id = ""
-    if "studyIdentifiers" in study_version and study_version["studyIdentifiers"]:
-        study_id = study_version["studyIdentifiers"][0].get("text", "")
-
-    study_design = (
-        study_version["studyDesigns"][0] if study_version.get("studyDesigns") else {}
-    )
-    population = study_design.get("population", {})
-    criterion_ids = population.get("criterionIds", [])
-    eligibility_criteria = {
-        ec["id"]: ec for ec in study_design.get("eligibilityCriteria", [])
-    }
-    # Get protocol version from documentVersionIds
-    doc_version_ids = study_version.get("documentVersionIds", [])
-    doc_versions = {}
-    for doc in usdm.get("study", {}).get("documentVersions", []):
-        doc_versions[doc.get("id")] = doc
-    # Fallback: scan all top-level keys for StudyDefinitionDocumentVersion objects
-    if not doc_versions:
-        for k, v in usdm.items():
-            if isinstance(v, list):
-                for item in v:
-                    if (
-                        isinstance(item, dict)
-                        and item.get("instanceType") == "StudyDefinitionDocumentVersion"
-                    ):
-                        doc_versions[item.get("id")] = item
-    tivers = "1"  # Static string for now as cannot determine from where this is mapped.
-    """
-    for doc_id in doc_version_ids:
-        doc = doc_versions.get(doc_id)
-        if doc and doc.get("version"):
-            tivers = doc["version"]
-            break
-    """
-    rows = []
-    for cid in criterion_ids:
-        crit = eligibility_criteria.get(cid, {})
-        decode = (
-            crit.get("category", {}).get("decode", "") if crit.get("category") else ""
-        )
-        if decode.lower().startswith("inclusion"):
-            iecat = "INCLUSION"
-        elif decode.lower().startswith("exclusion"):
-            iecat = "EXCLUSION"
-        else:
-            iecat = ""
-        ietest = crit.get("label", "")
-        ietestcd = crit.get("identifier", "")
-        if not ietestcd.startswith("IE"):
-            ietestcd = f"IE{ietestcd}"
-        # Remove 'IE' prefix from IETEST if present
-        if ietest.startswith("IE"):
-            ietest = ietest[2:]
-        row = {
-            "STUDYID": study_id,
-            "DOMAIN": "TI",
-            "IETESTCD": ietestcd,
-            "IETEST": ietest,
-            "IECAT": iecat,
-            "IESCAT": "",  # Not available in USDM
-            "TIRL": crit.get("label", ""),
-            "TIVERS": tivers,
-        }
-        rows.append(row)
-
-    with open(output_file, "w", newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=COLUMNS)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
+    write_csv(load_study_context(usdm_file), output_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,310 @@
+import os
+
+import create_ta_csv
+import create_te_csv
+import create_ti_csv
+import create_ts_csv
+import create_tv_csv
+from conformance import conform_stream, print_summary, write_report
+from incremental import (document_hash, inputs_fingerprint, is_current, load_manifest, record, save_manifest,
+                         subtree_fingerprint)
+from instrumentation import RUN_REPORT, RunReport
+from output_sinks import DATASET_LABELS, SINKS, Dataset, check_dataset, dataset_columns, output_file_name, write_dataset
+from row_records import as_record, is_record, record_type
+from study_context import STUDY_SUBTREES, StudyContext, iter_study_contexts, load_document
+from terminology import DEFAULT_TERMINOLOGY_FILES
+
+# Trial design domains in the order they are written
+DOMAINS = ["TA", "TE", "TV", "TI", "TS"]
+
+DOMAIN_SUBTREES = {
+    "TA": create_ta_csv.USDM_SUBTREES,
+    "TE": create_te_csv.USDM_SUBTREES,
+    "TV": create_tv_csv.USDM_SUBTREES,
+    "TI": create_ti_csv.USDM_SUBTREES,
+    "TS": create_ts_csv.USDM_SUBTREES,
+}
+
+DOMAIN_SPEC_FILES = {
+    "TA": create_ta_csv.SPEC_FILE,
+    "TE": create_te_csv.SPEC_FILE,
+    "TV": create_tv_csv.SPEC_FILE,
+    "TI": create_ti_csv.SPEC_FILE,
+    "TS": create_ts_csv.TS_SPEC_FILE,
+}
+
+DOMAIN_COLUMNS = {
+    "TA": create_ta_csv.COLUMNS,
+    "TE": create_te_csv.COLUMNS,
+    "TV": create_tv_csv.COLUMNS,
+    "TI": create_ti_csv.COLUMNS,
+    "TS": create_ts_csv.TS_COLUMNS,
+}
+
+# Leading columns identifying the study version and design of each row
+KEY_COLUMNS = ["VERSID", "DESIGNID"]
+
+# Conformance violations of the written domains, see conformance.write_report
+CONFORMANCE_REPORT = "conformance.json"
+
+# Subdirectory of the output directory receiving the cProfile stats of a profiled run
+PROFILE_DIR = "profile"
+
+# Schema errors printed before a failed validation is raised
+MAX_REPORTED_ERRORS = 20
+
+
+def check_domains(domains):
+    """Upper-cased domain codes, defaulting to all of DOMAINS."""
+    domains = [d.upper() for d in (domains or DOMAINS)]
+    unknown = [d for d in domains if d not in DOMAINS]
+    if unknown:
+        raise ValueError(f"Unknown trial design domain(s): {', '.join(unknown)}")
+    return domains
+
+
+def iter_domain_rows(ctx, domain, tsparm_spec_file="spec/TSPARM_spec.csv", derivations=None):
+    if domain == "TA":
+        return create_ta_csv.iter_rows(ctx, derivations=derivations)
+    if domain == "TE":
+        return create_te_csv.iter_rows(ctx, derivations=derivations)
+    if domain == "TV":
+        return create_tv_csv.iter_rows(ctx, derivations=derivations)
+    if domain == "TI":
+        return create_ti_csv.iter_rows(ctx, derivations=derivations)
+    return create_ts_csv.iter_rows(ctx, tsparm_spec_file, derivations=derivations)
+
+
+def domain_mapping(domain, derivations=None):
+    """The DomainMapping of a domain (see spec_mapping.py), None for TS, which is derived per parameter."""
+    if domain == "TA":
+        return create_ta_csv.domain_mapping(derivations=derivations)
+    if domain == "TE":
+        return create_te_csv.domain_mapping(derivations=derivations)
+    if domain == "TV":
+        return create_tv_csv.domain_mapping(derivations=derivations)
+    if domain == "TI":
+        return create_ti_csv.domain_mapping(derivations=derivations)
+    return None
+
+
+def domain_columns(domain, keyed=False):
+    """Variables written for a domain, led by KEY_COLUMNS when keyed."""
+    return KEY_COLUMNS + DOMAIN_COLUMNS[domain] if keyed else DOMAIN_COLUMNS[domain]
+
+
+def domain_rows(contexts, domain, tsparm_spec_file="spec/TSPARM_spec.csv", keyed=False, derivations=None):
+    """Rows of a domain over every context, generated one at a time as records of domain_columns."""
+    row_type = record_type(domain_columns(domain, keyed))
+    for ctx in contexts:
+        key = (ctx.version_id, ctx.design_id) if keyed else ()
+        for row in iter_domain_rows(ctx, domain, tsparm_spec_file, derivations):
+            if is_record(row, DOMAIN_COLUMNS[domain]):
+                # Key values are prepended to the tuple, no per-row dict
+                yield row_type._make(key + row) if keyed else row
+            else:
+                fields = row._asdict() if hasattr(row, "_fields") else row
+                yield as_record(row_type, {**dict(zip(KEY_COLUMNS, key)), **fields})
+
+
+def write_domains(contexts, output_dir, domains=None, tsparm_spec_file="spec/TSPARM_spec.csv", keyed=False,
+                  derivations=None, violations=None, formats=("csv",), report=None):
+    """
+    Write every requested trial design domain from shared StudyContexts.
+    Rows stream from the extraction through the conformance checks (see
+    conformance.py) into one sink per output format (see output_sinks.py),
+    so every format comes from the same single extraction.
+    Args:
+        contexts (list): StudyContext objects, one per study version/design.
+        output_dir (str): Directory receiving the domain files.
+        domains (list): Domain codes to write, defaults to all of DOMAINS.
+        tsparm_spec_file (str): Path to the TSPARM spec used for TS.
+        keyed (bool): Prefix each row with its VERSID and DESIGNID.
+        derivations (dict): Custom derivations per domain and variable, as
+            returned by jsonata_derivations.load_derivations.
+        violations (list): Receives the conformance Violations of every
+            written domain.
+        formats (list): Output formats from output_sinks.SINKS: "csv"
+            (<DOMAIN>.CSV), "json" (Dataset-JSON) and "xpt" (SAS V5 transport).
+        report (RunReport): Receives a "derive" and a "write" stage per
+            domain (see instrumentation.py); the derive stage times producing
+            and checking the rows, the write stage the rest.
+    Returns:
+        dict: Mapping of domain code to the file of the first format.
+    """
+    domains = check_domains(domains)
+    os.makedirs(output_dir, exist_ok=True)
+    study_id = contexts[0].study_id if contexts else ""
+    report = report or RunReport(sample_interval=None)
+    datasets = {}
+    for domain in domains:
+        columns = dataset_columns(domain_columns(domain, keyed), DOMAIN_SPEC_FILES[domain])
+        datasets[domain] = Dataset(domain, DATASET_LABELS[domain], columns, study_id)
+        # Fail before the first domain is written rather than leave a partial set
+        check_dataset(datasets[domain], formats)
+    written = {}
+    for domain, dataset in datasets.items():
+        columns = [column.name for column in dataset.columns]
+        spec_file = DOMAIN_SPEC_FILES[domain]
+        # Rows are produced lazily while being written, so the derive time is taken out of the write stage
+        derive = report.add_stage("derive", domain)
+        with report.stage("write", domain, profile=True) as write:
+            rows = domain_rows(contexts, domain, tsparm_spec_file, keyed, (derivations or {}).get(domain))
+            rows = derive.time_rows(conform_stream(domain, rows, columns, spec_file, violations))
+            files = write_dataset(rows, dataset, output_dir, formats)
+        write.subtract(derive)
+        written[domain] = files[formats[0]]
+    return written
+
+
+def domain_subtrees(domains=None):
+    """Union of the USDM subtrees read by the given domains."""
+    subtrees = []
+    for domain in domains or DOMAINS:
+        for path in DOMAIN_SUBTREES[domain.upper()]:
+            if path not in subtrees:
+                subtrees.append(path)
+    return subtrees
+
+
+def domain_input_files(domain, tsparm_spec_file="spec/TSPARM_spec.csv"):
+    """Spec and terminology files a domain's output depends on, besides the USDM document."""
+    if domain == "TS":
+        return [DOMAIN_SPEC_FILES["TS"], tsparm_spec_file] + DEFAULT_TERMINOLOGY_FILES
+    return [DOMAIN_SPEC_FILES[domain]]
+
+
+def main(usdm_file, output_dir, domains=None, tsparm_spec_file="spec/TSPARM_spec.csv",
+         stream=False, all_designs=False, changed_only=False, derivations_file=None, validate=None,
+         incremental=False, formats=("csv",), profile=False):
+    """
+    Load usdm_file once and write the requested domains to output_dir.
+    Args:
+        stream (bool): Parse only the subtrees the domains read.
+        all_designs (bool): Cover every study version and design instead of
+            versions[0]/studyDesigns[0]; rows are keyed by VERSID/DESIGNID.
+        changed_only (bool): With all_designs, skip designs identical to the
+            same design in the previous version.
+        derivations_file (str): JSON file of custom JSONata derivations per
+            domain and variable (see jsonata_derivations.py).
+        validate (str): Check the document against the USDM schema before
+            extraction, "full" for the whole document or "subset" for only
+            the subtrees the domains read (see usdm_schema.py).
+        incremental (bool): Only rewrite domains whose inputs changed since
+            the run recorded in output_dir's manifest (see incremental.py).
+        formats (list): Output formats, see write_domains.
+        profile (bool): Also run the load and each domain under cProfile,
+            writing <name>.prof and a <name>.txt summary to output_dir/profile.
+    Conformance violations are printed and written to conformance.json in
+    output_dir. The time, rows and peak memory of each stage of the run
+    (load, validate, contexts, then derive and write per domain) are
+    written to run_report.json in output_dir, also when the run fails.
+    Returns:
+        dict: Mapping of domain code to the output file written in this run.
+    Raises:
+        ValueError: If validation finds schema errors.
+    """
+    domains = check_domains(domains)
+    formats = list(formats or ["csv"])
+    unknown = [f for f in formats if f not in SINKS]
+    if unknown:
+        raise ValueError(f"Unknown output format(s): {', '.join(unknown)}")
+    derivations = None
+    if derivations_file:
+        from jsonata_derivations import TIMINGS, load_derivations
+
+        derivations = load_derivations(derivations_file)
+        if stream:
+            # Expressions may navigate anywhere in the document
+            print("Note: --stream is ignored when custom derivations are given")
+            stream = False
+    if validate == "full" and stream:
+        print("Note: --stream is ignored with full validation")
+        stream = False
+
+    skipped = []
+    if incremental:
+        # An unchanged document and unchanged inputs skip a domain without parsing anything
+        manifest = load_manifest(output_dir)
+        document = document_hash(usdm_file, manifest)
+        options = {"keyed": all_designs, "changed_only": changed_only, "formats": formats}
+        extra_files = [derivations_file] if derivations_file else []
+        inputs = {
+            domain: inputs_fingerprint(domain_input_files(domain, tsparm_spec_file) + extra_files, options)
+            for domain in domains
+        }
+        data = {}
+        skipped = [d for d in domains if is_current(manifest, output_dir, d, inputs[d], document=document)]
+        domains = [d for d in domains if d not in skipped]
+
+    written = {}
+    contexts = []
+    violations = []
+    report = RunReport(os.path.join(output_dir, PROFILE_DIR) if profile else None, usdm_file=usdm_file,
+                       formats=formats, all_designs=all_designs, incremental=incremental)
+    if derivations:
+        TIMINGS.clear()
+    try:
+        if domains:
+            with report.stage("load", profile=True):
+                usdm = load_document(usdm_file, domain_subtrees(domains) if stream else None)
+            if validate:
+                from usdm_schema import validate_usdm
+
+                with report.stage("validate"):
+                    errors = validate_usdm(usdm, domain_subtrees(domains) if validate == "subset" else None)
+                    for error in errors[:MAX_REPORTED_ERRORS]:
+                        print(f"Schema error at {error.path}: {error.message}")
+                    if errors:
+                        raise ValueError(f"{usdm_file} failed {validate} schema validation with {len(errors)} "
+                                         f"error(s), first at {errors[0].path}: {errors[0].message}")
+            if incremental:
+                # Otherwise compare only the parts of the document each domain reads
+                data = {
+                    # Custom derivations may read anything, so only the whole document vouches for them
+                    domain: document if domain in (derivations or {})
+                    else subtree_fingerprint(usdm, STUDY_SUBTREES + DOMAIN_SUBTREES[domain])
+                    for domain in domains
+                }
+                unchanged = [d for d in domains if is_current(manifest, output_dir, d, inputs[d], data=data[d])]
+                skipped.extend(unchanged)
+                domains = [d for d in domains if d not in unchanged]
+            with report.stage("contexts") as stage:
+                if all_designs:
+                    contexts = list(iter_study_contexts(usdm, changed_only))
+                else:
+                    contexts = [StudyContext(usdm)]
+                stage.rows = len(contexts)
+            if domains:
+                written = write_domains(contexts, output_dir, domains, tsparm_spec_file, keyed=all_designs,
+                                        derivations=derivations, violations=violations, formats=formats,
+                                        report=report)
+                write_report(os.path.join(output_dir, CONFORMANCE_REPORT), written, violations)
+    finally:
+        if derivations:
+            report.extra["derivations"] = TIMINGS.report()
+        report.extra["skipped"] = sorted(skipped, key=DOMAINS.index)
+        report.extra["violations"] = len(violations)
+        report.write(os.path.join(output_dir, RUN_REPORT))
+    print_summary(violations)
+    for ctx in contexts:
+        for diagnostic in ctx.diagnostics:
+            print(f"Warning: {diagnostic.kind} {diagnostic.id or ''}: {diagnostic.detail}")
+    if derivations:
+        for timing in TIMINGS.report():
+            flag = "  (slow)" if timing["slow"] else ""
+            print(f"Derivation {timing['expression']!r}: {timing['calls']} calls, {timing['seconds']}s{flag}")
+    if incremental:
+        for domain in skipped + list(written):
+            output_file = os.path.join(output_dir, output_file_name(domain, formats[0]))
+            record(manifest, domain, output_file, inputs[domain], document,
+                   data.get(domain) if domain in data else manifest["domains"][domain]["data"])
+        os.makedirs(output_dir, exist_ok=True)
+        save_manifest(output_dir, manifest)
+        if skipped:
+            print(f"Unchanged, skipped: {', '.join(sorted(skipped, key=DOMAINS.index))}")
+    return written
+
+
+if __name__ == "__main__":
+    main("files/usdm_sdw_v4.0.0_amendment.json", "output")
@@ -1,152 +1,108 @@
 
 import csv
-import json
-import pandas as pd
+from functools import lru_cache
+
+from conformance import conform, print_summary
+from row_records import as_record, record_type
+from study_context import load_study_context, write_domain_csv
+from terminology import default_terminology
+from ts_parameters import CDISC_CT, TS_DERIVATIONS, VALUE_CODELISTS, StudyFacts, value
 
 TS_COLUMNS = [
     "STUDYID","DOMAIN","TSSEQ","TSGRPID","TSPARMCD","TSPARM","TSVAL","TSVALNF","TSVALCD","TSVCDREF","TSVCDVER"
 ]
 
-# Helper to safely get nested values from dicts/lists
-def get_nested(data, path):
-    keys = path.split('.')
-    for key in keys:
-        if isinstance(data, list):
-            try:
-                data = data[0]
-            except IndexError:
-                return ''
-        if isinstance(data, dict):
-            data = data.get(key, '')
-        else:
-            return ''
-    return data if not isinstance(data, (dict, list)) else ''
-
-# Load TSPARM spec for mapping
+# One TS record, see row_records.py
+TS_ROW = record_type(TS_COLUMNS)
+
+# Type and Core of each TS variable, used by the conformance checks
+TS_SPEC_FILE = "spec/TS_spec.csv"
+
+# Parts of the USDM document this domain reads
+USDM_SUBTREES = [
+    "study.versions[*].studyDesigns[*].characteristics",
+    "study.versions[*].studyDesigns[*].population",
+    "study.versions[*].studyDesigns[*].indications",
+    "study.versions[*].studyDesigns[*].arms",
+    "study.versions[*].studyDesigns[*].objectives",
+    "study.versions[*].studyDesigns[*].studyType",
+    "study.versions[*].studyDesigns[*].studyPhase",
+    "study.versions[*].studyDesigns[*].therapeuticAreas",
+    "study.versions[*].studyDesigns[*].subTypes",
+    "study.versions[*].studyDesigns[*].intentTypes",
+    "study.versions[*].studyDesigns[*].model",
+    "study.versions[*].studyDesigns[*].blindingSchema",
+    "study.versions[*].studyDesigns[*].studyInterventionIds",
+    "study.versions[*].studyDesigns[*].scheduleTimelines[*].plannedDuration",
+    "study.versions[*].studyInterventions",
+    "study.versions[*].administrableProducts",
+    "study.versions[*].organizations",
+    "study.versions[*].titles",
+]
 
+# Load TSPARM spec for mapping, once per process
+
+@lru_cache(maxsize=None)
 def load_tsparm_spec(tsparm_spec_file):
     tsparm_map = []
     with open(tsparm_spec_file, newline='') as f:
         reader = csv.DictReader(f)
         for row in reader:
             tsparm_map.append(row)
-    return tsparm_map
+    return tuple(tsparm_map)
 
-# Main function
+# Domain function
 
-def main(usdm_file, ts_spec_file, tsparm_spec_file, output_file):
-    # Load SDTM Terminology Excel (column A: code, column B: codelist code)
-    terminology_xls = "files/SDTM Terminology.xls"
-    terminology = None
-    try:
-        terminology = pd.read_excel(terminology_xls, header=None, usecols=[0,1], dtype=str)
-        terminology.columns = ["code", "codelist_code"]
-    except Exception as e:
-        terminology = pd.DataFrame(columns=["code", "codelist_code"])
-    with open(usdm_file) as f:
-        usdm = json.load(f)
-
-    study_version = usdm["study"]["versions"][0]
-    study_id = ''
-    if "studyIdentifiers" in study_version and study_version["studyIdentifiers"]:
-        study_id = study_version["studyIdentifiers"][0].get("text", "")
+def iter_rows(ctx, tsparm_spec_file="spec/TSPARM_spec.csv", terminology=None, derivations=None):
+    # Cached CDISC controlled terminology, see terminology.py
+    if terminology is None:
+        terminology = default_terminology()
+    study_id = ctx.study_id
+    study_design = ctx.study_design
 
     tsparm_map = load_tsparm_spec(tsparm_spec_file)
+    # Everything the parameters read, gathered in one pass (see ts_parameters.py)
+    facts = StudyFacts(ctx)
 
-    rows = []
-    seq = 1
-    study_design = study_version["studyDesigns"][0] if study_version.get("studyDesigns") else {}
-    # Helper for characteristics
-    def has_characteristic(decode):
-        for c in study_design.get("characteristics", []):
-            if c.get("decode", "").upper() == decode.upper() or c.get("code", "") == decode:
-                return True
-        return False
-    # Helper for population min/max age
-    def get_min_max_age(which):
-        vals = []
-        for pop in study_design.get("population", {}).get("cohorts", []):
-            age = pop.get("plannedAge", {}).get("range", {})
-            v = age.get("minValue" if which=="min" else "maxValue")
-            unit = age.get("unit", "")
-            if v is not None:
-                vals.append((v, unit))
-        # fallback to population
-        pop = study_design.get("population", {})
-        age = pop.get("plannedAge", {}).get("range", {})
-        v = age.get("minValue" if which=="min" else "maxValue")
-        unit = age.get("unit", "")
-        if v is not None:
-            vals.append((v, unit))
-        if not vals:
-            return None, None
-        if which == "min":
-            minval = min(vals, key=lambda x: x[0])
-            return minval
-        else:
-            maxval = max(vals, key=lambda x: x[0])
-            return maxval
-    # Helper for boolean Y/N + code
-    def yn_code(val):
-        if val is True:
-            return "Y", "C49488"
-        elif val is False:
-            return "N", "C49487"
-        return '', ''
     for parm in tsparm_map:
-        row = {col: '' for col in TS_COLUMNS}
-        row["STUDYID"] = study_id
-        row["DOMAIN"] = "TS"
-        row["TSSEQ"] = seq
-        row["TSPARMCD"] = parm["TSPARMCD"]
-        row["TSPARM"] = parm["TSPARM"]
         tsp = parm["TSPARMCD"]
+        derive = TS_DERIVATIONS.get(tsp)
+        # Parameters without a derivation, or without a value, still get one empty record
+        records = (derive(facts) if derive else []) or [value()]
+        for tsseq, record in enumerate(records, 1):
+            tsval, tsvcdref, tsvcdver = record["TSVAL"], record["TSVCDREF"], record["TSVCDVER"]
+            # CDISC coded values use the submission value and version of the parameter's codelist; codes
+            # the terminology files lack keep the version the USDM Code gave
+            if record["TSVALCD"] and tsvcdref in ("", CDISC_CT):
+                term = terminology.term(record["TSVALCD"], VALUE_CODELISTS.get(tsp))
+                if term:
+                    tsval = term["submission_value"] or tsval
+                    tsvcdref = CDISC_CT
+                    tsvcdver = term["version"]
+            row = TS_ROW(study_id, "TS", tsseq, record["TSGRPID"], tsp, parm["TSPARM"], tsval, record["TSVALNF"],
+                         record["TSVALCD"], tsvcdref, tsvcdver)
+            if derivations:
+                # Custom derivations (see jsonata_derivations.py) see the row built so far
+                fields = row._asdict()
+                for name, derive_value in derivations.items():
+                    fields[name] = derive_value(ctx, dict(fields, _obj=study_design))
+                row = as_record(TS_ROW, fields)
+            yield row
 
-        # --- Example logic for key parameters ---
-        if tsp == "ADAPT":
-            val = has_characteristic("Adaptive Design")
-            row["TSVAL"], row["TSVALCD"] = yn_code(val)
-        elif tsp == "EXTTIND":
-            val = has_characteristic("Extension Study Design")
-            row["TSVAL"], row["TSVALCD"] = yn_code(val)
-        elif tsp == "RANDOM":
-            val = has_characteristic("Randomized")
-            row["TSVAL"], row["TSVALCD"] = yn_code(val)
-        elif tsp == "HLTSUBJI":
-            pop = study_design.get("population", {})
-            val = pop.get("includesHealthySubjects")
-            row["TSVAL"], row["TSVALCD"] = yn_code(val)
-        elif tsp == "RDIND":
-            inds = study_design.get("indications", [])
-            val = None
-            for ind in inds:
-                if "isRareDisease" in ind:
-                    val = ind["isRareDisease"]
-                    break
-            row["TSVAL"], row["TSVALCD"] = yn_code(val)
-        elif tsp == "AGEMIN":
-            v, unit = get_min_max_age("min")
-            if v is not None:
-                row["TSVAL"] = f"P{int(v)}Y" if unit and unit.lower() in ["year", "years", "yr", "y"] else str(v)
-            else:
-                row["TSVAL"] = ''
-                row["TSVALNF"] = 'UNK'
-        elif tsp == "AGEMAX":
-            v, unit = get_min_max_age("max")
-            if v is not None:
-                row["TSVAL"] = f"P{int(v)}Y" if unit and unit.lower() in ["year", "years", "yr", "y"] else str(v)
-            else:
-                row["TSVAL"] = ''
-                row["TSVALNF"] = 'UNK'
-        # Do not populate TSVAL, TSVALNF, TSVALCD, TSVCDREF, TSVCDVER for generic parameters
-        rows.append(row)
-        seq += 1
-
-    with open(output_file, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=TS_COLUMNS)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
+
+def build_rows(ctx, tsparm_spec_file="spec/TSPARM_spec.csv", terminology=None, derivations=None):
+    return list(iter_rows(ctx, tsparm_spec_file, terminology, derivations))
+
+def write_csv(ctx, output_file, tsparm_spec_file="spec/TSPARM_spec.csv", ts_spec_file=TS_SPEC_FILE):
+    # Shared text normalization and SDTM checks, see conformance.py
+    result = conform("TS", build_rows(ctx, tsparm_spec_file), TS_COLUMNS, ts_spec_file)
+    print_summary(result.violations)
+    write_domain_csv(output_file, TS_COLUMNS, result.rows)
+
+# Main function
+
+def main(usdm_file, ts_spec_file, tsparm_spec_file, output_file):
+    write_csv(load_study_context(usdm_file), output_file, tsparm_spec_file, ts_spec_file)
 
 if __name__ == "__main__":
     import argparse
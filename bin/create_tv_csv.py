@@ -1,78 +1,63 @@
-import csv
-import json
-import re
+from ordering import order_encounters
+from conformance import conform, print_summary
+from spec_mapping import DomainMapping
+from study_context import load_study_context, write_domain_csv
 
 COLUMNS = [
     "STUDYID","DOMAIN","VISITNUM","VISIT","VISITDY","ARMCD","ARM","TVSTRL","TVENRL"
 ]
 
-def main(usdm_file, output_file):
-    with open(usdm_file) as f:
-        usdm = json.load(f)
+# Parts of the USDM document this domain reads
+USDM_SUBTREES = [
+    "study.versions[*].studyDesigns[*].arms",
+    "study.versions[*].studyDesigns[*].encounters",
+    "study.versions[*].studyDesigns[*].scheduleTimelines",
+]
 
-    study_version = usdm["study"]["versions"][0]
-    study_id = ''
-    if "studyIdentifiers" in study_version and study_version["studyIdentifiers"]:
-        study_id = study_version["studyIdentifiers"][0].get("text", "")
+SPEC_FILE = "spec/TV_spec.csv"
 
-    study_design = study_version["studyDesigns"][0] if study_version.get("studyDesigns") else {}
-    arms = {arm["id"]: arm for arm in study_design.get("arms", [])}
-    study_cells = study_design.get("studyCells", [])
-    encounters = study_design.get("encounters", [])
-    encounter_map = {e["id"]: e for e in encounters}
+# One row per arm and encounter
+ROW_PATHS = [
+    "Study/@versions/StudyVersion/@studyDesigns/StudyDesign/@arms/StudyArm",
+    "Study/@versions/StudyVersion/@studyDesigns/StudyDesign/@encounter/Encounter",
+]
 
+def _visit_order(ctx, encounters):
     # Order encounters by chaining previousId/nextId
-    visit_order = []
-    id_to_prev = {e["id"]: e.get("previousId") for e in encounters}
-    # Find the first encounter (no previousId)
-    first = next((eid for eid, prev in id_to_prev.items() if not prev), None)
-    if first:
-        curr = first
-        while curr:
-            visit_order.append(curr)
-            curr = next((e["id"] for e in encounters if e.get("previousId") == curr), None)
-    else:
-        visit_order = [e["id"] for e in encounters]
+    order = order_encounters(ctx.study_design)
+    ctx.diagnostics.extend(order.diagnostics)
+    return order.items
+
+def _visitdy(ctx, row):
+    # Study day of the encounter's first scheduled instance relative to the anchor
+    day = ctx.timelines.encounter_day(row["Encounter"]["id"])
+    return day if day is not None else ""
+
+DERIVATIONS = {
+    "VISITNUM": lambda ctx, row: row["#Encounter"],
+    "VISITDY": _visitdy,
+}
+
+def domain_mapping(spec_file=SPEC_FILE, derivations=None):
+    return DomainMapping(spec_file, ROW_PATHS, DERIVATIONS, order={"Encounter": _visit_order},
+                         overrides=derivations)
 
-    rows = []
-    for arm in arms.values():
-        armcd = arm.get("name", "") or ""
-        armname = arm.get("description", "") or ""
-        for idx, eid in enumerate(visit_order, 1):
-            enc = encounter_map[eid]
-            # Clean up special whitespace
-            tvstrl = (enc.get("transitionStartRule") or {}).get("text", "") or ""
-            tvenrl = (enc.get("transitionEndRule") or {}).get("text", "") or ""
-            tvstrl = re.sub(r'[\u00A0\u200B\u202F\uFEFF]', ' ', tvstrl).replace('"', '').strip() or ""
-            tvenrl = re.sub(r'[\u00A0\u200B\u202F\uFEFF]', ' ', tvenrl).replace('"', '').strip() or ""
-            # Parse VISITDY from description (e.g., 'Day 14' -> 14), else 0/empty
-            desc = enc.get("description", "")
-            visitdy = ""
-            if idx == 1:
-                visitdy = "0"
-            elif desc:
-                import re as _re
-                m = _re.search(r'Day (\d+)', desc)
-                if m:
-                    visitdy = m.group(1)
-            row = {
-                "STUDYID": study_id or "",
-                "DOMAIN": "TV",
-                "VISITNUM": idx,
-                "VISIT": enc.get("name", "") or "",
-                "VISITDY": visitdy,
-                "ARMCD": armcd,
-                "ARM": armname,
-                "TVSTRL": tvstrl,
-                "TVENRL": tvenrl
-            }
-            rows.append(row)
 
-    with open(output_file, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=COLUMNS)
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(row)
+def iter_rows(ctx, spec_file=SPEC_FILE, derivations=None):
+    return domain_mapping(spec_file, derivations).iter_rows(ctx)
+
+
+def build_rows(ctx, spec_file=SPEC_FILE, derivations=None):
+    return list(iter_rows(ctx, spec_file, derivations))
+
+def write_csv(ctx, output_file):
+    # Shared text normalization and SDTM checks, see conformance.py
+    result = conform("TV", build_rows(ctx), COLUMNS, SPEC_FILE)
+    print_summary(result.violations)
+    write_domain_csv(output_file, COLUMNS, result.rows)
+
+def main(usdm_file, output_file):
+    write_csv(load_study_context(usdm_file), output_file)
 
 if __name__ == "__main__":
     main('files/usdm_sdw_v4.0.0_amendment.json', 'output/TV.CSV')
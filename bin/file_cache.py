@@ -0,0 +1,82 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_cache(cache_file, payload):
+    """Store payload in cache_file; a failed write is reported and otherwise ignored, the cache being optional."""
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        _replace_cache(cache_file, payload)
+    except (OSError, pickle.PicklingError) as e:
+        print(f"Warning: could not write cache {cache_file}: {e}")
+
+
+def _replace_cache(cache_file, payload):
+    # A temporary file of its own, so processes filling a cold cache at once do not replace each other's
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def load_cached(path, cache_dir, build, cache_format=1):
+    """
+    Return build(path) through an on-disk pickle cache.
+    The cache is reused while the file size and mtime are unchanged; if they
+    differ but the content hash still matches (e.g. after a fresh checkout)
+    only the stored signature is refreshed, otherwise build is called again.
+    build must return plain containers (dicts, lists, tuples, strings) so the
+    cache does not depend on module import paths.
+    Args:
+        path (str): Source file the cached data is derived from.
+        cache_dir (str): Directory holding <basename>.pkl cache files.
+        build (callable): Parses path into the data to cache.
+        cache_format (int): Bump when the layout of the built data changes.
+    A cache that cannot be written only costs building again next time.
+    """
+    cache_file = os.path.join(cache_dir, os.path.basename(path) + ".pkl")
+    signature = file_signature(path)
+    cached = None
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            cached = None
+    content_hash = None
+    if cached and cached.get("format") == cache_format:
+        if cached["signature"] == signature:
+            return cached["data"]
+        content_hash = file_hash(path)
+        if cached["hash"] == content_hash:
+            cached["signature"] = signature
+            _write_cache(cache_file, cached)
+            return cached["data"]
+
+    data = build(path)
+    _write_cache(cache_file, {
+        "format": cache_format,
+        "signature": signature,
+        "hash": content_hash or file_hash(path),
+        "data": data,
+    })
+    return data
@@ -0,0 +1,103 @@
+import glob
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+from file_cache import file_hash, file_signature
+from usdm_stream import prune_usdm
+
+# Written to each output directory; bump MANIFEST_FORMAT when its layout changes
+MANIFEST_FILE = ".manifest.json"
+MANIFEST_FORMAT = 1
+
+
+@lru_cache(maxsize=None)
+def tool_version():
+    """Hash of the converter sources, so any code change regenerates every domain."""
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _hash_json(value):
+    text = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def inputs_fingerprint(files, options=None):
+    """
+    Fingerprint of everything besides the USDM document that a domain's
+    output depends on: the tool version, the content of files (spec and
+    terminology files; missing ones count as absent) and options.
+    """
+    return _hash_json({
+        "tool": tool_version(),
+        "files": {path: file_hash(path) if os.path.exists(path) else None for path in files},
+        "options": options or {},
+    })
+
+
+def subtree_fingerprint(usdm, subtrees):
+    """Fingerprint of the parts of usdm a domain reads, see usdm_stream.prune_usdm."""
+    return _hash_json(prune_usdm(usdm, subtrees))
+
+
+def load_manifest(output_dir):
+    """The manifest of output_dir, or an empty one when missing, unreadable or outdated."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = None
+    if not isinstance(manifest, dict) or manifest.get("format") != MANIFEST_FORMAT:
+        manifest = {"format": MANIFEST_FORMAT, "document": {}, "domains": {}}
+    return manifest
+
+
+def save_manifest(output_dir, manifest):
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def document_hash(usdm_file, manifest):
+    """
+    Content hash of usdm_file, reusing the manifest's hash while the file
+    size and mtime are unchanged, and record it in the manifest.
+    """
+    signature = list(file_signature(usdm_file))
+    document = manifest["document"]
+    if document.get("path") == os.path.abspath(usdm_file) and document.get("signature") == signature:
+        return document["hash"]
+    content_hash = file_hash(usdm_file)
+    manifest["document"] = {"path": os.path.abspath(usdm_file), "signature": signature, "hash": content_hash}
+    return content_hash
+
+
+def is_current(manifest, output_dir, domain, inputs, document=None, data=None):
+    """
+    True when the domain's output file exists and was written from the same
+    inputs and either the same document or the same subtree data.
+    """
+    entry = manifest["domains"].get(domain)
+    if not entry or entry.get("inputs") != inputs:
+        return False
+    if not os.path.exists(os.path.join(output_dir, entry.get("file", ""))):
+        return False
+    return (document is not None and entry.get("document") == document) or (
+        data is not None and entry.get("data") == data)
+
+
+def record(manifest, domain, output_file, inputs, document, data):
+    manifest["domains"][domain] = {
+        "file": os.path.basename(output_file),
+        "inputs": inputs,
+        "document": document,
+        "data": data,
+    }
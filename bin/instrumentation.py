@@ -0,0 +1,212 @@
+import cProfile
+import datetime
+import json
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Written to the output directory of every trial design run
+RUN_REPORT = "run_report.json"
+
+# Seconds between resident memory samples while a stage runs
+SAMPLE_INTERVAL = 0.01
+
+# Functions listed in the text summary next to each profile
+PROFILE_TOP = 30
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Highest resident memory of this process so far in bytes, or None when unknown."""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _mb(value):
+    return round(value / 2 ** 20, 1) if value is not None else None
+
+
+class Stage:
+    """Wall and CPU time, rows and peak resident memory of one stage of a run."""
+
+    def __init__(self, name, domain=None):
+        self.name = name
+        self.domain = domain
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rows = None
+        self.peak_rss = None
+        self.error = None
+
+    def sample(self, rss):
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def time_rows(self, rows):
+        """
+        Generator over rows that adds the time spent producing each row to
+        this stage and counts them, so a lazy pipeline can tell producing
+        rows apart from consuming them.
+        """
+        self.rows = self.rows or 0
+        rows = iter(rows)
+        perf_counter, process_time = time.perf_counter, time.process_time
+        while True:
+            start, cpu = perf_counter(), process_time()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            finally:
+                self.seconds += perf_counter() - start
+                self.cpu_seconds += process_time() - cpu
+            self.rows += 1
+            yield row
+
+    def subtract(self, other):
+        """Leave out the time of a stage that ran inside this one (see time_rows)."""
+        self.seconds -= other.seconds
+        self.cpu_seconds -= other.cpu_seconds
+
+    def to_dict(self):
+        entry = {"stage": self.name}
+        if self.domain:
+            entry["domain"] = self.domain
+        entry.update({"seconds": round(self.seconds, 4), "cpu_seconds": round(self.cpu_seconds, 4)})
+        # Stages timed with time_rows run interleaved with another and are not sampled
+        if self.peak_rss is not None:
+            entry["peak_rss_mb"] = _mb(self.peak_rss)
+        if self.rows is not None:
+            entry["rows"] = self.rows
+        if self.error:
+            entry["error"] = self.error
+        return entry
+
+
+class RunReport:
+    """
+    Timings, row counts, peak memory and errors of one run, by stage.
+    Stages are timed with stage(); while any is open a background thread
+    samples the resident memory every sample_interval seconds (None turns
+    sampling off) and records the highest value in each open stage. With
+    profile_dir, stages opened with profile=True are also run under
+    cProfile and their stats written there.
+    """
+
+    def __init__(self, profile_dir=None, sample_interval=SAMPLE_INTERVAL, **info):
+        self.info = info
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self.stages = []
+        self.errors = []
+        self.extra = {}
+        self._start = time.perf_counter()
+        self._open = []
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            rss = current_rss()
+            with self._lock:
+                for stage in self._open:
+                    stage.sample(rss)
+
+    def add_stage(self, name, domain=None):
+        """Record a stage timed by the caller, e.g. with Stage.time_rows."""
+        stage = Stage(name, domain)
+        self.stages.append(stage)
+        return stage
+
+    @contextmanager
+    def stage(self, name, domain=None, profile=False):
+        """
+        Time the body of the with statement as a stage. An exception is
+        recorded on the stage and in errors, then raised again.
+        """
+        stage = self.add_stage(name, domain)
+        stage.sample(current_rss())
+        with self._lock:
+            self._open.append(stage)
+        if self.sample_interval and self._sampler is None:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+            self._sampler.start()
+        profiler = cProfile.Profile() if profile and self.profile_dir else None
+        start, cpu = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield stage
+        except Exception as e:
+            stage.error = f"{type(e).__name__}: {e}"
+            self.errors.append({"stage": name, "domain": domain, "type": type(e).__name__, "message": str(e)})
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+            stage.seconds += time.perf_counter() - start
+            stage.cpu_seconds += time.process_time() - cpu
+            stage.sample(current_rss())
+            with self._lock:
+                self._open.remove(stage)
+            if profiler:
+                self._dump_profile(profiler, domain or name)
+
+    def _dump_profile(self, profiler, name):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profile_file = os.path.join(self.profile_dir, f"{name}.prof")
+        profiler.dump_stats(profile_file)
+        with open(os.path.join(self.profile_dir, f"{name}.txt"), "w") as f:
+            pstats.Stats(profile_file, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+    def finish(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def to_dict(self):
+        rows = {}
+        for stage in self.stages:
+            if stage.domain and stage.rows is not None:
+                rows[stage.domain] = rows.get(stage.domain, 0) + stage.rows
+        return {
+            "started": self.started,
+            "python": platform.python_version(),
+            **self.info,
+            "seconds": round(time.perf_counter() - self._start, 4),
+            "peak_rss_mb": _mb(peak_rss()),
+            "stages": [stage.to_dict() for stage in self.stages],
+            "rows": rows,
+            "errors": self.errors,
+            **self.extra,
+        }
+
+    def write(self, report_file):
+        """Write the report as JSON, replacing report_file atomically."""
+        self.finish()
+        os.makedirs(os.path.dirname(os.path.abspath(report_file)), exist_ok=True)
+        tmp_file = report_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_file, report_file)
@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+from functools import lru_cache
+
+# Expressions slower than this in total are flagged in the timing report
+SLOW_EXPRESSION_SECONDS = 0.5
+
+
+class ExpressionTimings:
+    """Calls and wall time per expression text, for the run report."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def record(self, text, seconds):
+        with self._lock:
+            calls, total, slowest = self.stats.get(text, (0, 0.0, 0.0))
+            self.stats[text] = (calls + 1, total + seconds, max(slowest, seconds))
+
+    def report(self):
+        """
+        Return one dict per expression, slowest total first.
+        Returns:
+            list: dicts with "expression", "calls", "seconds", "max_seconds"
+            and "slow" (total above SLOW_EXPRESSION_SECONDS).
+        """
+        with self._lock:
+            items = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)
+        return [
+            {
+                "expression": text,
+                "calls": calls,
+                "seconds": round(total, 4),
+                "max_seconds": round(slowest, 4),
+                "slow": total > SLOW_EXPRESSION_SECONDS,
+            }
+            for text, (calls, total, slowest) in items
+        ]
+
+    def clear(self):
+        with self._lock:
+            self.stats.clear()
+
+
+TIMINGS = ExpressionTimings()
+
+
+@lru_cache(maxsize=None)
+def compile_expression(text):
+    """
+    Compile a JSONata expression once per distinct text.
+    Raises:
+        ValueError: If the expression does not parse.
+    """
+    import jsonata
+
+    try:
+        expression = jsonata.Jsonata(text)
+    except Exception as e:
+        raise ValueError(f"Invalid JSONata expression {text!r}: {e}") from e
+    # Input validation walks the whole input on every call, far more than
+    # evaluating a typical expression against a USDM document costs
+    expression.set_validate_input(False)
+    return expression
+
+
+def _index_functions(index):
+    """$ref(id) and $refs(ids) bindings resolving ids through index (or a callable returning it)."""
+    from jsonata import Jsonata
+
+    def get_index():
+        return index() if callable(index) else index
+
+    def ref(obj_id):
+        return get_index().get(obj_id) if obj_id is not None else None
+
+    def refs(obj_ids):
+        found = (get_index().get(obj_id) for obj_id in obj_ids or [])
+        return [obj for obj in found if obj is not None]
+
+    return {"ref": Jsonata.JLambda(ref), "refs": Jsonata.JLambda(refs)}
+
+
+def evaluate(text, data, bindings=None, index=None):
+    """
+    Evaluate the JSONata expression text against data.
+    Args:
+        text (str): JSONata expression, compiled once and cached by its text.
+        data: Input document or object the expression navigates.
+        bindings (dict): Extra $variables.
+        index (UsdmIndex): Makes $ref(id) and $refs(ids) available.
+    Returns:
+        The expression result.
+    """
+    expression = compile_expression(text)
+    variables = dict(bindings or {})
+    if index is not None:
+        variables.update(_index_functions(index))
+    start = time.perf_counter()
+    try:
+        return expression.evaluate(data, variables)
+    finally:
+        TIMINGS.record(text, time.perf_counter() - start)
+
+
+def _value(result):
+    # Sequences collapse to their first value, objects are not cell values
+    if isinstance(result, list):
+        result = result[0] if result else None
+    if result is None or isinstance(result, (dict, list)):
+        return ""
+    if isinstance(result, bool):
+        return "Y" if result else "N"
+    return result
+
+
+def jsonata_derivation(text):
+    """
+    Return a derivation callable (ctx, row) for DomainMapping that evaluates
+    text with the row's object as input. $study, $version, $design and $row
+    (the bound objects of the row) are available, as are $ref and $refs.
+    """
+    compile_expression(text)
+
+    def derive(ctx, row):
+        bindings = {
+            "study": ctx.usdm.get("study"),
+            "version": ctx.study_version,
+            "design": ctx.study_design,
+            "row": {name: value for name, value in row.items() if not name.startswith(("#", "_"))},
+        }
+        data = row.get("_obj", ctx.study_design)
+        return _value(evaluate(text, data, bindings, index=lambda: ctx.index))
+
+    return derive
+
+
+def load_derivations(path):
+    """
+    Read custom derivations from a JSON file mapping domain to variable to
+    JSONata expression, e.g. {"TA": {"STUDYID": "..."}}.
+    Returns:
+        dict: domain -> {variable: derivation callable}.
+    """
+    with open(path) as f:
+        definitions = json.load(f)
+    return {
+        domain.upper(): {variable: jsonata_derivation(text) for variable, text in variables.items()}
+        for domain, variables in definitions.items()
+    }
@@ -0,0 +1,125 @@
+from collections import namedtuple
+
+# Structured problem found while ordering a previousId/nextId chain.
+# kind is one of: "multiple_heads", "no_head", "cycle", "fork",
+# "inconsistent_link", "dangling_reference", "orphan", and for schedule
+# timelines (see timeline.py) "invalid_timing", "inconsistent_timing"
+ChainDiagnostic = namedtuple("ChainDiagnostic", ["kind", "id", "detail"])
+
+ChainOrder = namedtuple("ChainOrder", ["items", "diagnostics"])
+
+
+def order_linked(items, next_attr="nextId", prev_attr="previousId", head_id=None):
+    """
+    Order USDM objects that form a linked list in linear time.
+    A successor index is built once from both the next and previous
+    attributes, then the chain is followed from its head. Items that cannot
+    be reached from the head are appended in document order so no data is
+    lost, and every problem found is reported as a ChainDiagnostic.
+    Args:
+        items (list): USDM objects with an "id" attribute.
+        next_attr (str): Attribute holding the successor id, or None.
+        prev_attr (str): Attribute holding the predecessor id, or None.
+        head_id (str): Explicit first item, e.g. a timeline entryId.
+    Returns:
+        ChainOrder: Ordered items and the list of diagnostics.
+    """
+    diagnostics = []
+    by_id = {item["id"]: item for item in items}
+    successors = {}
+    has_predecessor = set()
+
+    def link(src, dst, attr):
+        if src not in by_id or dst not in by_id:
+            missing = dst if src in by_id else src
+            diagnostics.append(ChainDiagnostic(
+                "dangling_reference", missing, f"{attr} refers to an unknown id"))
+            return
+        current = successors.get(src)
+        if current is None:
+            successors[src] = dst
+            has_predecessor.add(dst)
+        elif current != dst:
+            diagnostics.append(ChainDiagnostic(
+                "fork", src, f"successors {current} and {dst} ({attr})"))
+
+    for item in items:
+        item_id = item["id"]
+        if next_attr:
+            next_id = item.get(next_attr)
+            if next_id:
+                link(item_id, next_id, next_attr)
+        if prev_attr:
+            prev_id = item.get(prev_attr)
+            if prev_id:
+                if next_attr and prev_id in by_id:
+                    prev_next = by_id[prev_id].get(next_attr)
+                    if prev_next and prev_next != item_id:
+                        diagnostics.append(ChainDiagnostic(
+                            "inconsistent_link", item_id,
+                            f"{prev_attr} is {prev_id} but {prev_id}.{next_attr} is {prev_next}"))
+                        continue
+                link(prev_id, item_id, prev_attr)
+
+    heads = [item["id"] for item in items if item["id"] not in has_predecessor]
+    if head_id is None:
+        if not heads and items:
+            diagnostics.append(ChainDiagnostic(
+                "no_head", None, "every item has a predecessor, the chain is cyclic"))
+            heads = [items[0]["id"]]
+        elif len(heads) > 1:
+            diagnostics.append(ChainDiagnostic(
+                "multiple_heads", heads[0], f"candidate heads: {', '.join(heads)}"))
+        head_id = heads[0] if heads else None
+    elif head_id not in by_id:
+        diagnostics.append(ChainDiagnostic(
+            "dangling_reference", head_id, "head id refers to an unknown id"))
+        head_id = None
+
+    ordered = []
+    visited = set()
+
+    def walk(start, orphan):
+        current = start
+        walked = set()
+        while current is not None:
+            if current in walked:
+                diagnostics.append(ChainDiagnostic(
+                    "cycle", current, "chain returns to an item already ordered"))
+                return
+            if current in visited:
+                # Sub-chain joins a chain that has already been ordered
+                return
+            walked.add(current)
+            visited.add(current)
+            ordered.append(by_id[current])
+            if orphan:
+                diagnostics.append(ChainDiagnostic(
+                    "orphan", current, "not reachable from the head of the chain"))
+            current = successors.get(current)
+
+    walk(head_id, orphan=False)
+    # Keep unreachable sub-chains together, starting from their own heads
+    for start in heads + [item["id"] for item in items]:
+        if start not in visited:
+            walk(start, orphan=True)
+
+    return ChainOrder(ordered, diagnostics)
+
+
+def order_encounters(study_design):
+    return order_linked(study_design.get("encounters", []))
+
+
+def order_epochs(study_design):
+    return order_linked(study_design.get("epochs", []))
+
+
+def order_timeline_instances(timeline):
+    """Order a timeline's instances along the default path from its entry."""
+    return order_linked(
+        timeline.get("instances", []),
+        next_attr="defaultConditionId",
+        prev_attr=None,
+        head_id=timeline.get("entryId"),
+    )
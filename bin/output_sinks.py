@@ -0,0 +1,395 @@
+import csv
+import datetime
+import json
+import math
+import os
+import shutil
+import struct
+import tempfile
+from collections import namedtuple
+
+from conformance import column_rules
+from spec_mapping import read_domain_spec
+
+# type is "Char" or "Num"; length is the SDTM limit of a Char column, or None when it has none
+Column = namedtuple("Column", ["name", "label", "type", "length"])
+
+# name is the domain code, study_id identifies the study in Dataset-JSON
+Dataset = namedtuple("Dataset", ["name", "label", "columns", "study_id"])
+
+DATASET_LABELS = {
+    "TA": "Trial Arms",
+    "TE": "Trial Elements",
+    "TV": "Trial Visits",
+    "TI": "Trial Inclusion/Exclusion Criteria",
+    "TS": "Trial Summary",
+}
+
+# Columns added by the trial design run that are not in any spec
+EXTRA_COLUMNS = {
+    "VERSID": Column("VERSID", "Study Version Identifier", "Char", None),
+    "DESIGNID": Column("DESIGNID", "Study Design Identifier", "Char", None),
+}
+
+DATASET_JSON_VERSION = "1.1.0"
+
+# SAS V5 transport limits
+XPT_MAX_NAME = 8
+XPT_MAX_LABEL = 40
+XPT_MAX_LENGTH = 200
+
+
+def dataset_columns(columns, spec_file):
+    """Column metadata for columns from the Variable Label, Type and SDTM length limit of spec_file."""
+    spec = {variable["name"]: variable for variable in read_domain_spec(spec_file)}
+    rules = column_rules(spec_file)
+    metadata = []
+    for name in columns:
+        variable = spec.get(name)
+        if variable is None:
+            metadata.append(EXTRA_COLUMNS.get(name, Column(name, "", "Char", None)))
+            continue
+        numeric = rules[name]["numeric"]
+        metadata.append(Column(
+            name, variable["label"].strip(), "Num" if numeric else "Char",
+            None if numeric else rules[name]["max_length"],
+        ))
+    return metadata
+
+
+def _number(value):
+    """value as an int or float, None when empty; raises ValueError when not numeric."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    number = float(value)
+    return int(number) if number.is_integer() and "." not in str(value) else number
+
+
+class CsvSink:
+    """Writes rows to a CSV file with a header line of the column names."""
+
+    extension = ".CSV"
+
+    def __init__(self, output_file, dataset):
+        self.output_file = output_file
+        self.names = [column.name for column in dataset.columns]
+        self._file = open(output_file, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.names)
+
+    def write(self, row):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+
+class DatasetJsonSink:
+    """
+    Writes rows to a CDISC Dataset-JSON (v1.1) file. The header gives each
+    character column the length of its longest value and the record
+    count, both only known once every row is seen, so rows are spooled
+    to a temporary file as they arrive and copied after the header.
+    """
+
+    extension = ".json"
+
+    def __init__(self, output_file, dataset):
+        self.output_file = output_file
+        self.dataset = dataset
+        self.columns = dataset.columns
+        self.numeric = [column.type == "Num" for column in self.columns]
+        self.lengths = [0] * len(self.columns)
+        self.records = 0
+        self._spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+
+    @staticmethod
+    def _column(domain, column, length):
+        item = {
+            "itemOID": f"IT.{domain}.{column.name}",
+            "name": column.name,
+            "label": column.label,
+            "dataType": "double" if column.type == "Num" else "string",
+        }
+        if length:
+            item["length"] = length
+        return item
+
+    def write(self, row):
+        values = []
+        for i, (value, numeric) in enumerate(zip(row, self.numeric)):
+            if numeric:
+                value = _number(value)
+            else:
+                value = value or ""
+                length = len(str(value))
+                if length > self.lengths[i]:
+                    self.lengths[i] = length
+            values.append(value)
+        self._spool.write(("\n    " if not self.records else ",\n    ") + json.dumps(values, ensure_ascii=False))
+        self.records += 1
+
+    def close(self):
+        dataset = self.dataset
+        header = {
+            "datasetJSONCreationDateTime": datetime.datetime.now().isoformat(timespec="seconds"),
+            "datasetJSONVersion": DATASET_JSON_VERSION,
+            "fileOID": f"{dataset.study_id}.{dataset.name}",
+            "sourceSystem": {"name": "cdisc-usdm-utils", "version": ""},
+            "studyOID": dataset.study_id,
+            "itemGroupOID": f"IG.{dataset.name}",
+            "records": self.records,
+            "name": dataset.name,
+            "label": dataset.label,
+            "columns": [
+                self._column(dataset.name, column, None if numeric else length)
+                for column, numeric, length in zip(self.columns, self.numeric, self.lengths)
+            ],
+        }
+        with open(self.output_file, "w") as f:
+            # The header object without its closing brace, then the spooled rows
+            f.write(json.dumps(header, indent=2)[:-2])
+            f.write(',\n  "rows": [')
+            self._spool.seek(0)
+            shutil.copyfileobj(self._spool, f)
+            f.write("\n  ]\n}\n")
+        self._spool.close()
+
+    def abort(self):
+        self._spool.close()
+
+
+def _ibm_float(value):
+    """8-byte IBM hexadecimal floating point of value (None is the SAS missing value)."""
+    if value is None:
+        return b"." + bytes(7)
+    if value == 0:
+        return bytes(8)
+    sign = 0x80 if value < 0 else 0
+    mantissa, exponent = math.frexp(abs(value))
+    # IBM exponents count powers of 16: shift the mantissa so the exponent is a multiple of 4
+    shift = -exponent % 4
+    exponent += shift
+    fraction = round(mantissa / (1 << shift) * (1 << 56))
+    if fraction >> 56:
+        fraction >>= 4
+        exponent += 4
+    ibm_exponent = exponent // 4 + 64
+    if not 0 <= ibm_exponent <= 127:
+        raise ValueError(f"{value} cannot be stored as an IBM floating point number")
+    return bytes([sign | ibm_exponent]) + fraction.to_bytes(7, "big")
+
+
+def split_text(value, limit=XPT_MAX_LENGTH):
+    """
+    value in pieces of at most limit bytes (latin-1), broken before a space
+    where there is one, as SDTM splits long values over TSVAL, TSVAL1, ...
+    Joining the pieces gives value back.
+    """
+    pieces = []
+    while len(value.encode("latin-1", errors="replace")) > limit:
+        cut = limit
+        space = value.rfind(" ", 1, cut + 1)
+        if space > 0:
+            cut = space
+        pieces.append(value[:cut])
+        value = value[cut:]
+    pieces.append(value)
+    return pieces
+
+
+def _xpt_datetime(moment):
+    return moment.strftime("%d%b%y:%H:%M:%S").upper().encode()
+
+
+def _record(text):
+    """One 80-byte header record, blank padded."""
+    return text.ljust(80)[:80].encode("ascii")
+
+
+def _header(name, counts="000000000000000000000000000000"):
+    return _record(f"HEADER RECORD*******{name:<8}HEADER RECORD!!!!!!!{counts}")
+
+
+class XptSink:
+    """
+    Writes rows to a SAS V5 transport (XPT) file. Character lengths in the
+    file header are those of the longest value, which is only known once
+    every row is seen, so rows are spooled to a temporary file first and
+    memory stays bounded however many rows there are.
+    Character values longer than the 200-byte V5 limit are not truncated:
+    as SDTM does for TSVAL, the column keeps the first 200 bytes and the
+    rest goes to added columns <NAME>1, <NAME>2, ... right after it (see
+    split_text). A column whose added names would not fit in 8 characters
+    raises ValueError.
+    """
+
+    extension = ".xpt"
+
+    def __init__(self, output_file, dataset):
+        self.output_file = output_file
+        self.dataset = dataset
+        self.columns = dataset.columns
+        check_dataset(dataset, ["xpt"])
+        # Longest value of each column, then of each of its overflow pieces
+        self.lengths = [[1] for _ in self.columns]
+        self._spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+
+    def write(self, row):
+        values = []
+        for i, (column, value) in enumerate(zip(self.columns, row)):
+            if column.type == "Num":
+                value = _number(value)
+            else:
+                value = "" if value is None else str(value)
+                lengths = self.lengths[i]
+                pieces = split_text(value)
+                if len(pieces) > len(lengths):
+                    name = f"{column.name}{len(pieces) - 1}"
+                    if len(name) > XPT_MAX_NAME:
+                        raise ValueError(f"{column.name} has values longer than {XPT_MAX_LENGTH} bytes and {name} "
+                                         f"is longer than {XPT_MAX_NAME} characters, so XPT cannot hold them")
+                    lengths.extend([1] * (len(pieces) - len(lengths)))
+                for j, piece in enumerate(pieces):
+                    length = len(piece.encode("latin-1", errors="replace"))
+                    if length > lengths[j]:
+                        lengths[j] = length
+            values.append(value)
+        self._spool.write(json.dumps(values) + "\n")
+
+    def _namestr(self, number, column, length, position):
+        numeric = column.type == "Num"
+        return struct.pack(
+            ">hhhh8s40s8shhh2s8shhi52s",
+            1 if numeric else 2, 0, length, number,
+            column.name.ljust(8).encode("ascii"),
+            column.label[:XPT_MAX_LABEL].ljust(40).encode("latin-1", errors="replace"),
+            b" " * 8, 0, 0, 0, bytes(2), b" " * 8, 0, 0, position, bytes(52),
+        )
+
+    def _layout(self):
+        """The columns written, overflow columns included, with their lengths and source column positions."""
+        layout = []
+        for i, (column, lengths) in enumerate(zip(self.columns, self.lengths)):
+            if column.type == "Num":
+                layout.append((column, 8, i, 0))
+                continue
+            layout.append((column, lengths[0], i, 0))
+            for j, length in enumerate(lengths[1:], 1):
+                label = f"{column.label} {j}" if len(column.label) + len(str(j)) < XPT_MAX_LABEL else column.label
+                layout.append((Column(f"{column.name}{j}", label, "Char", None), length, i, j))
+        return layout
+
+    def close(self):
+        layout = self._layout()
+        columns = [column for column, _, _, _ in layout]
+        lengths = [length for _, length, _, _ in layout]
+        now = _xpt_datetime(datetime.datetime.now())
+        with open(self.output_file, "wb") as f:
+            f.write(_header("LIBRARY"))
+            f.write(b"SAS     SAS     SASLIB  9.4     " + b"Python".ljust(8) + b" " * 24 + now)
+            f.write(now + b" " * 64)
+            f.write(_header("MEMBER", "000000000000000001600000000140"))
+            f.write(_header("DSCRPTR"))
+            f.write(b"SAS     " + self.dataset.name.ljust(8).encode("ascii") + b"SASDATA 9.4     "
+                    + b"Python".ljust(8) + b" " * 24 + now)
+            f.write(now + b" " * 16 + self.dataset.label[:40].ljust(40).encode("latin-1", errors="replace")
+                    + b" " * 8)
+            f.write(_header("NAMESTR", f"000000{len(columns):04d}00000000000000000000"))
+            namestrs = b""
+            position = 0
+            for number, (column, length) in enumerate(zip(columns, lengths), 1):
+                namestrs += self._namestr(number, column, length, position)
+                position += length
+            f.write(namestrs + b" " * (-len(namestrs) % 80))
+            f.write(_header("OBS"))
+            written = 0
+            self._spool.seek(0)
+            for line in self._spool:
+                values = json.loads(line)
+                pieces = [None if column.type == "Num" else split_text(value)
+                          for value, column in zip(values, self.columns)]
+                record = b"".join(
+                    _ibm_float(values[i]) if column.type == "Num"
+                    else (pieces[i][j] if j < len(pieces[i]) else "").encode("latin-1", errors="replace").ljust(length)
+                    for column, length, i, j in layout
+                )
+                f.write(record)
+                written += len(record)
+            f.write(b" " * (-written % 80))
+        self._spool.close()
+
+    def abort(self):
+        self._spool.close()
+
+
+SINKS = {
+    "csv": CsvSink,
+    "json": DatasetJsonSink,
+    "xpt": XptSink,
+}
+
+
+def output_file_name(domain, output_format):
+    """<DOMAIN>.CSV, or the lower-case domain with .json / .xpt as submissions name them."""
+    extension = SINKS[output_format].extension
+    return f"{domain}{extension}" if output_format == "csv" else f"{domain.lower()}{extension}"
+
+
+def check_dataset(dataset, formats):
+    """
+    Raise ValueError when a format cannot hold dataset, before any file is
+    opened: XPT only takes column names of up to XPT_MAX_NAME characters.
+    """
+    if "xpt" in formats:
+        for column in dataset.columns:
+            if len(column.name) > XPT_MAX_NAME:
+                raise ValueError(f"{dataset.name}.{column.name} is longer than {XPT_MAX_NAME} characters, "
+                                 "not allowed in XPT")
+
+
+def write_dataset(rows, dataset, output_dir, formats=("csv",)):
+    """
+    Write rows (any iterable, consumed once) to one file per format.
+    Each sink writes <file>.tmp, and the files only replace their previous
+    versions once every sink is closed; when reading the rows or writing
+    fails, the temporary files are removed and the old files are kept.
+    Args:
+        rows (iterable): Records (see row_records.py) or other sequences of
+            values in the order of dataset.columns.
+        dataset (Dataset): Name, label and column metadata.
+        output_dir (str): Directory receiving the files.
+        formats (list): Names from SINKS.
+    Returns:
+        dict: Mapping of format to the written file.
+    Raises:
+        ValueError: When a format cannot hold the dataset (see check_dataset).
+    """
+    check_dataset(dataset, formats)
+    output_files = {
+        output_format: os.path.join(output_dir, output_file_name(dataset.name, output_format))
+        for output_format in formats
+    }
+    sinks = {}
+    try:
+        for output_format, output_file in output_files.items():
+            sinks[output_format] = SINKS[output_format](f"{output_file}.tmp", dataset)
+        for row in rows:
+            for sink in sinks.values():
+                sink.write(row)
+        for sink in sinks.values():
+            sink.close()
+    except BaseException:
+        for sink in sinks.values():
+            sink.abort()
+            if os.path.exists(sink.output_file):
+                os.remove(sink.output_file)
+        raise
+    for output_format, sink in sinks.items():
+        os.replace(sink.output_file, output_files[output_format])
+    return output_files
@@ -1,27 +1,15 @@
-import pandas as pd
-import json
-
-
-usdm = "files/usdm_sdw_v4.0.0_amendment.json"
-out = "output/activities.csv"
-
-
-with open(usdm) as f:
-    data = json.load(f)
-
-df = pd.json_normalize(data)
-print(df.columns)
-"""
-    Index(['usdmVersion', 'systemName', 'systemVersion', 'study.id', 'study.name',
-       'study.description', 'study.label', 'study.versions',
-       'study.documentedBy', 'study.instanceType'],
-      dtype='object')
-"""
-
-# print(df['study.versions'].to_string(index=False))
-print(
-    "Children of study versions: ",
-    len(df[["study.versions"][0]].to_string(index=False)),
-)
-study_Versions = df[["study.versions"][0]]
-print(study_Versions.iloc[0:5])
+import argparse
+from soa import main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the Schedule of Activities (activity x encounter) from USDM JSON file.")
+    parser.add_argument("--usdm_file", type=str, default="files/usdm_sdw_v4.0.0_amendment.json", help="Path to USDM JSON file")
+    parser.add_argument("--output_file", type=str, default="output/SOA.CSV", help="Path to output CSV file")
+    parser.add_argument("--layout", choices=["grid", "long"], default="grid", help="grid: one row per activity and column per encounter; long: one row per scheduled activity")
+    parser.add_argument("--timeline", help="With the grid layout, only this schedule timeline id (default: all timelines)")
+    parser.add_argument("--stream", action="store_true", help="Parse only the activities, encounters and timelines of the USDM file")
+    args = parser.parse_args()
+    try:
+        main(args.usdm_file, args.output_file, args.layout, args.timeline, args.stream)
+    except ValueError as e:
+        parser.error(str(e))
@@ -0,0 +1,40 @@
+import csv
+from collections import namedtuple
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def _record_type(name, columns):
+    return namedtuple(name, columns, defaults=("",) * len(columns))
+
+
+def record_type(columns, name="Row"):
+    """
+    The row class of a domain: a named tuple with one field per column, in
+    column order, each defaulting to "". Rows are plain tuples, with no
+    per-row dict, and are written by position (see write_records); the
+    class is created once per column list and name.
+    """
+    return _record_type(name, tuple(columns))
+
+
+def is_record(row, columns):
+    """Whether row is a record with exactly these columns, in this order."""
+    return getattr(row, "_fields", None) == tuple(columns)
+
+
+def as_record(record, row):
+    """row (a record of other columns or a dict) as an instance of record, missing columns left ""."""
+    if type(row) is record:
+        return row
+    if hasattr(row, "_fields"):
+        row = row._asdict()
+    return record._make(row.get(name, "") for name in record._fields)
+
+
+def write_records(output_file, columns, records):
+    """Write a header line and records (tuples in column order) to a CSV file."""
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(records)
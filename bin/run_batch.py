@@ -0,0 +1,57 @@
+import argparse
+import sys
+from async_batch import DEFAULT_READ_CONCURRENCY, DEFAULT_WRITE_CONCURRENCY, run_batch_concurrent
+from batch import find_usdm_files, run_batch, study_output_dirs
+from create_trial_design import DOMAINS
+
+
+def report(result):
+    if result.ok:
+        print(f"OK      {result.usdm_file} -> {result.output_dir} ({result.elapsed:.2f}s)")
+    else:
+        print(f"FAILED  {result.usdm_file}: {result.error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a directory or glob of USDM JSON files to trial design domain CSVs in parallel.")
+    parser.add_argument("inputs", nargs="+", help="USDM JSON files, directories or glob patterns")
+    parser.add_argument("--output_dir", type=str, default="output", help="Root directory, one sub-folder per study")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--domains", nargs="+", choices=DOMAINS, default=DOMAINS, help="Domains to create (default: all)")
+    parser.add_argument("--tsparm_spec_file", default="spec/TSPARM_spec.csv", help="TSPARM spec file")
+    parser.add_argument("--max_tasks_per_child", type=int, default=20, help="Studies converted by a worker before it is recycled")
+    parser.add_argument("--stream", action="store_true", help="Parse only the parts of each USDM file the domains read")
+    parser.add_argument("--validate", choices=["full", "subset"], help="Check each USDM file against the schema first, all of it or only what the domains read")
+    parser.add_argument("--incremental", action="store_true", help="Only rewrite domains whose inputs changed since each study was last converted")
+    parser.add_argument("--formats", nargs="+", choices=["csv", "json", "xpt"], default=["csv"], help="Output formats: csv (<DOMAIN>.CSV), json (Dataset-JSON), xpt (SAS V5 transport)")
+    parser.add_argument("--async_io", action="store_true", help="Overlap reading inputs and writing outputs, for files on a slow or network filesystem")
+    parser.add_argument("--read_concurrency", type=int, default=DEFAULT_READ_CONCURRENCY, help="With --async_io, input files read at a time")
+    parser.add_argument("--write_concurrency", type=int, default=DEFAULT_WRITE_CONCURRENCY, help="With --async_io, studies written at a time")
+    parser.add_argument("--max_in_flight", type=int, default=None, help="With --async_io, studies between read and write at a time (default: 2 per worker)")
+    parser.add_argument("--scratch_dir", default=None, help="With --async_io, local directory for the working copies (default: system temp)")
+    args = parser.parse_args()
+    if args.async_io and args.incremental:
+        parser.error("--incremental cannot be combined with --async_io")
+
+    usdm_files = find_usdm_files(args.inputs)
+    if not usdm_files:
+        parser.error("No USDM JSON files found.")
+    try:
+        study_output_dirs(args.output_dir, usdm_files)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.async_io:
+        results = run_batch_concurrent(usdm_files, args.output_dir, workers=args.workers, domains=args.domains,
+                                       tsparm_spec_file=args.tsparm_spec_file,
+                                       max_tasks_per_child=args.max_tasks_per_child, on_result=report,
+                                       stream=args.stream, validate=args.validate, formats=args.formats,
+                                       read_concurrency=args.read_concurrency,
+                                       write_concurrency=args.write_concurrency,
+                                       max_in_flight=args.max_in_flight, scratch_dir=args.scratch_dir)
+    else:
+        results = run_batch(usdm_files, args.output_dir, args.workers, args.domains,
+                            args.tsparm_spec_file, args.max_tasks_per_child, on_result=report, stream=args.stream,
+                            validate=args.validate, incremental=args.incremental, formats=args.formats)
+    failed = [r for r in results if not r.ok]
+    print(f"{len(results) - len(failed)} of {len(results)} studies converted, {len(failed)} failed.")
+    sys.exit(1 if failed else 0)
@@ -1,7 +1,5 @@
-import sys
-import os
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from bin.biomedical_concepts import process_usdm_biomedical_concepts_to_csv
+from biomedical_concepts import process_usdm_biomedical_concepts_to_csv
+from bc_catalog import DEFAULT_CATALOG_FILE, load_bc_catalog
 
 if __name__ == "__main__":
     import argparse
@@ -15,5 +13,22 @@ if __name__ == "__main__":
     parser.add_argument(
         "--out_file", required=True, help="Path to the output CSV file."
     )
+    parser.add_argument(
+        "--catalog_file",
+        nargs="?",
+        const=DEFAULT_CATALOG_FILE,
+        help="Match concepts against a CDISC biomedical concepts catalog CSV "
+        f"(default when given without a value: {DEFAULT_CATALOG_FILE}).",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["csv", "parquet"],
+        default="csv",
+        help="Output format; parquet writes a typed, columnar file (requires pyarrow).",
+    )
     args = parser.parse_args()
-    process_usdm_biomedical_concepts_to_csv(args.usdm_file, args.out_file)
+    catalog = load_bc_catalog(args.catalog_file) if args.catalog_file else None
+    try:
+        process_usdm_biomedical_concepts_to_csv(args.usdm_file, args.out_file, catalog, args.format)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
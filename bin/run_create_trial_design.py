@@ -0,0 +1,23 @@
+import argparse
+from create_trial_design import DOMAINS, main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create trial design domain CSVs from one USDM JSON file.")
+    parser.add_argument("--usdm_file", type=str, default="files/usdm_sdw_v4.0.0_amendment.json", help="Path to USDM JSON file")
+    parser.add_argument("--output_dir", type=str, default="output", help="Directory for the <DOMAIN>.CSV files")
+    parser.add_argument("--domains", nargs="+", choices=DOMAINS, default=DOMAINS, help="Domains to create (default: all)")
+    parser.add_argument("--tsparm_spec_file", default="spec/TSPARM_spec.csv", help="TSPARM spec file")
+    parser.add_argument("--stream", action="store_true", help="Parse only the parts of the USDM file the domains read")
+    parser.add_argument("--all_designs", action="store_true", help="Cover every study version and design, keyed by VERSID/DESIGNID")
+    parser.add_argument("--changed_only", action="store_true", help="With --all_designs, skip designs unchanged since the previous version")
+    parser.add_argument("--derivations", help="JSON file of custom JSONata derivations per domain and variable")
+    parser.add_argument("--validate", choices=["full", "subset"], help="Check the USDM file against the schema first, all of it or only what the domains read")
+    parser.add_argument("--incremental", action="store_true", help="Only rewrite domains whose part of the USDM file, spec or options changed since the last run")
+    parser.add_argument("--formats", nargs="+", choices=["csv", "json", "xpt"], default=["csv"], help="Output formats: csv (<DOMAIN>.CSV), json (Dataset-JSON), xpt (SAS V5 transport)")
+    parser.add_argument("--profile", action="store_true", help="Write cProfile stats of the load and of each domain to <output_dir>/profile")
+    args = parser.parse_args()
+    if args.changed_only and not args.all_designs:
+        parser.error("--changed_only requires --all_designs")
+    main(args.usdm_file, args.output_dir, args.domains, args.tsparm_spec_file,
+         args.stream, args.all_designs, args.changed_only, args.derivations, args.validate,
+         args.incremental, args.formats, args.profile)
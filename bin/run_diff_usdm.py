@@ -0,0 +1,16 @@
+import argparse
+from create_trial_design import DOMAINS
+from usdm_diff import main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the USDM objects and trial design rows that changed between two USDM versions.")
+    parser.add_argument("old_file", help="USDM JSON file before the change")
+    parser.add_argument("new_file", nargs="?", help="USDM JSON file after the change (default: compare two versions of old_file)")
+    parser.add_argument("--old_version", type=int, default=0, help="Index of the study version compared in old_file")
+    parser.add_argument("--new_version", type=int, help="Index of the study version compared in new_file (default: 0, or the last version of old_file)")
+    parser.add_argument("--domains", nargs="+", choices=DOMAINS, default=DOMAINS, help="Domains to compare (default: all)")
+    parser.add_argument("--tsparm_spec_file", default="spec/TSPARM_spec.csv", help="TSPARM spec file")
+    parser.add_argument("--output_file", help="Path to a JSON report of every change")
+    args = parser.parse_args()
+    main(args.old_file, args.new_file, args.old_version, args.new_version, args.domains, args.output_file,
+         args.tsparm_spec_file)
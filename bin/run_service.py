@@ -0,0 +1,12 @@
+import argparse
+from service import DEFAULT_HOST, DEFAULT_PORT, main
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve USDM conversions over HTTP from worker processes with warm caches.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--queue_size", type=int, default=None, help="Conversions accepted at once before requests are refused with 503 (default: twice the workers)")
+    parser.add_argument("--max_tasks_per_child", type=int, default=None, help="Conversions a worker runs before it is recycled (default: never)")
+    args = parser.parse_args()
+    main(args.host, args.port, args.workers, args.queue_size, args.max_tasks_per_child)
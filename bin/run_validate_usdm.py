@@ -0,0 +1,60 @@
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from batch import find_usdm_files
+from create_trial_design import DOMAINS, domain_subtrees
+from usdm_schema import DEFAULT_SCHEMA_FILE, validate_usdm_file
+
+
+def validate_file(usdm_file, subtrees, stream, schema_file, max_errors):
+    start = time.perf_counter()
+    try:
+        errors = validate_usdm_file(usdm_file, subtrees, stream, schema_file, max_errors)
+    except (OSError, ValueError) as e:
+        return usdm_file, None, f"{type(e).__name__}: {e}", time.perf_counter() - start
+    return usdm_file, errors, "", time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check USDM JSON files against the USDM v4 schema.")
+    parser.add_argument("inputs", nargs="+", help="USDM JSON files, directories or glob patterns")
+    parser.add_argument("--schema_file", default=DEFAULT_SCHEMA_FILE, help="USDM API (OpenAPI) JSON file")
+    parser.add_argument("--subset", action="store_true", help="Only check the parts of each file the trial design domains read")
+    parser.add_argument("--domains", nargs="+", choices=DOMAINS, default=DOMAINS, help="Domains whose subtrees --subset checks (default: all)")
+    parser.add_argument("--stream", action="store_true", help="With --subset, parse only those parts of each file")
+    parser.add_argument("--max_errors", type=int, default=20, help="Errors reported per file")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    args = parser.parse_args()
+    if args.stream and not args.subset:
+        parser.error("--stream requires --subset")
+
+    usdm_files = find_usdm_files(args.inputs)
+    if not usdm_files:
+        parser.error("No USDM JSON files found.")
+    subtrees = domain_subtrees(args.domains) if args.subset else None
+    check = partial(validate_file, subtrees=subtrees, stream=args.stream,
+                    schema_file=args.schema_file, max_errors=args.max_errors)
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(check, usdm_files))
+    else:
+        results = map(check, usdm_files)
+
+    invalid = 0
+    for usdm_file, errors, failure, elapsed in results:
+        if failure:
+            invalid += 1
+            print(f"FAILED  {usdm_file}: {failure}")
+        elif errors:
+            invalid += 1
+            more = "+" if len(errors) == args.max_errors else ""
+            print(f"INVALID {usdm_file} ({len(errors)}{more} errors, {elapsed:.2f}s)")
+            for error in errors:
+                print(f"        {error.path}: {error.message}")
+        else:
+            print(f"VALID   {usdm_file} ({elapsed:.2f}s)")
+    print(f"{len(usdm_files) - invalid} of {len(usdm_files)} files valid.")
+    sys.exit(1 if invalid else 0)
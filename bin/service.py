@@ -0,0 +1,369 @@
+import csv
+import glob
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bc_catalog import DEFAULT_CATALOG_FILE, default_bc_catalog
+from conformance import column_rules, conform_stream
+from create_trial_design import DOMAIN_SPEC_FILES, DOMAINS, check_domains, domain_columns, domain_rows
+from create_ts_csv import load_tsparm_spec
+from file_cache import file_signature
+from spec_mapping import read_domain_spec
+from study_context import StudyContext, iter_study_contexts
+from terminology import DEFAULT_TERMINOLOGY_FILES, default_terminology
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Requests larger than this are refused before being read
+MAX_PAYLOAD_BYTES = 256 * 1024 * 1024
+
+# Conversion times kept for the latency percentiles of /metrics
+LATENCY_WINDOW = 1000
+
+TSPARM_SPEC_FILE = "spec/TSPARM_spec.csv"
+
+# Biomedical concepts can be requested alongside the trial design domains
+BC_DOMAIN = "BC"
+
+# Per-process caches of parsed specs, terminology and catalogs, cleared when their files change
+_CACHES = [read_domain_spec, column_rules, load_tsparm_spec, default_terminology, default_bc_catalog]
+_signatures = None
+
+
+class ServiceBusy(Exception):
+    """Every worker is busy and the queue is full."""
+
+
+class WorkerFailure(Exception):
+    """A worker process died during a conversion; the pool has been replaced."""
+
+
+def _input_files():
+    return sorted(glob.glob("spec/*.csv")) + [DEFAULT_CATALOG_FILE] + DEFAULT_TERMINOLOGY_FILES
+
+
+def refresh_caches():
+    """
+    Clear the cached specs, terminology and catalog when any of their
+    files was added, removed or changed since the last call; a stat per
+    file, so it is cheap enough to run before every conversion.
+    """
+    global _signatures
+    signatures = {path: file_signature(path) if os.path.exists(path) else None for path in _input_files()}
+    if _signatures is not None and signatures != _signatures:
+        for cache in _CACHES:
+            cache.cache_clear()
+    _signatures = signatures
+
+
+def warm_caches():
+    """
+    Load every spec, the terminology and the BC catalog (when present) in
+    this process. Best effort: it runs as the pool initializer, where an
+    exception would break the whole pool, so a failure is only reported
+    and whatever is missing loads on the first request instead.
+    """
+    try:
+        refresh_caches()
+        for domain in DOMAINS:
+            column_rules(DOMAIN_SPEC_FILES[domain])
+        load_tsparm_spec(TSPARM_SPEC_FILE)
+        default_terminology()
+        if os.path.exists(DEFAULT_CATALOG_FILE):
+            default_bc_catalog()
+    except Exception as e:
+        print(f"Warning: worker {os.getpid()} could not warm its caches ({type(e).__name__}: {e}), "
+              f"loading them on first use")
+
+
+def _csv_text(columns, rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def _bc_table(usdm):
+    from biomedical_concepts import biomedical_concept_columns, iter_biomedical_concept_rows
+
+    catalog = default_bc_catalog() if os.path.exists(DEFAULT_CATALOG_FILE) else None
+    return biomedical_concept_columns(catalog), list(iter_biomedical_concept_rows(usdm, catalog))
+
+
+def convert(payload, domains=None, output_format="json", all_designs=False):
+    """
+    Convert one USDM document held in memory, as run by the worker processes.
+    Args:
+        payload (bytes): The USDM JSON document.
+        domains (list): Trial design domain codes, and BC for biomedical
+            concepts; defaults to all trial design domains.
+        output_format (str): "csv" for each domain as CSV text, "json" for
+            its columns and rows as lists.
+        all_designs (bool): Cover every study version and design, keyed by
+            VERSID/DESIGNID.
+    Returns:
+        dict: "domains" mapping each code to its table, "conformance" with
+        the Violations as dicts and "warnings" with the diagnostics found.
+    """
+    refresh_caches()
+    usdm = json.loads(payload)
+    domains = domains or DOMAINS
+    with_bc = BC_DOMAIN in domains
+    domains = check_domains([d for d in domains if d != BC_DOMAIN])
+    contexts = list(iter_study_contexts(usdm)) if all_designs else [StudyContext(usdm)]
+    violations = []
+    tables = {}
+    for domain in domains:
+        columns = domain_columns(domain, all_designs)
+        rows = conform_stream(domain, domain_rows(contexts, domain, TSPARM_SPEC_FILE, all_designs), columns,
+                              DOMAIN_SPEC_FILES[domain], violations)
+        # Records are returned as plain tuples, which pickle without their class
+        tables[domain] = (columns, [tuple(row) for row in rows])
+    if with_bc:
+        tables[BC_DOMAIN] = _bc_table(usdm)
+    if output_format == "csv":
+        tables = {domain: _csv_text(columns, rows) for domain, (columns, rows) in tables.items()}
+    else:
+        tables = {domain: {"columns": columns, "rows": rows} for domain, (columns, rows) in tables.items()}
+    return {
+        "domains": tables,
+        "conformance": [violation._asdict() for violation in violations],
+        "warnings": [f"{d.kind} {d.id or ''}: {d.detail}" for ctx in contexts for d in ctx.diagnostics],
+    }
+
+
+class Metrics:
+    """Request counters and recent conversion latencies, shared by the handler threads."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.counts = {"requests": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def count(self, name, latency=None):
+        with self._lock:
+            self.counts[name] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            counts = dict(self.counts)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e3, 1) if latencies else None
+
+        return {
+            **counts,
+            "uptime_s": round(time.time() - self.started, 1),
+            "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+        }
+
+
+class ConversionService:
+    """
+    A pool of worker processes with warm caches and a bounded queue.
+    At most queue_size conversions are accepted at a time (running or
+    waiting for a worker); further requests are refused with ServiceBusy
+    rather than queued without limit, so callers can back off. A pool
+    broken by a dying worker is replaced, and the conversions it took down
+    fail with WorkerFailure.
+    """
+
+    def __init__(self, workers=None, queue_size=None, max_tasks_per_child=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or self.workers * 2
+        self.max_tasks_per_child = max_tasks_per_child
+        self.metrics = Metrics()
+        self.restarts = 0
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._pool = self._start_pool()
+
+    def _start_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_caches,
+                                   max_tasks_per_child=self.max_tasks_per_child)
+        # Start every worker now rather than on the first requests
+        try:
+            for future in [pool.submit(time.sleep, 0) for _ in range(self.workers)]:
+                future.result()
+        except BrokenProcessPool as e:
+            print(f"Warning: worker pool failed to start ({e}), it is restarted on the next request")
+        return pool
+
+    def _replace_pool(self, broken):
+        with self._lock:
+            # Only the first of the requests that saw the same pool break replaces it
+            if self._pool is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._start_pool()
+                self.restarts += 1
+
+    @property
+    def pool_broken(self):
+        # Set by ProcessPoolExecutor when a worker dies or its initializer fails
+        return bool(getattr(self._pool, "_broken", False))
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @contextmanager
+    def reserve(self):
+        """Hold one of the queue_size slots for a conversion; raises ServiceBusy at once when none is free."""
+        self.metrics.count("requests")
+        if not self._slots.acquire(blocking=False):
+            self.metrics.count("rejected")
+            raise ServiceBusy(f"{self.queue_size} conversions already queued")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def run(self, payload, domains=None, output_format="json", all_designs=False):
+        """Run convert() on a worker and wait for it, in a slot already held with reserve()."""
+        start = time.perf_counter()
+        pool = self._pool
+        if self.pool_broken:
+            self._replace_pool(pool)
+            pool = self._pool
+        try:
+            result = pool.submit(convert, payload, domains, output_format, all_designs).result()
+        except BrokenProcessPool as e:
+            self.metrics.count("failed")
+            self._replace_pool(pool)
+            raise WorkerFailure(f"a worker process died during the conversion ({e})") from e
+        except Exception:
+            self.metrics.count("failed")
+            raise
+        elapsed = time.perf_counter() - start
+        self.metrics.count("completed", elapsed)
+        result["elapsed_ms"] = round(elapsed * 1e3, 1)
+        return result
+
+    def convert(self, payload, domains=None, output_format="json", all_designs=False):
+        """run() in a slot of its own; raises ServiceBusy when the queue is full."""
+        with self.reserve():
+            return self.run(payload, domains, output_format, all_designs)
+
+    def health(self):
+        return {
+            "status": "unavailable" if self.pool_broken else "ok",
+            "pool": "broken" if self.pool_broken else "running",
+            "restarts": self.restarts,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(cancel_futures=True)
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health   service status and load
+    GET  /metrics  request counts and conversion latency percentiles
+    POST /convert  USDM JSON body; query parameters domains (comma
+                   separated, default all), format (json or csv) and
+                   all_designs (1 to cover every version and design)
+    """
+
+    service = None
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            health = self.service.health()
+            self._send(200 if health["status"] == "ok" else 503, health)
+        elif path == "/metrics":
+            self._send(200, {**self.service.metrics.snapshot(), "in_flight": self.service.in_flight})
+        else:
+            self._send(404, {"error": f"no such endpoint: {path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/convert":
+            self._send(404, {"error": f"no such endpoint: {url.path}"})
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            self._send(400, {"error": "the request body must be a USDM JSON document"})
+            return
+        if length > MAX_PAYLOAD_BYTES:
+            self._send(413, {"error": f"payload larger than {MAX_PAYLOAD_BYTES} bytes"})
+            return
+        output_format = query.get("format", "json")
+        domains = [d.strip().upper() for d in query["domains"].split(",") if d.strip()] if "domains" in query else None
+        unknown = [d for d in domains or [] if d not in DOMAINS + [BC_DOMAIN]]
+        if output_format not in ("json", "csv") or unknown:
+            self._send(400, {"error": f"unknown format or domain(s): {', '.join(unknown) or output_format}"})
+            return
+        try:
+            # The slot is taken before the body is read, so a busy service refuses without reading it
+            with self.service.reserve():
+                payload = self.rfile.read(length)
+                result = self.service.run(payload, domains, output_format, query.get("all_designs") == "1")
+        except (ServiceBusy, WorkerFailure) as e:
+            self._send(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+        except ValueError as e:
+            # Malformed JSON (json.JSONDecodeError is a ValueError) or an unusable document
+            self._send(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        except Exception as e:
+            self._send(422, {"error": f"{type(e).__name__}: {e}"})
+            return
+        if output_format == "csv" and len(result["domains"]) == 1:
+            (text,) = result["domains"].values()
+            self._send(200, text.encode(), "text/csv")
+        else:
+            self._send(200, result)
+
+    def log_message(self, format, *args):
+        # Conversions are counted in /metrics rather than logged one line each
+        pass
+
+
+def main(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, queue_size=None, max_tasks_per_child=None):
+    service = ConversionService(workers, queue_size, max_tasks_per_child)
+    handler = type("Handler", (ConversionHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Serving on http://{host}:{server.server_port} with {service.workers} worker(s), "
+          f"queue of {service.queue_size}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
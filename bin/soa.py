@@ -0,0 +1,277 @@
+import csv
+from array import array
+from collections import namedtuple
+
+from ordering import ChainDiagnostic, order_encounters, order_linked
+
+# Subtrees of the document the Schedule of Activities reads
+USDM_SUBTREES = [
+    "study.versions[*].studyDesigns[*].activities",
+    "study.versions[*].studyDesigns[*].encounters",
+    "study.versions[*].studyDesigns[*].scheduleTimelines",
+]
+
+# One scheduled activity: positions in ScheduleOfActivities.activities,
+# .encounters (-1 when the instance has no encounter) and .timelines
+SoaEntry = namedtuple("SoaEntry", ["activity", "encounter", "timeline", "instance_id"])
+
+LONG_COLUMNS = ["activity_id", "activity", "encounter_id", "encounter", "timeline_id", "timeline", "instance_id"]
+
+# Marks a scheduled activity in the grid layout
+SCHEDULED = "X"
+
+
+def _label(obj):
+    return obj.get("label") or obj.get("name") or obj["id"]
+
+
+class ScheduleOfActivities:
+    """
+    Activity x encounter x timeline incidence of one study design, from the
+    activityIds of its scheduled activity instances.
+
+    Activities, encounters and timelines are numbered once (activities and
+    encounters in their previousId/nextId order) and every scheduled
+    activity is stored as one coordinate triple, so the schedule is held as
+    a sparse matrix however many activities and visits a study has. Per
+    activity and per encounter id indexes are built in the same pass, so
+    e.g. all visits of an activity are found without scanning the timelines.
+
+    Instances of a timeline without an encounter take the encounters the
+    timeline is scheduled at: those of the instance that refers to it
+    (timelineId) or else of the activities that do; timelines scheduled
+    from nowhere (e.g. early termination) have encounter -1.
+    """
+
+    def __init__(self, study_design, diagnostics=None):
+        self.diagnostics = diagnostics if diagnostics is not None else []
+        activities = order_linked(study_design.get("activities") or [])
+        encounters = order_encounters(study_design)
+        self.diagnostics.extend(activities.diagnostics + encounters.diagnostics)
+        self.activities = activities.items
+        self.encounters = encounters.items
+        self.timelines = list(study_design.get("scheduleTimelines") or [])
+        self.activity_index = {a["id"]: i for i, a in enumerate(self.activities)}
+        self.encounter_index = {e["id"]: i for i, e in enumerate(self.encounters)}
+        self.timeline_index = {t["id"]: i for i, t in enumerate(self.timelines)}
+        # Coordinates of every entry, as compact C int arrays
+        self._activity = array("i")
+        self._encounter = array("i")
+        self._timeline = array("i")
+        self._instance_ids = []
+        self._build()
+
+    def _build(self):
+        instances = {}
+        # Timeline id -> instance of another timeline, or activity, that schedules it
+        parent_instances = {}
+        parent_activities = {}
+        for timeline in self.timelines:
+            for instance in timeline.get("instances") or []:
+                instances[instance["id"]] = (timeline["id"], instance)
+                if instance.get("timelineId") and instance["timelineId"] != timeline["id"]:
+                    parent_instances.setdefault(instance["timelineId"], []).append(instance["id"])
+        for activity in self.activities:
+            if activity.get("timelineId"):
+                parent_activities.setdefault(activity["timelineId"], []).append(activity["id"])
+        activity_instances = {}
+        for timeline_id, instance in instances.values():
+            for activity_id in instance.get("activityIds") or []:
+                activity_instances.setdefault(activity_id, []).append(instance["id"])
+
+        encounters_of = {}
+
+        def instance_encounters(instance_id, seen):
+            timeline_id, instance = instances[instance_id]
+            if instance.get("encounterId") in self.encounter_index:
+                return [self.encounter_index[instance["encounterId"]]]
+            return timeline_encounters(timeline_id, seen)
+
+        def timeline_encounters(timeline_id, seen):
+            if timeline_id in encounters_of:
+                return encounters_of[timeline_id]
+            if timeline_id in seen:
+                return []
+            seen = seen | {timeline_id}
+            parents = parent_instances.get(timeline_id) or [
+                instance_id
+                for activity_id in parent_activities.get(timeline_id, [])
+                for instance_id in activity_instances.get(activity_id, [])
+                if instances[instance_id][0] != timeline_id
+            ]
+            found = sorted({e for parent in parents for e in instance_encounters(parent, seen)})
+            encounters_of[timeline_id] = found
+            return found
+
+        unknown = set()
+        for timeline_id, instance in instances.values():
+            timeline = self.timeline_index[timeline_id]
+            positions = instance_encounters(instance["id"], frozenset()) or [-1]
+            for activity_id in instance.get("activityIds") or []:
+                activity = self.activity_index.get(activity_id)
+                if activity is None:
+                    unknown.add(activity_id)
+                    continue
+                for encounter in positions:
+                    self._activity.append(activity)
+                    self._encounter.append(encounter)
+                    self._timeline.append(timeline)
+                    self._instance_ids.append(instance["id"])
+        for activity_id in sorted(unknown):
+            self.diagnostics.append(ChainDiagnostic("dangling_reference", activity_id,
+                                                    "scheduled activity does not exist"))
+
+        by_activity = {}
+        by_encounter = {}
+        for activity, encounter in zip(self._activity, self._encounter):
+            if encounter >= 0:
+                by_activity.setdefault(activity, set()).add(encounter)
+                by_encounter.setdefault(encounter, set()).add(activity)
+        self._cells = {(a, e) for a, es in by_activity.items() for e in es}
+        self._encounters_of = {
+            self.activities[a]["id"]: tuple(self.encounters[e]["id"] for e in sorted(es))
+            for a, es in by_activity.items()
+        }
+        self._activities_at = {
+            self.encounters[e]["id"]: tuple(self.activities[a]["id"] for a in sorted(activities))
+            for e, activities in by_encounter.items()
+        }
+
+    def __len__(self):
+        return len(self._instance_ids)
+
+    @property
+    def shape(self):
+        """(activities, encounters, timelines)."""
+        return len(self.activities), len(self.encounters), len(self.timelines)
+
+    def entries(self):
+        """Every scheduled activity as a SoaEntry, in timeline and instance order."""
+        return [SoaEntry(*entry) for entry in
+                zip(self._activity, self._encounter, self._timeline, self._instance_ids)]
+
+    def encounters_for(self, activity_id):
+        """Ids of the encounters (visits) an activity is scheduled at, in visit order."""
+        return self._encounters_of.get(activity_id, ())
+
+    def activities_at(self, encounter_id):
+        """Ids of the activities scheduled at an encounter, in activity order."""
+        return self._activities_at.get(encounter_id, ())
+
+    def timeline_position(self, timeline_id):
+        """Position of a schedule timeline; raises ValueError naming the available ids when there is none."""
+        if timeline_id not in self.timeline_index:
+            available = ", ".join(self.timeline_index) or "none"
+            raise ValueError(f"Unknown schedule timeline {timeline_id!r}; available: {available}")
+        return self.timeline_index[timeline_id]
+
+    def is_scheduled(self, activity_id, encounter_id):
+        return (self.activity_index.get(activity_id), self.encounter_index.get(encounter_id)) in self._cells
+
+    def coordinates(self, timeline_id=None):
+        """
+        The sparse (COO) form of the schedule as NumPy arrays (requires numpy).
+        Args:
+            timeline_id (str): Only entries of this timeline, default all.
+        Returns:
+            tuple: activity, encounter and timeline position arrays (int32).
+        """
+        import numpy as np
+
+        activity = np.frombuffer(self._activity, dtype=np.intc)
+        encounter = np.frombuffer(self._encounter, dtype=np.intc)
+        timeline = np.frombuffer(self._timeline, dtype=np.intc)
+        if timeline_id is not None:
+            keep = timeline == self.timeline_position(timeline_id)
+            activity, encounter, timeline = activity[keep], encounter[keep], timeline[keep]
+        return activity, encounter, timeline
+
+    def matrix(self, timeline_id=None):
+        """
+        Dense activity x encounter matrix of scheduled counts (requires numpy);
+        entries without an encounter are left out.
+        """
+        import numpy as np
+
+        activity, encounter, _ = self.coordinates(timeline_id)
+        keep = encounter >= 0
+        grid = np.zeros((len(self.activities), len(self.encounters)), dtype=np.int32)
+        np.add.at(grid, (activity[keep], encounter[keep]), 1)
+        return grid
+
+    def to_frame(self, timeline_id=None):
+        """
+        The schedule grid as a pandas DataFrame (requires pandas): one row
+        per activity and one boolean column per encounter, labelled by name.
+        """
+        import pandas as pd
+
+        return pd.DataFrame(
+            self.matrix(timeline_id) > 0,
+            index=pd.Index([_label(a) for a in self.activities], name="activity"),
+            columns=[_label(e) for e in self.encounters],
+        )
+
+    def iter_long_rows(self):
+        """Yield one row per scheduled activity, in LONG_COLUMNS order."""
+        for activity, encounter, timeline, instance_id in zip(
+                self._activity, self._encounter, self._timeline, self._instance_ids):
+            activity, timeline = self.activities[activity], self.timelines[timeline]
+            encounter = self.encounters[encounter] if encounter >= 0 else None
+            yield (
+                activity["id"], _label(activity),
+                encounter["id"] if encounter else "", _label(encounter) if encounter else "",
+                timeline["id"], timeline.get("name") or "", instance_id,
+            )
+
+    def iter_grid_rows(self, timeline_id=None):
+        """Yield the header and one row per activity, SCHEDULED in each encounter column it is at."""
+        yield ["activity"] + [_label(e) for e in self.encounters]
+        if timeline_id is None:
+            for activity in self.activities:
+                scheduled = set(self.encounters_for(activity["id"]))
+                yield [_label(activity)] + [SCHEDULED if e["id"] in scheduled else "" for e in self.encounters]
+            return
+        scheduled = set()
+        timeline = self.timeline_position(timeline_id)
+        for a, e, t in zip(self._activity, self._encounter, self._timeline):
+            if t == timeline and e >= 0:
+                scheduled.add((a, e))
+        for a, activity in enumerate(self.activities):
+            yield [_label(activity)] + [SCHEDULED if (a, e) in scheduled else "" for e in range(len(self.encounters))]
+
+
+def write_soa_csv(soa, output_file, layout="grid", timeline_id=None):
+    """
+    Write a ScheduleOfActivities to CSV.
+    Args:
+        soa (ScheduleOfActivities): The schedule.
+        output_file (str): Path to the CSV file.
+        layout (str): "grid" for the activity x encounter table, "long" for
+            one row per scheduled activity with its encounter, timeline and
+            instance (LONG_COLUMNS).
+        timeline_id (str): With "grid", only this timeline's entries.
+    Raises:
+        ValueError: If timeline_id is not a schedule timeline of the design.
+    """
+    if timeline_id is not None:
+        # Checked before the file is opened, so a wrong id leaves no empty output
+        soa.timeline_position(timeline_id)
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        if layout == "long":
+            writer.writerow(LONG_COLUMNS)
+            writer.writerows(soa.iter_long_rows())
+        else:
+            writer.writerows(soa.iter_grid_rows(timeline_id))
+
+
+def main(usdm_file, output_file, layout="grid", timeline_id=None, stream=False):
+    from study_context import STUDY_SUBTREES, load_study_context
+
+    ctx = load_study_context(usdm_file, STUDY_SUBTREES + USDM_SUBTREES if stream else None)
+    soa = ScheduleOfActivities(ctx.study_design, ctx.diagnostics)
+    write_soa_csv(soa, output_file, layout, timeline_id)
+    for diagnostic in ctx.diagnostics:
+        print(f"Warning: {diagnostic.kind} {diagnostic.id or ''}: {diagnostic.detail}")
+    return soa
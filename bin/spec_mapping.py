@@ -0,0 +1,377 @@
+import csv
+import itertools
+import re
+from functools import lru_cache
+
+from row_records import record_type
+
+# Spec attribute names that differ from the USDM v4 API attribute they map to
+ATTRIBUTE_ALIASES = {
+    "studyIdentifier": "text",
+    "encounter": "encounters",
+    "criteria": "criterionIds",
+    "previous": "previousId",
+    "next": "nextId",
+    "timingValue": "value",
+}
+
+# Classes every StudyContext binds, outermost first
+CONTEXT_CLASSES = ["Study", "StudyVersion", "StudyDesign"]
+
+
+class CompiledPath:
+    """
+    A "Study/@versions/StudyVersion/@attr/..." spec path split once into
+    steps: ("@", attribute) to follow an attribute or reference, and
+    ("class", names) labelling the objects reached by the previous step.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.steps = []
+        for segment in text.split("/"):
+            segment = segment.strip()
+            if not segment:
+                continue
+            if segment.startswith("@"):
+                self.steps.append(("@", segment[1:].strip()))
+            else:
+                names = frozenset(name.strip() for name in segment.split("|") if name.strip())
+                self.steps.append(("class", names))
+
+    def __repr__(self):
+        return f"CompiledPath({self.text!r})"
+
+    def class_positions(self):
+        """Yield (step index, class names) for every class step, outermost first."""
+        for i, (kind, value) in enumerate(self.steps):
+            if kind == "class":
+                yield i, value
+
+    def attributes(self, start=0):
+        return tuple(value for kind, value in self.steps[start:] if kind == "@")
+
+
+def _expand_optional(path):
+    # "a(/B/@c)/D" -> ["a/D", "a/B/@c/D"]
+    match = re.search(r"\(([^()]*)\)", path)
+    if not match:
+        return [path]
+    head, tail = path[:match.start()], path[match.end():]
+    return _expand_optional(head + tail) + _expand_optional(head + match.group(1) + tail)
+
+
+@lru_cache(maxsize=None)
+def compile_path(text):
+    """
+    Compile the "USDM Path and Attribute" text of a spec row.
+    Text before the first "Study/@" is ignored, "(...)" marks an optional
+    part of the path and " | @attr" an alternative final attribute.
+    Returns:
+        tuple: CompiledPath alternatives, empty when text holds no path.
+    """
+    start = (text or "").find("Study/@")
+    if start < 0:
+        return ()
+    first, *others = re.split(r"\s*\|\s*(?=@)", text[start:].strip())
+    parent = first.rsplit("/", 1)[0]
+    paths = [first] + [f"{parent}/{other}" for other in others]
+    return tuple(CompiledPath(p) for path in paths for p in _expand_optional(path))
+
+
+def _spec_column(fieldnames, prefix):
+    return next((name for name in fieldnames if name.startswith(prefix)), None)
+
+
+@lru_cache(maxsize=None)
+def read_domain_spec(spec_file):
+    """
+    Read a domain spec CSV (spec/<DOMAIN>_spec.csv).
+    Returns:
+        tuple: One dict per variable with "name", "label", "type", "core",
+        "paths" (compiled), "relationships" as (class, attribute) pairs and
+        the "derivation" text.
+    """
+    variables = []
+    with open(spec_file, newline="") as f:
+        reader = csv.DictReader(f)
+        # Some specs spell the column "USDM Path and Attrobute"
+        path_column = _spec_column(reader.fieldnames, "USDM Path")
+        for row in reader:
+            name = (row.get("Variable Name") or "").strip()
+            if not name:
+                continue
+            variables.append({
+                "name": name,
+                "label": row.get("Variable Label") or "",
+                "type": row.get("Type") or "",
+                "core": row.get("Core") or "",
+                "paths": compile_path(row.get(path_column) or ""),
+                "relationships": tuple(re.findall(r"(\w+)/@(\w+)", row.get("Required USDM relationships") or "")),
+                "derivation": row.get("Selection / Derivation") or "",
+            })
+    return tuple(variables)
+
+
+def _constant(derivation):
+    # "Set to 'TA'" / "Set to TE"
+    match = re.match(r"\s*Set to '?([^'\s]+)'?\s*$", derivation or "")
+    return match.group(1) if match else None
+
+
+def _attribute(obj, name, index):
+    """Value of attribute name on obj, following *Id / *Ids references through index."""
+    if name in obj:
+        return obj[name]
+    name = ATTRIBUTE_ALIASES.get(name, name)
+    if name not in obj:
+        for ref in (name + "Id", name + "Ids", name[:-1] + "Ids"):
+            if ref in obj:
+                name = ref
+                break
+        else:
+            return None
+    value = obj[name]
+    if index is None or value is None or not name.endswith(("Id", "Ids")):
+        return value
+    if callable(index):
+        index = index()
+    if name.endswith("Ids"):
+        return index.refs(obj, name)
+    if name.endswith("Id"):
+        return index.get(value)
+    return value
+
+
+def follow(objs, attributes, index=None):
+    """
+    Follow attributes from each of objs, flattening list values. index (a
+    UsdmIndex, or a callable returning one when first needed) resolves
+    references.
+    """
+    for attribute in attributes:
+        found = []
+        for obj in objs:
+            if not isinstance(obj, dict):
+                continue
+            value = _attribute(obj, attribute, index)
+            if isinstance(value, list):
+                found.extend(value)
+            elif value is not None:
+                found.append(value)
+        objs = found
+    return objs
+
+
+def _context_binding(ctx):
+    return {
+        "Study": ctx.usdm.get("study") or {},
+        "StudyVersion": ctx.study_version,
+        "StudyDesign": ctx.study_design,
+    }
+
+
+def _scalar(values):
+    for value in values:
+        if not isinstance(value, (dict, list)):
+            return value
+        return ""
+    return ""
+
+
+class DomainMapping:
+    """
+    Row builder for one SDTM domain, compiled from its spec CSV.
+
+    Rows come from row_paths: spec-style paths whose objects each yield a
+    row (several paths yield their cross product). Every object reached
+    along a row path is bound to its class name, and its 1-based position
+    to "#<class>", so each spec variable is evaluated from the deepest
+    bound class on its own path, or through one of its "Required USDM
+    relationships" from a bound class. Variables are planned once here;
+    build_rows only follows attributes.
+
+    Variables whose spec entry is not a plain path take their value from
+    derivations (callables taking the context and row binding; None leaves
+    the variable empty). transforms post-process a variable's value.
+    overrides are derivations supplied by the user (e.g. JSONata, see
+    jsonata_derivations.py); they replace both the mapping and any
+    transform of their variables.
+    """
+
+    def __init__(self, spec_file, row_paths, derivations=None, transforms=None, order=None, overrides=None):
+        self.spec_file = spec_file
+        if isinstance(row_paths, str):
+            row_paths = [row_paths]
+        self.row_paths = [compile_path(path) for path in row_paths]
+        overrides = overrides or {}
+        self.derivations = {**(derivations or {}), **overrides}
+        self.transforms = {name: t for name, t in (transforms or {}).items() if name not in overrides}
+        # class name -> callable(ctx, objects) returning them in row order
+        self.order = order or {}
+        self.row_classes = set()
+        for alternatives in self.row_paths:
+            for path in alternatives:
+                for _, names in path.class_positions():
+                    self.row_classes.update(names)
+        self.row_classes.difference_update(CONTEXT_CLASSES)
+        spec = read_domain_spec(spec_file)
+        # A relationship listed for one variable links the same classes for all of them
+        self.relationships = tuple(dict.fromkeys(rel for variable in spec for rel in variable["relationships"]))
+        self.variables = [self._plan(variable) for variable in spec]
+        # Rows are records of the spec variables, in spec order
+        self.record = record_type([name for name, _, _ in self.variables])
+
+    def _plan(self, variable):
+        name = variable["name"]
+        if name in self.derivations:
+            return name, "derived", self.derivations[name]
+        plans = []
+        for path in variable["paths"]:
+            plan = self._plan_path(path, variable["relationships"] + self.relationships)
+            if plan is not None:
+                plans.append(plan)
+        if plans:
+            # Evaluated per row unless every alternative starts at the context
+            kind = "context" if all(start in CONTEXT_CLASSES for start, _ in plans) else "row"
+            return name, kind, plans
+        constant = _constant(variable["derivation"])
+        if constant is not None:
+            return name, "constant", constant
+        return name, "derived", None
+
+    def _plan_path(self, path, relationships):
+        positions = list(path.class_positions())
+        for i, names in reversed(positions):
+            bound = names & self.row_classes
+            if bound:
+                return next(iter(bound)), path.attributes(i)
+        # Reach the path's target class through a relationship of a row class
+        for rel_class, rel_attribute in relationships:
+            if rel_class not in self.row_classes:
+                continue
+            for i, names in positions:
+                if i and path.steps[i - 1][1] in (rel_attribute, rel_attribute + "s"):
+                    return rel_class, (rel_attribute,) + path.attributes(i)
+        for i, names in reversed(positions):
+            bound = [c for c in CONTEXT_CLASSES if c in names]
+            if bound:
+                return bound[0], path.attributes(i)
+        return None
+
+    def _walk(self, obj, path, start, binding, index, out):
+        steps = path.steps
+        i = start
+        while i < len(steps) and steps[i][0] == "class":
+            i += 1
+        if i == len(steps):
+            out.append(binding)
+            return
+        attribute = steps[i][1]
+        names = steps[i + 1][1] if i + 1 < len(steps) and steps[i + 1][0] == "class" else frozenset()
+        for position, item in enumerate(follow([obj], (attribute,), index), 1):
+            if not isinstance(item, dict):
+                continue
+            child = dict(binding)
+            for name in names:
+                child[name] = item
+                child["#" + name] = position
+            child["_obj"] = item
+            self._walk(item, path, i + 1, child, index, out)
+
+    def _path_bindings(self, ctx, alternatives, context):
+        bindings = []
+        seen = set()
+        for path in alternatives:
+            start = None
+            for i, names in path.class_positions():
+                bound = [c for c in CONTEXT_CLASSES if c in names]
+                if bound:
+                    start = i, context[bound[0]]
+            if start is None:
+                continue
+            found = []
+            self._walk(start[1], path, start[0] + 1, dict(context), lambda: ctx.index, found)
+            # Optional parts of a path may reach objects an earlier alternative already did
+            bindings.extend(binding for binding in found if id(binding["_obj"]) not in seen)
+            seen.update(id(binding["_obj"]) for binding in found)
+        final = [names for _, names in alternatives[0].class_positions()][-1] if alternatives else ()
+        for name in final:
+            if name not in self.order:
+                continue
+            by_obj = {id(binding["_obj"]): binding for binding in bindings}
+            ordered = self.order[name](ctx, [binding["_obj"] for binding in bindings])
+            bindings = []
+            for position, obj in enumerate(ordered, 1):
+                binding = dict(by_obj.get(id(obj), context), _obj=obj)
+                binding[name] = obj
+                binding["#" + name] = position
+                bindings.append(binding)
+        return bindings
+
+    def row_bindings(self, ctx):
+        """Yield one dict of bound objects (and positions) per domain row."""
+        context = _context_binding(ctx)
+        per_path = [self._path_bindings(ctx, alternatives, context) for alternatives in self.row_paths]
+        for combination in itertools.product(*per_path):
+            binding = {}
+            for part in combination:
+                binding.update(part)
+            yield binding
+
+    def row_ids(self, ctx):
+        """
+        Yield, for each row of iter_rows in the same order, the sorted ids
+        of the USDM objects bound to it, which identify the row however its
+        values change.
+        """
+        for binding in self.row_bindings(ctx):
+            yield tuple(sorted({
+                binding[name]["id"] for name in self.row_classes
+                if isinstance(binding.get(name), dict) and binding[name].get("id")
+            }))
+
+    def _evaluate(self, plans, binding, index):
+        for start, attributes in plans:
+            obj = binding.get(start)
+            if obj is None:
+                continue
+            values = follow([obj], attributes, index)
+            if values:
+                return _scalar(values)
+        return ""
+
+    def build_rows(self, ctx):
+        """
+        Evaluate every spec variable for every row binding of ctx.
+        Returns:
+            list: One record per row (see row_records.py), fields named
+            after the spec variables.
+        """
+        return list(self.iter_rows(ctx))
+
+    def iter_rows(self, ctx):
+        """Generator form of build_rows, yielding each row as it is evaluated."""
+        # Only documents whose paths follow references pay for building the index
+        index = lambda: ctx.index
+        context = _context_binding(ctx)
+        # Values that only depend on the study version/design are computed once
+        fixed = {}
+        for name, kind, plan in self.variables:
+            if kind == "constant":
+                fixed[name] = plan
+            elif kind == "context":
+                fixed[name] = self._evaluate(plan, context, index)
+        transforms = [self.transforms.get(name) for name, _, _ in self.variables]
+        make = self.record._make
+        for binding in self.row_bindings(ctx):
+            values = []
+            for (name, kind, plan), transform in zip(self.variables, transforms):
+                if kind == "row":
+                    value = self._evaluate(plan, binding, index)
+                elif kind == "derived":
+                    value = plan(ctx, binding) if plan is not None else ""
+                else:
+                    value = fixed[name]
+                values.append(transform(value) if transform is not None else value)
+            yield make(values)
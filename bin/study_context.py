@@ -0,0 +1,123 @@
+import hashlib
+import json
+
+from row_records import write_records
+from timeline import ScheduleTimelines
+from usdm_model import UsdmIndex
+from usdm_stream import load_usdm_subtrees
+
+# Subtrees every domain needs when loading a document selectively
+STUDY_SUBTREES = ["study.versions[*].studyIdentifiers"]
+
+
+def study_versions(usdm):
+    """
+    The study versions of a USDM document.
+    Raises:
+        ValueError: When usdm has no study or the study has no versions.
+    """
+    study = usdm.get("study") if isinstance(usdm, dict) else None
+    if not isinstance(study, dict):
+        raise ValueError('not a USDM document: there is no "study" object at the top level')
+    versions = study.get("versions")
+    if not versions:
+        raise ValueError("the USDM document's study has no versions")
+    return versions
+
+
+class StudyContext:
+    """
+    Shared, parsed view of a USDM document used by every trial design domain.
+    The document is loaded once and the study version, study design and
+    STUDYID lookups are resolved up front so each domain can reuse them.
+    A context covers one study version and one of its study designs; use
+    iter_study_contexts to cover every version and design of a document.
+    """
+
+    def __init__(self, usdm, version_index=0, design_index=0, index=None):
+        self.usdm = usdm
+        # Structured problems found while deriving domains (e.g. ChainDiagnostic)
+        self.diagnostics = []
+        self.study_version = study_versions(usdm)[version_index]
+        self.study_id = ""
+        if self.study_version.get("studyIdentifiers"):
+            self.study_id = self.study_version["studyIdentifiers"][0].get("text", "")
+        designs = self.study_version.get("studyDesigns") or []
+        self.study_design = designs[design_index] if design_index < len(designs) else {}
+        self.version_id = self.study_version.get("id") or ""
+        self.design_id = self.study_design.get("id") or ""
+        self._index = index.scoped(self.study_version) if index is not None else None
+        self._timelines = None
+
+    @property
+    def index(self):
+        """
+        Index over the whole document, scoped to this context's study
+        version, built on first use unless shared by iter_study_contexts.
+        """
+        if self._index is None:
+            self._index = UsdmIndex(self.usdm).scoped(self.study_version)
+        return self._index
+
+    @property
+    def timelines(self):
+        """
+        ScheduleTimelines of this context's study design, built on first use;
+        timing problems are added to diagnostics.
+        """
+        if self._timelines is None:
+            self._timelines = ScheduleTimelines(self.study_design, self.diagnostics)
+        return self._timelines
+
+
+def design_fingerprint(study_design):
+    return hashlib.sha1(json.dumps(study_design, sort_keys=True).encode()).hexdigest()
+
+
+def iter_study_contexts(usdm, changed_only=False):
+    """
+    Yield a StudyContext for every study version and study design in usdm,
+    all sharing one UsdmIndex. With changed_only, a design is skipped when
+    it is identical to the design with the same id (or, failing that, the
+    same position) in the previous version.
+    """
+    index = UsdmIndex(usdm)
+    previous = {}
+    for version_index, version in enumerate(study_versions(usdm)):
+        designs = version.get("studyDesigns") or [{}]
+        current = {}
+        for design_index, design in enumerate(designs):
+            fingerprint = design_fingerprint(design) if changed_only else None
+            current[design.get("id") or design_index] = fingerprint
+            current.setdefault(design_index, fingerprint)
+            if changed_only and version_index > 0:
+                before = previous.get(design.get("id"), previous.get(design_index))
+                if before == fingerprint:
+                    continue
+            yield StudyContext(usdm, version_index, design_index, index)
+        previous = current
+
+
+def load_usdm(usdm_file):
+    with open(usdm_file) as f:
+        return json.load(f)
+
+
+def load_document(usdm_file, subtrees=None):
+    """
+    Load a USDM file. When subtrees is given only those parts of the
+    document (plus STUDY_SUBTREES) are parsed, see
+    usdm_stream.load_usdm_subtrees.
+    """
+    if subtrees is None:
+        return load_usdm(usdm_file)
+    return load_usdm_subtrees(usdm_file, STUDY_SUBTREES + list(subtrees))
+
+
+def load_study_context(usdm_file, subtrees=None):
+    return StudyContext(load_document(usdm_file, subtrees))
+
+
+def write_domain_csv(output_file, columns, rows):
+    # Rows are records in column order (see conformance.conform), written by position
+    write_records(output_file, columns, rows)
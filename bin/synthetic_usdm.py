@@ -0,0 +1,505 @@
+import argparse
+import json
+from collections import defaultdict
+
+CDISC = "http://www.cdisc.org"
+CT_VERSION = "2024-09-27"
+
+
+class _Ids:
+    """Sequential ids per instanceType, e.g. StudyArm_1, StudyArm_2."""
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+
+    def __call__(self, instance_type):
+        self.counters[instance_type] += 1
+        return f"{instance_type}_{self.counters[instance_type]}"
+
+
+def _code(ids, code, decode, system=CDISC, version=CT_VERSION):
+    return {
+        "id": ids("Code"),
+        "extensionAttributes": [],
+        "code": code,
+        "codeSystem": system,
+        "codeSystemVersion": version,
+        "decode": decode,
+        "instanceType": "Code",
+    }
+
+
+def _alias(ids, code, decode):
+    return {
+        "id": ids("AliasCode"),
+        "extensionAttributes": [],
+        "standardCode": _code(ids, code, decode),
+        "standardCodeAliases": [],
+        "instanceType": "AliasCode",
+    }
+
+
+def _rule(ids, name, text):
+    return {
+        "id": ids("TransitionRule"),
+        "extensionAttributes": [],
+        "name": name,
+        "label": None,
+        "description": None,
+        "text": text,
+        "instanceType": "TransitionRule",
+    }
+
+
+def _quantity(ids, value, unit_code="C29848", unit_decode="Year"):
+    return {
+        "id": ids("Quantity"),
+        "extensionAttributes": [],
+        "value": float(value),
+        "unit": _alias(ids, unit_code, unit_decode),
+        "instanceType": "Quantity",
+    }
+
+
+def _chain(items):
+    for i, item in enumerate(items):
+        item["previousId"] = items[i - 1]["id"] if i else None
+        item["nextId"] = items[i + 1]["id"] if i + 1 < len(items) else None
+
+
+def _design(ids, n_arms, n_epochs, n_encounters, n_instances, n_timelines,
+            n_criteria, n_activities, criterion_items):
+    arms = [
+        {
+            "id": ids("StudyArm"),
+            "extensionAttributes": [],
+            "name": f"ARM{a + 1}",
+            "label": f"Arm {a + 1}",
+            "description": f"Treatment arm {a + 1}",
+            "type": _code(ids, "C174266", "Investigational Arm"),
+            "dataOriginDescription": "Data collected from subjects",
+            "dataOriginType": _code(ids, "C188866", "Data Generated Within Study"),
+            "populationIds": [],
+            "notes": [],
+            "instanceType": "StudyArm",
+        }
+        for a in range(n_arms)
+    ]
+    epochs = [
+        {
+            "id": ids("StudyEpoch"),
+            "extensionAttributes": [],
+            "name": f"Epoch {e + 1}",
+            "label": f"Epoch {e + 1}",
+            "description": f"Study epoch {e + 1}",
+            "type": _code(ids, "C101526", "Treatment Epoch"),
+            "notes": [],
+            "instanceType": "StudyEpoch",
+        }
+        for e in range(n_epochs)
+    ]
+    _chain(epochs)
+
+    # One element per arm and epoch, except a shared screening element
+    elements = []
+    cells = []
+    screening = None
+    for e, epoch in enumerate(epochs):
+        for a, arm in enumerate(arms):
+            if e == 0 and screening is not None:
+                element = screening
+            else:
+                element = {
+                    "id": ids("StudyElement"),
+                    "extensionAttributes": [],
+                    "name": f"EL{len(elements) + 1}",
+                    "label": f"Element {len(elements) + 1}",
+                    "description": f"Element for arm {a + 1} in epoch {e + 1}",
+                    "transitionStartRule": _rule(ids, f"ELEMENT_START_RULE_{len(elements) + 1}", "Start of element"),
+                    "transitionEndRule": _rule(ids, f"ELEMENT_END_RULE_{len(elements) + 1}", "End of element"),
+                    "studyInterventionIds": [],
+                    "notes": [],
+                    "instanceType": "StudyElement",
+                }
+                elements.append(element)
+                if e == 0:
+                    screening = element
+            cells.append({
+                "id": ids("StudyCell"),
+                "extensionAttributes": [],
+                "armId": arm["id"],
+                "epochId": epoch["id"],
+                "elementIds": [element["id"]],
+                "instanceType": "StudyCell",
+            })
+
+    encounters = [
+        {
+            "id": ids("Encounter"),
+            "extensionAttributes": [],
+            "name": f"E{v + 1}",
+            "label": f"Visit {v + 1}",
+            "description": f"Day {v * 7}" if v else "Screening encounter",
+            "type": _code(ids, "C25716", "Visit"),
+            "scheduledAtId": None,
+            "environmentalSettings": [],
+            "contactModes": [],
+            "transitionStartRule": _rule(ids, f"ENCOUNTER_START_RULE_{v + 1}", f"Start of visit {v + 1}"),
+            "transitionEndRule": _rule(ids, f"ENCOUNTER_END_RULE_{v + 1}", f"End of visit {v + 1}"),
+            "notes": [],
+            "instanceType": "Encounter",
+        }
+        for v in range(n_encounters)
+    ]
+    _chain(encounters)
+
+    activities = [
+        {
+            "id": ids("Activity"),
+            "extensionAttributes": [],
+            "name": f"ACT{a + 1}",
+            "label": f"Activity {a + 1}",
+            "description": f"Activity {a + 1}",
+            "definedProcedures": [],
+            "biomedicalConceptIds": [],
+            "bcCategoryIds": [],
+            "bcSurrogateIds": [],
+            "timelineId": None,
+            "notes": [],
+            "instanceType": "Activity",
+        }
+        for a in range(n_activities)
+    ]
+    _chain(activities)
+
+    timelines = []
+    for t in range(n_timelines):
+        instances = []
+        for i in range(n_instances):
+            encounter = encounters[i * n_encounters // n_instances] if encounters else None
+            epoch = epochs[i * n_epochs // n_instances] if epochs else None
+            instances.append({
+                "id": ids("ScheduledActivityInstance"),
+                "extensionAttributes": [],
+                "name": f"SAI{t + 1}_{i + 1}",
+                "label": f"Instance {i + 1}",
+                "description": "-",
+                "defaultConditionId": None,
+                "epochId": epoch["id"] if epoch else None,
+                "instanceType": "ScheduledActivityInstance",
+                "timelineId": None,
+                "timelineExitId": None,
+                "activityIds": [activities[(i + k) % n_activities]["id"] for k in range(min(3, n_activities))],
+                "encounterId": encounter["id"] if encounter else None,
+            })
+        exit_ = {"id": ids("ScheduleTimelineExit"), "extensionAttributes": [], "instanceType": "ScheduleTimelineExit"}
+        for i, instance in enumerate(instances):
+            if i + 1 < len(instances):
+                instance["defaultConditionId"] = instances[i + 1]["id"]
+            else:
+                instance["timelineExitId"] = exit_["id"]
+        anchor = instances[0]["id"] if instances else None
+        timings = []
+        for i, instance in enumerate(instances):
+            fixed = i == 0
+            timings.append({
+                "id": ids("Timing"),
+                "extensionAttributes": [],
+                "name": f"TIM{len(timings) + 1}",
+                "label": "",
+                "description": "",
+                "type": _code(ids, "C201358", "Fixed Reference") if fixed else _code(ids, "C201356", "After"),
+                "value": "P1D" if fixed else f"P{i * 7}D",
+                "valueLabel": "1 day" if fixed else f"{i * 7} days",
+                "relativeToFrom": _code(ids, "C201355", "Start to Start"),
+                "relativeFromScheduledInstanceId": instance["id"],
+                "relativeToScheduledInstanceId": anchor,
+                "windowLower": None,
+                "windowUpper": None,
+                "windowLabel": "",
+                "instanceType": "Timing",
+            })
+        timelines.append({
+            "id": ids("ScheduleTimeline"),
+            "extensionAttributes": [],
+            "name": "Main Timeline" if t == 0 else f"Timeline {t + 1}",
+            "label": "",
+            "description": "",
+            "mainTimeline": t == 0,
+            "entryCondition": "Subject enrolled",
+            "entryId": anchor,
+            "exits": [exit_],
+            "timings": timings,
+            "instances": instances,
+            "plannedDuration": None,
+            "instanceType": "ScheduleTimeline",
+        })
+
+    criteria = []
+    for c in range(n_criteria):
+        inclusion = c < (n_criteria + 1) // 2
+        item = {
+            "id": ids("EligibilityCriterionItem"),
+            "extensionAttributes": [],
+            "name": f"{'IN' if inclusion else 'EX'}{c + 1:02d}",
+            "label": None,
+            "description": None,
+            "text": f"<p>Criterion {c + 1} text.</p>",
+            "dictionaryId": None,
+            "notes": [],
+            "instanceType": "EligibilityCriterionItem",
+        }
+        criterion_items.append(item)
+        criteria.append({
+            "id": ids("EligibilityCriterion"),
+            "extensionAttributes": [],
+            "name": item["name"],
+            "label": f"Criterion {c + 1}",
+            "description": "",
+            "category": _code(ids, "C25532", "Inclusion Criteria") if inclusion else _code(ids, "C25370", "Exclusion Criteria"),
+            "identifier": f"{c + 1:02d}",
+            "criterionItemId": item["id"],
+            "nextId": None,
+            "previousId": None,
+            "notes": [],
+            "instanceType": "EligibilityCriterion",
+        })
+
+    population = {
+        "id": ids("StudyDesignPopulation"),
+        "extensionAttributes": [],
+        "name": "POP1",
+        "label": "",
+        "description": "Synthetic population",
+        "includesHealthySubjects": False,
+        "plannedEnrollmentNumber": {"id": ids("Quantity"), "extensionAttributes": [], "value": 300.0, "unit": None, "instanceType": "Quantity"},
+        "plannedCompletionNumber": None,
+        "plannedSex": [_code(ids, "C49636", "Both")],
+        "criterionIds": [c["id"] for c in criteria],
+        "plannedAge": {
+            "id": ids("Range"),
+            "extensionAttributes": [],
+            "minValue": _quantity(ids, 18),
+            "maxValue": _quantity(ids, 65),
+            "isApproximate": False,
+            "instanceType": "Range",
+        },
+        "notes": [],
+        "cohorts": [],
+        "instanceType": "StudyDesignPopulation",
+    }
+
+    return {
+        "id": ids("InterventionalStudyDesign"),
+        "extensionAttributes": [],
+        "name": "Study Design 1",
+        "label": "",
+        "description": "Synthetic study design",
+        "studyType": _code(ids, "C98388", "Interventional Study"),
+        "studyPhase": _alias(ids, "C15601", "Phase II Trial"),
+        "therapeuticAreas": [],
+        "characteristics": [_code(ids, "C25196", "Randomized")],
+        "encounters": encounters,
+        "activities": activities,
+        "arms": arms,
+        "studyCells": cells,
+        "rationale": "Synthetic design for benchmarking",
+        "epochs": epochs,
+        "elements": elements,
+        "estimands": [],
+        "indications": [{
+            "id": ids("Indication"),
+            "extensionAttributes": [],
+            "name": "IND1",
+            "label": "Synthetic indication",
+            "description": "Synthetic indication",
+            "codes": [],
+            "isRareDisease": False,
+            "notes": [],
+            "instanceType": "Indication",
+        }],
+        "studyInterventionIds": [],
+        "objectives": [],
+        "population": population,
+        "scheduleTimelines": timelines,
+        "biospecimenRetentions": [],
+        "documentVersionIds": [],
+        "eligibilityCriteria": criteria,
+        "analysisPopulations": [],
+        "notes": [],
+        "instanceType": "InterventionalStudyDesign",
+        "subTypes": [],
+        "model": _code(ids, "C82639", "Parallel Study"),
+        "intentTypes": [],
+        "blindingSchema": None,
+    }
+
+
+def _biomedical_concepts(ids, n_bcs, properties_per_bc, codes_per_property):
+    concepts = []
+    for b in range(n_bcs):
+        properties = []
+        for p in range(properties_per_bc):
+            properties.append({
+                "id": ids("BiomedicalConceptProperty"),
+                "extensionAttributes": [],
+                "name": f"Property {p + 1}",
+                "label": f"Property {p + 1}",
+                "isRequired": True,
+                "isEnabled": True,
+                "datatype": "string",
+                "responseCodes": [
+                    {
+                        "id": ids("ResponseCode"),
+                        "extensionAttributes": [],
+                        "name": f"RC_C{1000 + r}",
+                        "label": "",
+                        "isEnabled": True,
+                        "code": _code(ids, f"C{1000 + r}", f"Response {r + 1}"),
+                        "instanceType": "ResponseCode",
+                    }
+                    for r in range(codes_per_property)
+                ],
+                "code": _alias(ids, f"C{2000 + p}", f"Property {p + 1}"),
+                "notes": [],
+                "instanceType": "BiomedicalConceptProperty",
+            })
+        concepts.append({
+            "id": ids("BiomedicalConcept"),
+            "extensionAttributes": [],
+            "name": f"Concept {b + 1}",
+            "label": f"Concept {b + 1}",
+            "synonyms": [f"BC{b + 1}"],
+            "reference": f"/mdr/bc/packages/2025-04-01/biomedicalconcepts/C{3000 + b}",
+            "properties": properties,
+            "code": _alias(ids, f"C{3000 + b}", f"Concept {b + 1}"),
+            "notes": [],
+            "instanceType": "BiomedicalConcept",
+        })
+    return concepts
+
+
+def synthetic_usdm(arms=3, epochs=5, encounters=12, timeline_instances=None, timelines=1,
+                   criteria=30, activities=36, bcs=30, properties_per_bc=5,
+                   codes_per_property=2, versions=1, designs=1):
+    """
+    Build a synthetic USDM v4 document of configurable size.
+    The document carries the attributes required by the USDM API schema for
+    every class it contains, with references (armId, epochId, elementIds,
+    previousId/nextId, entryId, defaultConditionId, criterionIds, ...)
+    consistent throughout. Ids are unique across the whole document.
+    Args:
+        arms, epochs, encounters, criteria, activities (int): Per study design.
+        timeline_instances (int): Scheduled instances per timeline, defaults
+            to one per encounter.
+        timelines (int): Schedule timelines per study design.
+        bcs, properties_per_bc, codes_per_property (int): Biomedical concepts
+            per study version.
+        versions, designs (int): Study versions and study designs per version.
+    Returns:
+        dict: The USDM document.
+    """
+    ids = _Ids()
+    if timeline_instances is None:
+        timeline_instances = encounters
+    organization = {
+        "id": ids("Organization"),
+        "extensionAttributes": [],
+        "name": "SPONSOR",
+        "label": "Synthetic Sponsor",
+        "type": _code(ids, "C70793", "Clinical Study Sponsor"),
+        "identifierScheme": "DUNS",
+        "identifier": "00-000-0000",
+        "legalAddress": None,
+        "managedSites": [],
+        "instanceType": "Organization",
+    }
+    study_versions = []
+    for v in range(versions):
+        criterion_items = []
+        study_designs = [
+            _design(ids, arms, epochs, encounters, timeline_instances, timelines,
+                    criteria, activities, criterion_items)
+            for _ in range(designs)
+        ]
+        study_versions.append({
+            "id": ids("StudyVersion"),
+            "extensionAttributes": [],
+            "versionIdentifier": str(v + 1),
+            "rationale": "Synthetic study version",
+            "documentVersionIds": [],
+            "dateValues": [],
+            "amendments": [],
+            "businessTherapeuticAreas": [],
+            "studyIdentifiers": [{
+                "id": ids("StudyIdentifier"),
+                "extensionAttributes": [],
+                "text": "SYNTH-001",
+                "scopeId": organization["id"],
+                "instanceType": "StudyIdentifier",
+            }],
+            "referenceIdentifiers": [],
+            "studyDesigns": study_designs,
+            "titles": [{
+                "id": ids("StudyTitle"),
+                "extensionAttributes": [],
+                "text": "Synthetic Study",
+                "type": _code(ids, "C207616", "Official Study Title"),
+                "instanceType": "StudyTitle",
+            }],
+            "eligibilityCriterionItems": criterion_items,
+            "narrativeContentItems": [],
+            "abbreviations": [],
+            "roles": [],
+            "organizations": [organization] if v == 0 else [],
+            "studyInterventions": [],
+            "administrableProducts": [],
+            "medicalDevices": [],
+            "productOrganizationRoles": [],
+            "biomedicalConcepts": _biomedical_concepts(ids, bcs, properties_per_bc, codes_per_property),
+            "bcCategories": [],
+            "bcSurrogates": [],
+            "dictionaries": [],
+            "conditions": [],
+            "notes": [],
+            "instanceType": "StudyVersion",
+        })
+    return {
+        "study": {
+            "id": None,
+            "name": "SYNTHETIC",
+            "description": None,
+            "label": None,
+            "versions": study_versions,
+            "documentedBy": [],
+            "instanceType": "Study",
+        },
+        "usdmVersion": "4.0.0",
+        "systemName": "synthetic_usdm",
+        "systemVersion": "1",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic USDM JSON document.")
+    parser.add_argument("--output_file", required=True, help="Path to the output USDM JSON file")
+    parser.add_argument("--arms", type=int, default=3)
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--encounters", type=int, default=12)
+    parser.add_argument("--timeline_instances", type=int, default=None)
+    parser.add_argument("--timelines", type=int, default=1)
+    parser.add_argument("--criteria", type=int, default=30)
+    parser.add_argument("--activities", type=int, default=36)
+    parser.add_argument("--bcs", type=int, default=30)
+    parser.add_argument("--properties_per_bc", type=int, default=5)
+    parser.add_argument("--codes_per_property", type=int, default=2)
+    parser.add_argument("--versions", type=int, default=1)
+    parser.add_argument("--designs", type=int, default=1)
+    args = parser.parse_args()
+    usdm = synthetic_usdm(
+        args.arms, args.epochs, args.encounters, args.timeline_instances, args.timelines,
+        args.criteria, args.activities, args.bcs, args.properties_per_bc,
+        args.codes_per_property, args.versions, args.designs,
+    )
+    with open(args.output_file, "w") as f:
+        json.dump(usdm, f)
@@ -0,0 +1,164 @@
+import os
+import re
+from functools import lru_cache
+
+from file_cache import load_cached
+
+# CDISC terminology spreadsheets, in lookup priority order. Missing files are skipped.
+DEFAULT_TERMINOLOGY_FILES = [
+    "files/SDTM Terminology.xls",
+    "files/Define-XML Terminology.xls",
+]
+DEFAULT_CACHE_DIR = ".cache/terminology"
+
+# Bump when the cached record layout changes
+CACHE_FORMAT = 1
+
+# Column layout of the CDISC controlled terminology spreadsheets
+CT_COLUMNS = [
+    "code",
+    "codelist_code",
+    "extensible",
+    "codelist_name",
+    "submission_value",
+    "synonyms",
+    "definition",
+    "preferred_term",
+]
+
+
+class Terminology:
+    """
+    Indexed CDISC controlled terminology.
+    Codelists and terms are held in plain dicts so every lookup is a single
+    hash probe: code -> codelists, codelist -> terms and
+    (codelist, submission value) -> term.
+    """
+
+    def __init__(self, codelists=None, terms=None, versions=None):
+        # codelist code -> codelist record (CT_COLUMNS keys plus "version")
+        self.codelists = codelists or {}
+        # codelist code -> list of term records
+        self.terms_by_codelist = terms or {}
+        # source file name -> terminology version (publication date)
+        self.versions = versions or {}
+        self.codelists_by_code = {}
+        self.term_by_value = {}
+        for codelist_code, terms_ in self.terms_by_codelist.items():
+            for term in terms_:
+                self.codelists_by_code.setdefault(term["code"], []).append(codelist_code)
+                self.term_by_value[(codelist_code, term["submission_value"].upper())] = term
+        self._term_by_code = {
+            (term["codelist_code"], term["code"]): term
+            for terms_ in self.terms_by_codelist.values()
+            for term in terms_
+        }
+
+    def __len__(self):
+        return len(self._term_by_code)
+
+    def codelists_for(self, code):
+        """Codelist codes that contain the term code."""
+        return self.codelists_by_code.get(code, [])
+
+    def terms(self, codelist_code):
+        return self.terms_by_codelist.get(codelist_code, [])
+
+    def term(self, code, codelist_code=None):
+        """
+        Return the term record for code within codelist_code. Without a
+        codelist, only a code found in exactly one codelist is returned, as
+        the same code can have a different submission value in each.
+        """
+        if codelist_code is None:
+            codelists = self.codelists_for(code)
+            if len(codelists) != 1:
+                return None
+            codelist_code = codelists[0]
+        return self._term_by_code.get((codelist_code, code))
+
+    def lookup_value(self, codelist_code, submission_value):
+        """Return the term whose submission value matches, case-insensitively."""
+        return self.term_by_value.get((codelist_code, submission_value.upper()))
+
+    def merge(self, other):
+        """Return a Terminology holding this one's entries, then other's."""
+        codelists = dict(other.codelists)
+        codelists.update(self.codelists)
+        terms = dict(other.terms_by_codelist)
+        terms.update(self.terms_by_codelist)
+        versions = dict(other.versions)
+        versions.update(self.versions)
+        return Terminology(codelists, terms, versions)
+
+
+def read_terminology_xls(path):
+    """
+    Parse a CDISC terminology spreadsheet into codelist and term records.
+    The version is taken from the date in the terminology sheet name, e.g.
+    "SDTM Terminology 2025-03-28".
+    """
+    import xlrd
+
+    codelists = {}
+    terms = {}
+    version = ""
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        for sheet_name in book.sheet_names():
+            sheet = book.sheet_by_name(sheet_name)
+            if sheet.ncols < len(CT_COLUMNS) or sheet.nrows < 2:
+                continue
+            if str(sheet.cell_value(0, 0)).strip() != "Code":
+                continue
+            match = re.search(r"\d{4}-\d{2}-\d{2}", sheet_name)
+            version = match.group(0) if match else version
+            for r in range(1, sheet.nrows):
+                values = [str(v).strip() for v in sheet.row_values(r, 0, len(CT_COLUMNS))]
+                record = dict(zip(CT_COLUMNS, values))
+                if not record["code"]:
+                    continue
+                record["version"] = version
+                if record["codelist_code"]:
+                    terms.setdefault(record["codelist_code"], []).append(record)
+                else:
+                    codelists[record["code"]] = record
+    finally:
+        book.release_resources()
+    return Terminology(codelists, terms, {os.path.basename(path): version})
+
+
+def _read_terminology_data(path):
+    terminology = read_terminology_xls(path)
+    return terminology.codelists, terminology.terms_by_codelist, terminology.versions
+
+
+def load_terminology_file(path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Load one terminology spreadsheet through the on-disk cache in file_cache.
+    TS runs in every conversion, batch workers included, so a cache that
+    cannot be used (e.g. a read-only checkout) only costs a direct parse.
+    """
+    try:
+        return Terminology(*load_cached(path, cache_dir, _read_terminology_data, CACHE_FORMAT))
+    except OSError as e:
+        print(f"Warning: terminology cache {cache_dir} not usable ({e}), parsing {path} directly")
+        return read_terminology_xls(path)
+
+
+def load_terminology(paths=None, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Load and merge the terminology spreadsheets in paths (defaults to
+    DEFAULT_TERMINOLOGY_FILES); earlier files win when codelists overlap.
+    """
+    terminology = Terminology()
+    for path in paths or DEFAULT_TERMINOLOGY_FILES:
+        if os.path.exists(path):
+            terminology = terminology.merge(load_terminology_file(path, cache_dir))
+    return terminology
+
+
+@lru_cache(maxsize=None)
+def default_terminology():
+    """Terminology from DEFAULT_TERMINOLOGY_FILES, loaded once per process."""
+    return load_terminology()
@@ -0,0 +1,281 @@
+import math
+import re
+from collections import deque
+
+from ordering import ChainDiagnostic, order_epochs
+
+# Timing type codes
+TIMING_BEFORE = "C201357"
+TIMING_AFTER = "C201356"
+TIMING_FIXED_REFERENCE = "C201358"
+
+_TIMING_TYPES = {"before": TIMING_BEFORE, "after": TIMING_AFTER, "fixed reference": TIMING_FIXED_REFERENCE}
+
+SECONDS_PER_DAY = 86400
+
+# Years and months have no fixed length; the same approximation as for ages in TS
+_DESIGNATOR_SECONDS = {
+    "Y": 365.25 * SECONDS_PER_DAY,
+    "M": 30.4375 * SECONDS_PER_DAY,
+    "W": 7 * SECONDS_PER_DAY,
+    "D": SECONDS_PER_DAY,
+    "TH": 3600,
+    "TM": 60,
+    "TS": 1,
+}
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_DURATION = re.compile(
+    rf"^([+-])?P(?:{_NUMBER}Y)?(?:{_NUMBER}M)?(?:{_NUMBER}W)?(?:{_NUMBER}D)?"
+    rf"(?:T(?:{_NUMBER}H)?(?:{_NUMBER}M)?(?:{_NUMBER}S)?)?$"
+)
+
+
+def parse_duration(text):
+    """
+    Length of an ISO 8601 duration such as "P2W", "-P3D" or "PT4H" in seconds.
+    Returns:
+        float: The duration, or None when text is not an ISO 8601 duration.
+    """
+    text = (text or "").strip().upper()
+    match = _DURATION.match(text)
+    # Every part is optional in the pattern, but a duration needs at least one
+    if not match or text.rstrip("T") in ("P", "-P", "+P"):
+        return None
+    seconds = 0.0
+    for number, designator in zip(match.groups()[1:], ("Y", "M", "W", "D", "TH", "TM", "TS")):
+        if number:
+            seconds += float(number.replace(",", ".")) * _DESIGNATOR_SECONDS[designator]
+    return -seconds if match.group(1) == "-" else seconds
+
+
+def format_duration(seconds):
+    """Format seconds as an ISO 8601 duration in days and time, e.g. "P14D", "-P2DT4H"."""
+    sign = "-" if seconds < 0 else ""
+    days, rest = divmod(round(abs(seconds)), SECONDS_PER_DAY)
+    hours, rest = divmod(rest, 3600)
+    minutes, secs = divmod(rest, 60)
+    time = "".join(f"{value}{designator}" for value, designator in ((hours, "H"), (minutes, "M"), (secs, "S")) if value)
+    if not days and not time:
+        return "P0D"
+    return f"{sign}P{f'{days}D' if days else ''}{'T' + time if time else ''}"
+
+
+def study_day(offset, anchor_day=1):
+    """
+    SDTM study day of a time offset (seconds) from the anchor, which falls
+    on anchor_day. There is no day 0: the day before day 1 is day -1.
+    """
+    day = anchor_day + math.floor(offset / SECONDS_PER_DAY)
+    if day <= 0 < anchor_day:
+        day -= 1
+    return day
+
+
+def _timing_type(timing):
+    code = (timing.get("type") or {}).get("code")
+    if code in (TIMING_BEFORE, TIMING_AFTER, TIMING_FIXED_REFERENCE):
+        return code
+    return _TIMING_TYPES.get(((timing.get("type") or {}).get("decode") or "").lower())
+
+
+class ScheduleTimelines:
+    """
+    Time offsets of the scheduled instances of one study design, from the
+    anchor (the Fixed Reference timing) of its main timeline.
+
+    Each timeline's timings form a graph over its instances that is walked
+    once, breadth first from the anchor, the first time any of its
+    instances is asked for; a timeline that an instance of another timeline
+    refers to (timelineId) starts at that instance. Epoch, encounter and
+    element figures are derived once from the instance offsets, so callers
+    can ask per row without walking the graph again.
+
+    Instances carry no duration, so "End to Start" and similar timings are
+    measured between the start of both instances.
+    """
+
+    def __init__(self, study_design, diagnostics=None):
+        self.study_design = study_design
+        self.diagnostics = diagnostics if diagnostics is not None else []
+        timelines = study_design.get("scheduleTimelines") or []
+        self.timelines = {timeline["id"]: timeline for timeline in timelines}
+        main = next((t for t in timelines if t.get("mainTimeline")), timelines[0] if timelines else None)
+        self.main_timeline_id = main["id"] if main else None
+        self.instances = {}
+        self._timeline_of = {}
+        # Timeline id -> instance (of another timeline) it is scheduled from
+        self._parents = {}
+        for timeline in timelines:
+            for instance in timeline.get("instances") or []:
+                self.instances[instance["id"]] = instance
+                self._timeline_of[instance["id"]] = timeline["id"]
+                if instance.get("timelineId") and instance["timelineId"] != timeline["id"]:
+                    self._parents.setdefault(instance["timelineId"], instance["id"])
+        self._local = {}
+        self._anchor_days = {}
+        self._offsets = {}
+        self._epochs = None
+        self._encounters = None
+        self._elements = None
+
+    def _walk_timeline(self, timeline_id):
+        timeline = self.timelines[timeline_id]
+        edges = {}
+        anchors = []
+        for timing in timeline.get("timings") or []:
+            kind = _timing_type(timing)
+            source = timing.get("relativeFromScheduledInstanceId")
+            target = timing.get("relativeToScheduledInstanceId") or source
+            if kind == TIMING_FIXED_REFERENCE:
+                anchors.append(source)
+                self._anchor_days.setdefault(
+                    timeline_id, math.floor((parse_duration(timing.get("value")) or 0) / SECONDS_PER_DAY))
+                continue
+            seconds = parse_duration(timing.get("value"))
+            if kind is None or seconds is None or source not in self.instances or target not in self.instances:
+                self.diagnostics.append(ChainDiagnostic(
+                    "invalid_timing", timing.get("id"), "timing type, value or instances cannot be resolved"))
+                continue
+            # offset(source) = offset(target) + delta
+            delta = -seconds if kind == TIMING_BEFORE else seconds
+            edges.setdefault(target, []).append((source, delta, timing.get("id")))
+            edges.setdefault(source, []).append((target, -delta, timing.get("id")))
+
+        anchor = anchors[0] if anchors else timeline.get("entryId")
+        offsets = {}
+        if anchor in self.instances:
+            offsets[anchor] = 0.0
+        queue = deque(offsets)
+        reported = set()
+        while queue:
+            node = queue.popleft()
+            for other, delta, timing_id in edges.get(node, ()):
+                value = offsets[node] + delta
+                if other not in offsets:
+                    offsets[other] = value
+                    queue.append(other)
+                elif abs(offsets[other] - value) > 1e-6 and timing_id not in reported:
+                    reported.add(timing_id)
+                    self.diagnostics.append(ChainDiagnostic(
+                        "inconsistent_timing", timing_id, "timing disagrees with other timings of its instances"))
+        return offsets
+
+    def local_offsets(self, timeline_id):
+        """Offsets (seconds) of a timeline's instances from its own anchor."""
+        offsets = self._local.get(timeline_id)
+        if offsets is None:
+            offsets = self._local[timeline_id] = self._walk_timeline(timeline_id)
+        return offsets
+
+    def offset(self, instance_id):
+        """
+        Offset of an instance from the main timeline anchor in seconds.
+        Returns:
+            float: The offset, or None when no timing path reaches the instance.
+        """
+        if instance_id in self._offsets:
+            return self._offsets[instance_id]
+        self._offsets[instance_id] = None  # Guards against timelines scheduling each other
+        timeline_id = self._timeline_of.get(instance_id)
+        value = None
+        if timeline_id is not None:
+            local = self.local_offsets(timeline_id).get(instance_id)
+            if local is not None:
+                if timeline_id == self.main_timeline_id:
+                    value = local
+                elif timeline_id in self._parents:
+                    parent = self.offset(self._parents[timeline_id])
+                    value = parent + local if parent is not None else None
+        self._offsets[instance_id] = value
+        return value
+
+    def iso_offset(self, instance_id):
+        """Offset of an instance as an ISO 8601 duration, or None."""
+        value = self.offset(instance_id)
+        return format_duration(value) if value is not None else None
+
+    @property
+    def anchor_day(self):
+        """Study day of the main timeline anchor: the Fixed Reference timing value, at least day 1."""
+        if self.main_timeline_id is None:
+            return 1
+        self.local_offsets(self.main_timeline_id)
+        return max(self._anchor_days.get(self.main_timeline_id, 1), 1)
+
+    def _timed_instances(self):
+        for instance_id, instance in self.instances.items():
+            value = self.offset(instance_id)
+            if value is not None:
+                yield instance, value
+
+    def epoch_spans(self):
+        """Epoch id -> (first, last) instance offset in the epoch, in seconds."""
+        if self._epochs is None:
+            spans = {}
+            for instance, value in self._timed_instances():
+                epoch_id = instance.get("epochId")
+                if epoch_id:
+                    first, last = spans.get(epoch_id, (value, value))
+                    spans[epoch_id] = (min(first, value), max(last, value))
+            self._epochs = spans
+        return self._epochs
+
+    def encounter_offsets(self):
+        """Encounter id -> offset in seconds of its earliest scheduled instance."""
+        if self._encounters is None:
+            offsets = {}
+            for instance, value in self._timed_instances():
+                encounter_id = instance.get("encounterId")
+                if encounter_id and (encounter_id not in offsets or value < offsets[encounter_id]):
+                    offsets[encounter_id] = value
+            # Encounters no instance schedules may still name their timing
+            timings = {t["id"]: t for timeline in self.timelines.values() for t in timeline.get("timings") or []}
+            for encounter in self.study_design.get("encounters") or []:
+                timing = timings.get(encounter.get("scheduledAtId"))
+                if encounter["id"] not in offsets and timing:
+                    value = self.offset(timing.get("relativeFromScheduledInstanceId"))
+                    if value is not None:
+                        offsets[encounter["id"]] = value
+            self._encounters = offsets
+        return self._encounters
+
+    def encounter_day(self, encounter_id):
+        """Planned study day of an encounter, or None."""
+        value = self.encounter_offsets().get(encounter_id)
+        return study_day(value, self.anchor_day) if value is not None else None
+
+    def element_durations(self):
+        """
+        Element id -> planned duration in seconds: from the start of the
+        first epoch holding the element (via the study cells of the first
+        arm that has it) to the start of the epoch after the last one, or
+        to the last instance when no epoch follows.
+        """
+        if self._elements is None:
+            epochs = [epoch["id"] for epoch in order_epochs(self.study_design).items]
+            position = {epoch_id: i for i, epoch_id in enumerate(epochs)}
+            cells = {}
+            for cell in self.study_design.get("studyCells") or []:
+                if cell.get("epochId") not in position:
+                    continue
+                for element_id in cell.get("elementIds") or []:
+                    arm_id = cells.setdefault(element_id, (cell.get("armId"), []))[0]
+                    if arm_id == cell.get("armId"):
+                        cells[element_id][1].append(position[cell["epochId"]])
+            spans = self.epoch_spans()
+            durations = {}
+            for element_id, (_, positions) in cells.items():
+                first, last = min(positions), max(positions)
+                start = spans.get(epochs[first], (None, None))[0]
+                following = spans.get(epochs[last + 1]) if last + 1 < len(epochs) else None
+                end = following[0] if following else spans.get(epochs[last], (None, None))[1]
+                if start is not None and end is not None and end > start:
+                    durations[element_id] = end - start
+            self._elements = durations
+        return self._elements
+
+    def element_duration(self, element_id):
+        """Planned duration of an element as an ISO 8601 duration, or None."""
+        value = self.element_durations().get(element_id)
+        return format_duration(value) if value is not None else None
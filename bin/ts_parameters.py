@@ -0,0 +1,536 @@
+CDISC_CODE_SYSTEM = "http://www.cdisc.org"
+# TSVCDREF of CDISC controlled terminology
+CDISC_CT = "CDISC CT"
+
+# No Yes Response codelist (C66742)
+YES = ("Y", "C49488")
+NO = ("N", "C49487")
+
+# CDISC codelist of the coded TSVAL of each parameter, where there is one
+VALUE_CODELISTS = {
+    "ADAPT": "C66742",
+    "EXTTIND": "C66742",
+    "HLTSUBJI": "C66742",
+    "RANDOM": "C66742",
+    "RDIND": "C66742",
+    "DOSFRQ": "C71113",
+    "DOSU": "C71620",
+    "INTMODEL": "C99076",
+    "INTTYPE": "C99078",
+    "ROUTE": "C66729",
+    "SEXPOP": "C66732",
+    "STYPE": "C99077",
+    "TBLIND": "C66735",
+    "TCNTRL": "C66785",
+    "TINDTP": "C66736",
+    "TPHASE": "C66737",
+    "TTYPE": "C66739",
+}
+
+# Characteristic codes checked by the Y/N design parameters
+ADAPTIVE_DESIGN = "C98704"
+EXTENSION_STUDY = "C207613"
+RANDOMIZED = "C25196"
+
+# StudyIntervention role codes
+EXPERIMENTAL_INTERVENTION = "C41161"
+BACKGROUND_TREATMENT = "C165822"
+
+# Objective and endpoint level codes, by parameter
+OBJECTIVE_LEVELS = {"OBJPRIM": "C85826", "OBJSEC": "C85827", "OBJEXP": "C163559"}
+ENDPOINT_LEVELS = {"OUTMSPRI": "C94496", "OUTMSSEC": "C139173", "OUTMSEXP": "C170559"}
+
+# Organization type codes
+SPONSOR_ORGANIZATION = "C70793"
+REGISTRY_ORGANIZATION = "C93453"
+
+# ISO 8601 duration designators by unit decode; hours and smaller follow "T"
+ISO_8601_UNITS = {
+    "year": "Y", "years": "Y", "yr": "Y", "y": "Y",
+    "month": "M", "months": "M",
+    "week": "W", "weeks": "W", "wk": "W",
+    "day": "D", "days": "D", "d": "D",
+    "hour": "TH", "hours": "TH", "h": "TH",
+    "minute": "TM", "minutes": "TM", "min": "TM",
+}
+
+# Approximate length of each designator in days, to compare ages given in different units
+_UNIT_DAYS = {"Y": 365.25, "M": 30.4375, "W": 7, "D": 1, "TH": 1 / 24, "TM": 1 / 1440}
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _standard_code(code):
+    """The Code of an AliasCode, or code itself when it is a Code."""
+    if not code:
+        return {}
+    return code.get("standardCode") or code
+
+
+def _unit_designator(quantity):
+    unit = _standard_code((quantity or {}).get("unit"))
+    return ISO_8601_UNITS.get((unit.get("decode") or "").lower())
+
+
+def iso8601_duration(quantity):
+    """
+    Format a USDM Quantity with a time unit as an ISO 8601 duration, e.g.
+    50 Year -> "P50Y", 24 Week -> "P24W", 12 Hour -> "PT12H".
+    Returns:
+        str: The duration, or None when the value or unit is missing.
+    """
+    if not quantity or quantity.get("value") is None:
+        return None
+    designator = _unit_designator(quantity)
+    if designator is None:
+        return None
+    if designator.startswith("T"):
+        return f"PT{_number(quantity['value'])}{designator[1:]}"
+    return f"P{_number(quantity['value'])}{designator}"
+
+
+def value(tsval="", tsvalcd="", tsvcdref="", tsvcdver="", tsvalnf="", tsgrpid=""):
+    """One TS record's value columns."""
+    return {
+        "TSVAL": tsval,
+        "TSVALNF": tsvalnf,
+        "TSVALCD": tsvalcd,
+        "TSVCDREF": tsvcdref,
+        "TSVCDVER": tsvcdver,
+        "TSGRPID": tsgrpid,
+    }
+
+
+def yes_no(flag):
+    if flag is None:
+        return []
+    tsval, tsvalcd = YES if flag else NO
+    return [value(tsval, tsvalcd, CDISC_CT)]
+
+
+class StudyFacts:
+    """
+    Everything the TS parameters read from one study version and design,
+    gathered in a single pass so each derivation is a lookup.
+    """
+
+    def __init__(self, ctx):
+        version = ctx.study_version
+        design = ctx.study_design
+        self.study_version = version
+        self.study_design = design
+
+        self.characteristic_codes = set()
+        self.characteristic_decodes = set()
+        for code in design.get("characteristics") or []:
+            self.characteristic_codes.add(code.get("code"))
+            self.characteristic_decodes.add((code.get("decode") or "").upper())
+
+        population = design.get("population") or {}
+        self.population = population
+        self.cohorts = population.get("cohorts") or []
+        self.populations = ([population] if population else []) + self.cohorts
+        # plannedAge bounds of every population and cohort, None where missing
+        self.min_ages = []
+        self.max_ages = []
+        for pop in self.populations:
+            age = pop.get("plannedAge") or {}
+            self.min_ages.append(age.get("minValue"))
+            self.max_ages.append(age.get("maxValue"))
+
+        self.indications = design.get("indications") or []
+        self.arms = design.get("arms") or []
+
+        products = {p.get("id"): p for p in version.get("administrableProducts") or []}
+        interventions = {i.get("id"): i for i in version.get("studyInterventions") or []}
+        intervention_ids = design.get("studyInterventionIds")
+        if intervention_ids is None:
+            intervention_ids = list(interventions)
+        self.interventions = [interventions[i] for i in intervention_ids if i in interventions]
+        self.interventions_by_role = {}
+        # Intervention id -> administrable products it administers
+        self.intervention_products = {}
+        for intervention in self.interventions:
+            role = (intervention.get("role") or {}).get("code")
+            self.interventions_by_role.setdefault(role, []).append(intervention)
+            self.intervention_products[intervention.get("id")] = [
+                products[a["administrableProductId"]]
+                for a in intervention.get("administrations") or []
+                if a.get("administrableProductId") in products
+            ]
+
+        self.objectives_by_level = {}
+        self.endpoints_by_level = {}
+        for objective in design.get("objectives") or []:
+            level = (objective.get("level") or {}).get("code")
+            self.objectives_by_level.setdefault(level, []).append(objective)
+            for endpoint in objective.get("endpoints") or []:
+                level = (endpoint.get("level") or {}).get("code")
+                self.endpoints_by_level.setdefault(level, []).append((endpoint, objective))
+
+        # TSGRPID: interventions, then objectives (with their endpoints), numbered in document order
+        self.group_ids = {}
+        for obj in self.interventions + list(design.get("objectives") or []):
+            self.group_ids[obj.get("id")] = str(len(self.group_ids) + 1)
+
+        organizations = {}
+        self.site_countries = []
+        for org in version.get("organizations") or []:
+            organizations[org.get("id")] = org
+            for site in org.get("managedSites") or []:
+                country = site.get("country")
+                if country and country.get("code") not in {c.get("code") for c in self.site_countries}:
+                    self.site_countries.append(country)
+        # (identifier text, scoping organization) per study identifier
+        self.identifiers = [
+            (identifier.get("text") or "", organizations.get(identifier.get("scopeId")) or {})
+            for identifier in version.get("studyIdentifiers") or []
+        ]
+
+        self.titles_by_type = {}
+        for title in version.get("titles") or []:
+            decode = ((title.get("type") or {}).get("decode") or "").upper()
+            self.titles_by_type.setdefault(decode, []).append(title.get("text") or "")
+
+        self.main_timeline = next(
+            (t for t in design.get("scheduleTimelines") or [] if t.get("mainTimeline")), None
+        )
+
+    def has_characteristic(self, code, decode):
+        return code in self.characteristic_codes or decode.upper() in self.characteristic_decodes
+
+    def group(self, obj):
+        return self.group_ids.get(obj.get("id"), "")
+
+    def products_designated(self, intervention, designation):
+        return any(
+            (_standard_code(p.get("productDesignation")).get("decode") or "").upper() == designation
+            for p in self.intervention_products.get(intervention.get("id"), [])
+        )
+
+    def identifiers_scoped_by(self, organization_type):
+        return [
+            (text, org) for text, org in self.identifiers
+            if ((org.get("type") or {}).get("code")) == organization_type
+        ]
+
+
+# TSPARMCD -> derivation(facts) returning a list of value() dicts, one per record
+TS_DERIVATIONS = {}
+
+
+def ts_parameter(*parmcds):
+    """Register the decorated function as the derivation of the given TSPARMCDs."""
+    def register(derive):
+        for parmcd in parmcds:
+            TS_DERIVATIONS[parmcd] = derive
+        return derive
+    return register
+
+
+def coded(code, tsgrpid=""):
+    """
+    A record for a USDM Code or AliasCode: decode, code and its code system.
+    CDISC codes are referenced as CDISC CT in the Code's own version, which
+    the terminology lookup in create_ts_csv replaces when it knows the term.
+    """
+    code = _standard_code(code)
+    if not code or not code.get("code"):
+        return []
+    cdisc = code.get("codeSystem") == CDISC_CODE_SYSTEM
+    return [value(
+        code.get("decode") or "",
+        code.get("code") or "",
+        CDISC_CT if cdisc else code.get("codeSystem") or "",
+        code.get("codeSystemVersion") or "",
+        tsgrpid=tsgrpid,
+    )]
+
+
+def _codes(codes, tsgrpid=""):
+    return [record for code in codes or [] for record in coded(code, tsgrpid)]
+
+
+@ts_parameter("ADAPT")
+def _adapt(facts):
+    return yes_no(facts.has_characteristic(ADAPTIVE_DESIGN, "Adaptive Design"))
+
+
+@ts_parameter("EXTTIND")
+def _exttind(facts):
+    return yes_no(facts.has_characteristic(EXTENSION_STUDY, "Extension Study Design"))
+
+
+@ts_parameter("RANDOM")
+def _random(facts):
+    return yes_no(facts.has_characteristic(RANDOMIZED, "Randomized"))
+
+
+@ts_parameter("HLTSUBJI")
+def _hltsubji(facts):
+    flags = [p.get("includesHealthySubjects") for p in facts.populations if p.get("includesHealthySubjects") is not None]
+    return yes_no(any(flags) if flags else None)
+
+
+@ts_parameter("RDIND")
+def _rdind(facts):
+    flags = [i["isRareDisease"] for i in facts.indications if i.get("isRareDisease") is not None]
+    return yes_no(any(flags) if flags else None)
+
+
+def _age(quantities, pick):
+    # Any population without a bound leaves the parameter unknown
+    if not quantities or any(q is None or q.get("value") is None for q in quantities):
+        return [value(tsvalnf="UNK")]
+    comparable = [q for q in quantities if _unit_designator(q)]
+    if not comparable:
+        return [value(_number(quantities[0]["value"]))]
+    chosen = pick(comparable, key=lambda q: q["value"] * _UNIT_DAYS[_unit_designator(q)])
+    return [value(iso8601_duration(chosen))]
+
+
+@ts_parameter("AGEMIN")
+def _agemin(facts):
+    return _age(facts.min_ages, min)
+
+
+@ts_parameter("AGEMAX")
+def _agemax(facts):
+    return _age(facts.max_ages, max)
+
+
+def _intervention_names(facts, interventions):
+    return [value(i.get("name") or "", tsgrpid=facts.group(i)) for i in interventions]
+
+
+@ts_parameter("TRT")
+def _trt(facts):
+    return _intervention_names(facts, facts.interventions_by_role.get(EXPERIMENTAL_INTERVENTION, []))
+
+
+@ts_parameter("COMPTRT")
+def _comptrt(facts):
+    return _intervention_names(facts, [
+        i for i in facts.interventions
+        if (i.get("role") or {}).get("code") != EXPERIMENTAL_INTERVENTION and facts.products_designated(i, "IMP")
+    ])
+
+
+@ts_parameter("CURTRT")
+def _curtrt(facts):
+    return _intervention_names(facts, facts.interventions_by_role.get(BACKGROUND_TREATMENT, []))
+
+
+def _per_administration(facts, derive):
+    # One record per distinct value within each intervention, grouped by intervention
+    records = []
+    for intervention in facts.interventions:
+        seen = set()
+        for administration in intervention.get("administrations") or []:
+            for record in derive(administration, facts.group(intervention)):
+                key = (record["TSVAL"], record["TSVALCD"])
+                if key not in seen:
+                    seen.add(key)
+                    records.append(record)
+    return records
+
+
+@ts_parameter("DOSE")
+def _dose(facts):
+    def derive(administration, group):
+        dose = administration.get("dose") or {}
+        return [value(_number(dose["value"]), tsgrpid=group)] if dose.get("value") is not None else []
+    return _per_administration(facts, derive)
+
+
+@ts_parameter("DOSU")
+def _dosu(facts):
+    return _per_administration(facts, lambda a, group: coded((a.get("dose") or {}).get("unit"), group))
+
+
+@ts_parameter("DOSFRQ")
+def _dosfrq(facts):
+    return _per_administration(facts, lambda a, group: coded(a.get("frequency"), group))
+
+
+@ts_parameter("ROUTE")
+def _route(facts):
+    return _per_administration(facts, lambda a, group: coded(a.get("route"), group))
+
+
+@ts_parameter("PTRTDUR")
+def _ptrtdur(facts):
+    def derive(administration, group):
+        duration = iso8601_duration((administration.get("duration") or {}).get("quantity"))
+        return [value(duration, tsgrpid=group)] if duration else []
+    return _per_administration(facts, derive)
+
+
+@ts_parameter("INTTYPE")
+def _inttype(facts):
+    return [r for i in facts.interventions for r in coded(i.get("type"), facts.group(i))]
+
+
+@ts_parameter("PCLAS")
+def _pclas(facts):
+    records = []
+    for intervention in facts.interventions:
+        for product in facts.intervention_products.get(intervention.get("id"), []):
+            if (_standard_code(product.get("productDesignation")).get("decode") or "").upper() == "IMP":
+                records.extend(coded(product.get("pharmacologicClass"), facts.group(intervention)))
+    return records
+
+
+@ts_parameter("TCNTRL")
+def _tcntrl(facts):
+    return [
+        r for i in facts.interventions if facts.products_designated(i, "NIMP")
+        for r in coded(i.get("role"), facts.group(i))
+    ]
+
+
+@ts_parameter("FCNTRY")
+def _fcntry(facts):
+    return [
+        value(c.get("code") or "", tsvcdref=c.get("codeSystem") or "", tsvcdver=c.get("codeSystemVersion") or "")
+        for c in facts.site_countries
+    ]
+
+
+@ts_parameter("INDIC")
+def _indic(facts):
+    records = []
+    for indication in facts.indications:
+        text = indication.get("description") or indication.get("name") or ""
+        codes = coded((indication.get("codes") or [None])[0])
+        if codes:
+            codes[0]["TSVAL"] = text
+            records.extend(codes)
+        else:
+            records.append(value(text))
+    return records
+
+
+@ts_parameter("INTMODEL")
+def _intmodel(facts):
+    return coded(facts.study_design.get("model"))
+
+
+@ts_parameter("LENGTH")
+def _length(facts):
+    duration = iso8601_duration(((facts.main_timeline or {}).get("plannedDuration") or {}).get("quantity"))
+    return [value(duration)] if duration else []
+
+
+@ts_parameter("NARMS")
+def _narms(facts):
+    return [value(str(len(facts.arms)))]
+
+
+@ts_parameter("NCOHORT")
+def _ncohort(facts):
+    return [value(str(len(facts.cohorts)))]
+
+
+def _objectives(level):
+    def derive(facts):
+        return [
+            value(o.get("text") or "", tsgrpid=facts.group(o))
+            for o in facts.objectives_by_level.get(level, [])
+        ]
+    return derive
+
+
+def _endpoints(level):
+    def derive(facts):
+        # Grouped with the objective the endpoint belongs to
+        return [
+            value(e.get("text") or "", tsgrpid=facts.group(o))
+            for e, o in facts.endpoints_by_level.get(level, [])
+        ]
+    return derive
+
+
+for _parmcd, _level in OBJECTIVE_LEVELS.items():
+    ts_parameter(_parmcd)(_objectives(_level))
+for _parmcd, _level in ENDPOINT_LEVELS.items():
+    ts_parameter(_parmcd)(_endpoints(_level))
+
+
+@ts_parameter("PLANSUB")
+def _plansub(facts):
+    planned = facts.population.get("plannedEnrollmentNumber") or {}
+    if planned.get("value") is not None:
+        return [value(_number(planned["value"]))]
+    # A Range: combine minimum and maximum, once when equal or only one given
+    bounds = [
+        _number(q["value"]) for q in (planned.get("minValue"), planned.get("maxValue"))
+        if q and q.get("value") is not None
+    ]
+    if not bounds:
+        return []
+    return [value(bounds[0] if len(set(bounds)) == 1 else "-".join(bounds))]
+
+
+@ts_parameter("REGID")
+def _regid(facts):
+    return [
+        value(text, tsvcdref=org.get("name") or "")
+        for text, org in facts.identifiers_scoped_by(REGISTRY_ORGANIZATION)
+    ]
+
+
+@ts_parameter("SPONSOR")
+def _sponsor(facts):
+    for _, org in facts.identifiers_scoped_by(SPONSOR_ORGANIZATION)[:1]:
+        return [value(org.get("name") or "", org.get("identifier") or "", org.get("identifierScheme") or "")]
+    return []
+
+
+@ts_parameter("SPREFID")
+def _sprefid(facts):
+    return [value(text) for text, _ in facts.identifiers_scoped_by(SPONSOR_ORGANIZATION)[:1]]
+
+
+@ts_parameter("SEXPOP")
+def _sexpop(facts):
+    return _codes(facts.population.get("plannedSex"))
+
+
+@ts_parameter("STYPE")
+def _stype(facts):
+    return coded(facts.study_design.get("studyType") or facts.study_version.get("studyType"))
+
+
+@ts_parameter("TBLIND")
+def _tblind(facts):
+    return coded(facts.study_design.get("blindingSchema"))
+
+
+@ts_parameter("THERAREA")
+def _therarea(facts):
+    return _codes(facts.study_design.get("therapeuticAreas"))
+
+
+@ts_parameter("TINDTP")
+def _tindtp(facts):
+    return _codes(facts.study_design.get("intentTypes") or facts.study_design.get("trialIntentTypes"))
+
+
+@ts_parameter("TITLE")
+def _title(facts):
+    return [value(text) for text in facts.titles_by_type.get("OFFICIAL STUDY TITLE", [])]
+
+
+@ts_parameter("TPHASE")
+def _tphase(facts):
+    return coded(facts.study_design.get("studyPhase") or facts.study_version.get("studyPhase"))
+
+
+@ts_parameter("TTYPE")
+def _ttype(facts):
+    return _codes(facts.study_design.get("subTypes") or facts.study_design.get("trialTypes"))
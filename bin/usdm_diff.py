@@ -0,0 +1,326 @@
+import json
+from collections import namedtuple
+
+from conformance import conform
+from create_trial_design import (DOMAIN_COLUMNS, DOMAIN_SPEC_FILES, DOMAIN_SUBTREES, DOMAINS, check_domains,
+                                 domain_mapping, iter_domain_rows)
+from study_context import STUDY_SUBTREES, StudyContext, study_versions
+from usdm_stream import prune_usdm
+
+# kind is one of: "added", "removed", "changed"; attributes lists the
+# changed attributes of a changed object
+ObjectChange = namedtuple("ObjectChange", ["kind", "id", "instance_type", "attributes"])
+
+# key holds the values of the domain's DOMAIN_KEYS; changes maps each
+# changed variable to its (old, new) values, or is the whole row when added/removed;
+# design is the id of the study design the row belongs to
+RowChange = namedtuple("RowChange", ["domain", "kind", "key", "changes", "design"], defaults=("",))
+
+# Variables identifying a record of each domain, as in the SDTM natural keys
+DOMAIN_KEYS = {
+    "TA": ["ARMCD", "TAETORD"],
+    "TE": ["ETCD"],
+    "TV": ["VISITNUM", "ARMCD"],
+    "TI": ["IETESTCD"],
+    "TS": ["TSPARMCD", "TSSEQ"],
+}
+
+DiffResult = namedtuple("DiffResult", ["objects", "rows", "compared", "skipped"])
+
+
+def _is_object(node):
+    return isinstance(node.get("id"), str) and bool(node.get("instanceType"))
+
+
+def _shallow(node, children):
+    """
+    node with every nested USDM object replaced by {"$id": id}; those
+    objects are appended to children.
+    """
+    if isinstance(node, dict):
+        if _is_object(node):
+            children.append(node)
+            return {"$id": node["id"]}
+        return {key: _shallow(value, children) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_shallow(value, children) for value in node]
+    return node
+
+
+def _compare(old, new):
+    """Changed attributes of two versions of an object, and the objects nested in each."""
+    old_children, new_children = [], []
+    changed = []
+    for key in list(old) + [key for key in new if key not in old]:
+        if _shallow(old.get(key), old_children) != _shallow(new.get(key), new_children):
+            changed.append(key)
+    return changed, old_children, new_children
+
+
+def _by_key(objects):
+    """objects by id; repeated ids (invalid, but found in the wild) by id and occurrence."""
+    by_key = {}
+    for obj in objects:
+        key = obj["id"]
+        n = 1
+        while key in by_key:
+            n += 1
+            key = (obj["id"], n)
+        by_key[key] = obj
+    return by_key
+
+
+def diff_objects(old_root, new_root):
+    """
+    USDM objects added, removed or changed between two roots (e.g. two
+    StudyVersion objects), matched by id.
+    The walk starts at the roots and pairs the objects nested in each pair
+    of differing objects through an id index; subtrees that compare equal
+    are skipped as a whole by one built-in equality check, which runs
+    without building anything and stops at the first difference, so an
+    amendment costs in proportion to what it touches. Objects that moved
+    to another parent are matched up again once the walk is done.
+    Returns:
+        list: ObjectChange, changed objects in walk order, then removed and
+        added objects.
+    """
+    changes = []
+    removed = {}
+    added = {}
+    pending = [(old_root, new_root)]
+    while pending:
+        while pending:
+            old, new = pending.pop()
+            if old == new:
+                continue
+            attributes, old_children, new_children = _compare(old, new)
+            if attributes:
+                changes.append(ObjectChange("changed", new["id"], new["instanceType"], attributes))
+            new_by_key = _by_key(new_children)
+            old_by_key = _by_key(old_children)
+            for key, child in old_by_key.items():
+                if key in new_by_key:
+                    pending.append((child, new_by_key[key]))
+                else:
+                    removed[key] = child
+            for key, child in new_by_key.items():
+                if key not in old_by_key:
+                    added[key] = child
+        for moved in [key for key in added if key in removed]:
+            pending.append((removed.pop(moved), added.pop(moved)))
+    changes.extend(ObjectChange("removed", obj["id"], obj["instanceType"], []) for obj in removed.values())
+    changes.extend(ObjectChange("added", obj["id"], obj["instanceType"], []) for obj in added.values())
+    return changes
+
+
+def _keyed_rows(domain, rows, ids=None):
+    """rows by their DOMAIN_KEYS values, and the object ids (see diff_rows) of each key."""
+    keys = DOMAIN_KEYS[domain]
+    keyed = {}
+    ids_by_key = {}
+    for row, row_ids in zip(rows, ids if ids is not None else [()] * len(rows)):
+        key = tuple(str(row.get(name, "")) for name in keys)
+        # Rows sharing a key are told apart by their position among them
+        occurrence = key
+        n = 1
+        while occurrence in keyed:
+            n += 1
+            occurrence = key + (f"#{n}",)
+        keyed[occurrence] = row
+        ids_by_key[occurrence] = row_ids
+    return keyed, ids_by_key
+
+
+def diff_rows(domain, old_rows, new_rows, old_ids=None, new_ids=None, design=""):
+    """
+    Records added, removed or changed between two versions of a domain
+    table, matched by DOMAIN_KEYS. Keys are derived values (e.g. ARMCD from
+    the arm name), so a row whose key is new is paired with a row whose key
+    is gone when both were built from the same USDM objects, and reported
+    as changed, key variables included; a renamed arm then shows as changed
+    rows rather than new ones. Other rows with a new or a gone key are
+    added or removed.
+    Args:
+        domain (str): Domain code.
+        old_rows, new_rows (list): Rows as dicts of variable values.
+        old_ids, new_ids (list): For each row, the ids of the USDM objects
+            it was built from (see spec_mapping.DomainMapping.row_ids);
+            without them rows are only matched by key.
+        design (str): Study design id recorded in each RowChange.
+    Returns:
+        list: RowChange, in new table order then removed rows.
+    """
+    old, old_ids = _keyed_rows(domain, old_rows, old_ids)
+    new, new_ids = _keyed_rows(domain, new_rows, new_ids)
+    removed = {}
+    for key in old:
+        if key not in new and old_ids[key]:
+            removed.setdefault(old_ids[key], []).append(key)
+    paired = {}
+    for key in new:
+        if key not in old and removed.get(new_ids[key]):
+            paired[key] = removed[new_ids[key]].pop(0)
+    changes = []
+    for key, row in new.items():
+        before = old.get(key) or old.get(paired.get(key))
+        if before is None:
+            changes.append(RowChange(domain, "added", key, row, design))
+            continue
+        changed = {name: (before.get(name, ""), value) for name, value in row.items()
+                   if str(before.get(name, "")) != str(value)}
+        if changed:
+            changes.append(RowChange(domain, "changed", key, changed, design))
+    matched = set(paired.values())
+    changes.extend(RowChange(domain, "removed", key, row, design) for key, row in old.items()
+                   if key not in new and key not in matched)
+    return changes
+
+
+def _domain_rows(ctx, domain, tsparm_spec_file):
+    """The conformed rows of a domain as dicts, and the object ids of each (empty for TS)."""
+    if ctx is None:
+        return [], []
+    rows = list(iter_domain_rows(ctx, domain, tsparm_spec_file))
+    mapping = domain_mapping(domain)
+    ids = list(mapping.row_ids(ctx)) if mapping is not None else [()] * len(rows)
+    # Rows are compared and reported by variable name
+    rows = conform(domain, rows, DOMAIN_COLUMNS[domain], DOMAIN_SPEC_FILES[domain]).rows
+    return [row._asdict() for row in rows], ids
+
+
+def _design_pairs(old_version, new_version):
+    """
+    Indexes of the matching study designs of two study versions, matched
+    by id or, failing that, position; None for a design found in one only.
+    """
+    old_designs = old_version.get("studyDesigns") or [{}]
+    new_designs = new_version.get("studyDesigns") or [{}]
+    old_by_id = {design.get("id"): i for i, design in enumerate(old_designs) if design.get("id")}
+    new_ids = {design.get("id") for design in new_designs}
+    pairs = []
+    matched = set()
+    for new_index, design in enumerate(new_designs):
+        old_index = old_by_id.get(design.get("id"))
+        # An old design at the same position is only taken when no new design has its id
+        if old_index is None and new_index < len(old_designs) and old_designs[new_index].get("id") not in new_ids:
+            old_index = new_index
+        if old_index is not None:
+            matched.add(old_index)
+        pairs.append((old_index, new_index))
+    pairs.extend((old_index, None) for old_index in range(len(old_designs)) if old_index not in matched)
+    return pairs
+
+
+def _domain_inputs(usdm, version_index, subtrees):
+    """
+    The parts of one study version a domain reads (see usdm_stream.prune_usdm),
+    leaving out the version's own id and other attributes, which differ
+    between versions of one document without changing any domain row.
+    """
+    document = {"study": {"versions": [study_versions(usdm)[version_index]]}}
+    version = prune_usdm(document, subtrees)["study"]["versions"][0]
+    return {key: value for key, value in version.items() if isinstance(value, (dict, list))}
+
+
+def diff_usdm(old_usdm, new_usdm, old_version=0, new_version=0, domains=None,
+              tsparm_spec_file="spec/TSPARM_spec.csv"):
+    """
+    Compare one study version of two USDM documents (or two versions of the
+    same document, passed twice).
+    Object deltas come from diff_objects over the two StudyVersion objects.
+    Domain rows are only built for domains whose part of the version (see
+    create_trial_design.DOMAIN_SUBTREES) differs, then compared by key for
+    every study design, designs being matched by id (see diff_rows); the
+    rows of a design found in one version only are all added or removed.
+    Args:
+        old_usdm, new_usdm (dict): Loaded USDM documents.
+        old_version, new_version (int): Index of the study version in each.
+        domains (list): Trial design domains to compare, defaults to all.
+        tsparm_spec_file (str): Path to the TSPARM spec used for TS.
+    Returns:
+        DiffResult: ObjectChanges, RowChanges, and the domains compared and
+        skipped as unchanged.
+    """
+    domains = check_domains(domains)
+    old_study_version, new_study_version = study_versions(old_usdm)[old_version], study_versions(new_usdm)[new_version]
+    objects = diff_objects(old_study_version, new_study_version)
+    contexts = [
+        (StudyContext(old_usdm, old_version, old_index) if old_index is not None else None,
+         StudyContext(new_usdm, new_version, new_index) if new_index is not None else None)
+        for old_index, new_index in _design_pairs(old_study_version, new_study_version)
+    ]
+    rows = []
+    compared = []
+    skipped = []
+    for domain in domains:
+        subtrees = STUDY_SUBTREES + DOMAIN_SUBTREES[domain]
+        if _domain_inputs(old_usdm, old_version, subtrees) == _domain_inputs(new_usdm, new_version, subtrees):
+            skipped.append(domain)
+            continue
+        compared.append(domain)
+        for old_ctx, new_ctx in contexts:
+            old_rows, old_ids = _domain_rows(old_ctx, domain, tsparm_spec_file)
+            new_rows, new_ids = _domain_rows(new_ctx, domain, tsparm_spec_file)
+            design = (new_ctx or old_ctx).design_id
+            rows.extend(diff_rows(domain, old_rows, new_rows, old_ids, new_ids, design))
+    return DiffResult(objects, rows, compared, skipped)
+
+
+def summarize(result):
+    """Counts of object and row changes by kind, per instanceType and per domain."""
+    objects = {}
+    for change in result.objects:
+        counts = objects.setdefault(change.instance_type, {"added": 0, "removed": 0, "changed": 0})
+        counts[change.kind] += 1
+    rows = {domain: {"added": 0, "removed": 0, "changed": 0} for domain in result.compared}
+    for change in result.rows:
+        rows[change.domain][change.kind] += 1
+    return {"objects": objects, "rows": rows, "unchanged_domains": result.skipped}
+
+
+def write_report(report_file, result):
+    report = {
+        "summary": summarize(result),
+        "objects": [change._asdict() for change in result.objects],
+        "rows": [dict(change._asdict(), key=list(change.key)) for change in result.rows],
+    }
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+
+
+def main(old_file, new_file=None, old_version=0, new_version=None, domains=None, report_file=None,
+         tsparm_spec_file="spec/TSPARM_spec.csv"):
+    """
+    Print the changes between two USDM files, or between two study versions
+    of old_file when new_file is not given (new_version then defaults to
+    the last version), and write them to report_file as JSON.
+    """
+    from study_context import load_usdm
+
+    old_usdm = load_usdm(old_file)
+    new_usdm = load_usdm(new_file) if new_file else old_usdm
+    if new_version is None:
+        new_version = 0 if new_file else len(study_versions(new_usdm)) - 1
+    result = diff_usdm(old_usdm, new_usdm, old_version, new_version, domains, tsparm_spec_file)
+    summary = summarize(result)
+    for instance_type, counts in summary["objects"].items():
+        print(f"{instance_type}: {counts['added']} added, {counts['removed']} removed, {counts['changed']} changed")
+    # Rows are only told apart by design when either version has more than one
+    designs = max(len(study_versions(old_usdm)[old_version].get("studyDesigns") or []),
+                  len(study_versions(new_usdm)[new_version].get("studyDesigns") or [])) > 1
+    for change in result.rows:
+        key = "/".join(change.key)
+        domain = f"{change.domain} {change.design}:" if designs else change.domain
+        if change.kind == "changed":
+            detail = ", ".join(f"{name} {old!r} -> {new!r}" for name, (old, new) in change.changes.items())
+            print(f"{domain} {key} changed: {detail}")
+        else:
+            print(f"{domain} {key} {change.kind}")
+    for domain in result.compared:
+        if not any(summary["rows"][domain].values()):
+            print(f"{domain}: no row changes")
+    if result.skipped:
+        print(f"Unchanged: {', '.join(sorted(result.skipped, key=DOMAINS.index))}")
+    if report_file:
+        write_report(report_file, result)
+    return result
@@ -0,0 +1,128 @@
+from collections import defaultdict
+
+
+class UsdmIndex:
+    """
+    Index of every object in a USDM document by id and by instanceType.
+
+    The document is walked once when the index is built. References held in
+    *Id / *Ids attributes (armId, epochId, elementIds, criterionIds,
+    previousId, nextId, documentVersionIds, ...) are not expanded up front;
+    they are resolved on access with a dict lookup.
+
+    Ids are only unique within a study version, so objects inside each
+    StudyVersion are also indexed per version; use scoped() to resolve
+    references the way that version sees them.
+    """
+
+    def __init__(self, usdm):
+        self.by_id = {}
+        self.by_type = defaultdict(list)
+        self.duplicate_ids = []
+        # StudyVersion id -> {object id: object} for objects inside that version
+        self.scopes = {}
+        self._parents = {}
+        self._walk(usdm)
+
+    def _walk(self, root):
+        # Iterative walk, USDM documents nest deeply enough to make recursion costly
+        stack = [(root, None, None)]
+        while stack:
+            node, parent, scope = stack.pop()
+            if isinstance(node, dict):
+                obj_id = node.get("id")
+                instance_type = node.get("instanceType")
+                if isinstance(obj_id, str) and instance_type:
+                    if instance_type == "StudyVersion":
+                        scope = self.scopes.setdefault(obj_id, {})
+                    if scope is not None:
+                        if obj_id in scope:
+                            self.duplicate_ids.append(obj_id)
+                        else:
+                            scope[obj_id] = node
+                    if obj_id not in self.by_id:
+                        self.by_id[obj_id] = node
+                    elif scope is None:
+                        self.duplicate_ids.append(obj_id)
+                    self.by_type[instance_type].append(node)
+                    if parent is not None:
+                        self._parents[id(node)] = parent
+                    parent = node
+                children = node.values()
+            elif isinstance(node, list):
+                children = node
+            else:
+                continue
+            # Push in reverse so objects are indexed in document order
+            for child in reversed(list(children)):
+                if isinstance(child, (dict, list)):
+                    stack.append((child, parent, scope))
+
+    def __contains__(self, obj_id):
+        return self.get(obj_id) is not None
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, obj_id, default=None):
+        return self.by_id.get(obj_id, default)
+
+    def instances(self, instance_type):
+        """Return all objects of the given instanceType in document order."""
+        return self.by_type.get(instance_type, [])
+
+    def parent(self, obj):
+        """Return the closest enclosing USDM object of obj, or None."""
+        return self._parents.get(id(obj))
+
+    def ref(self, obj, attr, default=None):
+        """Resolve a single-valued reference attribute such as armId."""
+        ref_id = obj.get(attr)
+        if ref_id is None:
+            return default
+        return self.get(ref_id, default)
+
+    def refs(self, obj, attr):
+        """Resolve a multi-valued reference attribute such as elementIds."""
+        found = (self.get(ref_id) for ref_id in obj.get(attr) or [])
+        return [item for item in found if item is not None]
+
+    def resolve(self, obj, name):
+        """
+        Resolve a relationship by its short name, e.g. "arm" -> armId or
+        "elements" -> elementIds.
+        """
+        if name + "Id" in obj:
+            return self.ref(obj, name + "Id")
+        if name.endswith("s") and name[:-1] + "Ids" in obj:
+            return self.refs(obj, name[:-1] + "Ids")
+        if name + "Ids" in obj:
+            return self.refs(obj, name + "Ids")
+        raise KeyError(f"{obj.get('instanceType', 'object')} has no reference named '{name}'")
+
+    def scoped(self, study_version):
+        """Return a view that resolves ids within study_version first."""
+        return ScopedIndex(self, self.scopes.get(study_version.get("id"), {}))
+
+
+class ScopedIndex(UsdmIndex):
+    """View of a UsdmIndex that prefers objects from one study version."""
+
+    def __init__(self, base, scope):
+        self.by_id = base.by_id
+        self.by_type = base.by_type
+        self.duplicate_ids = base.duplicate_ids
+        self.scopes = base.scopes
+        self._parents = base._parents
+        self._scope = scope
+
+    def get(self, obj_id, default=None):
+        obj = self._scope.get(obj_id)
+        if obj is None:
+            obj = self.by_id.get(obj_id, default)
+        return obj
+
+    def instances(self, instance_type):
+        """Return the objects of instance_type inside this study version."""
+        scope = self._scope
+        return [obj for obj in self.by_type.get(instance_type, []) if scope.get(obj["id"]) is obj]
@@ -0,0 +1,314 @@
+import json
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from study_context import STUDY_SUBTREES, load_document
+from usdm_stream import parse_path
+
+DEFAULT_SCHEMA_FILE = "files/USDM_API_v4.0.0.json"
+
+# Component schema of a whole USDM document
+ROOT_SCHEMA = "Wrapper-Input"
+
+# path is a JSON path such as "$.study.versions[0].studyDesigns[0].arms[2].name"
+SchemaError = namedtuple("SchemaError", ["path", "message"])
+
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _type_test(name):
+    if name == "integer":
+        return lambda value: isinstance(value, int) and not isinstance(value, bool)
+    if name == "number":
+        return lambda value: isinstance(value, (int, float)) and not isinstance(value, bool)
+    python_type = {
+        "object": dict, "array": list, "string": str, "boolean": bool, "null": type(None),
+    }[name]
+    return lambda value: isinstance(value, python_type)
+
+
+def format_path(path):
+    """Render a (parent, key) linked path as "$.a.b[0].c"."""
+    parts = []
+    while path is not None:
+        path, key = path
+        parts.append(f"[{key}]" if isinstance(key, int) else f".{key}")
+    return "$" + "".join(reversed(parts))
+
+
+class _TooManyErrors(Exception):
+    pass
+
+
+class _Errors(list):
+    def __init__(self, limit=None):
+        super().__init__()
+        self.limit = limit
+
+    def add(self, path, message):
+        self.append(SchemaError(format_path(path), message))
+        if self.limit is not None and len(self) >= self.limit:
+            raise _TooManyErrors
+
+
+class UsdmSchema:
+    """
+    Validators compiled from the component schemas of the USDM API
+    (OpenAPI) file. Each schema is compiled into a check function the
+    first time it is used and kept for the life of the object, so
+    validating many documents only pays for walking them.
+
+    Only the keywords the USDM schemas use are supported: type,
+    properties, required, items, maxItems, anyOf, $ref, enum, const,
+    minLength and the date format.
+    """
+
+    def __init__(self, schemas):
+        self.schemas = schemas
+        self._named = {}
+        self._inline = {}
+
+    def validator(self, name):
+        """Check function (value, path, errors) for components/schemas/name."""
+        check = self._named.get(name)
+        if check is None:
+            check = self._named[name] = self._compile(self.schemas[name])
+        return check
+
+    def compile_all(self):
+        """Compile every component schema up front, e.g. in a long-lived process."""
+        for name in self.schemas:
+            self.validator(name)
+
+    def _ref(self, ref):
+        name = ref.rsplit("/", 1)[-1]
+        if name not in self.schemas:
+            raise ValueError(f"Unknown schema reference {ref!r}")
+        resolved = None
+
+        # Resolved on first use so recursive schemas compile
+        def check(value, path, errors):
+            nonlocal resolved
+            if resolved is None:
+                resolved = self.validator(name)
+            resolved(value, path, errors)
+
+        return check
+
+    def _instance_types(self, branches):
+        """instanceType -> schema name when every branch is a class $ref, else None."""
+        by_type = {}
+        for branch in branches:
+            name = branch.get("$ref", "").rsplit("/", 1)[-1]
+            const = self.schemas.get(name, {}).get("properties", {}).get("instanceType", {}).get("const")
+            if const is None:
+                return None
+            by_type[const] = name
+        return by_type
+
+    def _any_of(self, branches):
+        nullable = any(branch.get("type") == "null" for branch in branches)
+        branches = [branch for branch in branches if branch.get("type") != "null"]
+        by_type = self._instance_types(branches) if len(branches) > 1 else None
+        if by_type:
+            # USDM classes are told apart by instanceType, no need to try each
+            checks = {instance_type: self._ref(name) for instance_type, name in by_type.items()}
+            expected = ", ".join(sorted(checks))
+
+            def check(value, path, errors):
+                if value is None and nullable:
+                    return
+                if not isinstance(value, dict):
+                    errors.add(path, f"expected one of {expected}, got {type(value).__name__}")
+                    return
+                branch = checks.get(value.get("instanceType"))
+                if branch is None:
+                    errors.add(path, f"instanceType {value.get('instanceType')!r} is not one of {expected}")
+                    return
+                branch(value, path, errors)
+
+            return check
+
+        checks = [self._compile(branch) for branch in branches]
+        if len(checks) == 1:
+            only = checks[0]
+
+            def check(value, path, errors):
+                if value is None and nullable:
+                    return
+                only(value, path, errors)
+
+            return check
+
+        def check(value, path, errors):
+            if value is None and nullable:
+                return
+            for branch in checks:
+                scratch = _Errors()
+                branch(value, None, scratch)
+                if not scratch:
+                    return
+            errors.add(path, "does not match any of the allowed schemas")
+
+        return check
+
+    def _compile(self, schema):
+        if "$ref" in schema:
+            return self._ref(schema["$ref"])
+        if "anyOf" in schema:
+            return self._any_of(schema["anyOf"])
+
+        expected = schema.get("type")
+        is_type = _type_test(expected) if expected else None
+        allowed = [schema["const"]] if "const" in schema else schema.get("enum")
+        min_length = schema.get("minLength")
+        is_date = schema.get("format") == "date"
+        items = self._compile(schema["items"]) if "items" in schema else None
+        max_items = schema.get("maxItems")
+        properties = {name: self._compile(s) for name, s in schema.get("properties", {}).items()}
+        required = tuple(schema.get("required", ()))
+
+        def check(value, path, errors):
+            if is_type is not None and not is_type(value):
+                errors.add(path, f"expected {expected}, got {type(value).__name__}")
+                return
+            if allowed is not None and value not in allowed:
+                errors.add(path, f"{value!r} is not one of {allowed}")
+            if isinstance(value, str):
+                if min_length is not None and len(value) < min_length:
+                    errors.add(path, f"shorter than {min_length} character(s)")
+                if is_date and not _DATE.match(value):
+                    errors.add(path, f"{value!r} is not a YYYY-MM-DD date")
+            elif isinstance(value, list):
+                if max_items is not None and len(value) > max_items:
+                    errors.add(path, f"more than {max_items} item(s)")
+                if items is not None:
+                    for i, item in enumerate(value):
+                        items(item, (path, i), errors)
+            elif isinstance(value, dict):
+                for name in required:
+                    if name not in value:
+                        errors.add(path, f"missing required attribute {name!r}")
+                for name, item in value.items():
+                    check_property = properties.get(name)
+                    if check_property is not None:
+                        check_property(item, (path, name), errors)
+
+        return check
+
+    def _inline_validator(self, schema):
+        check = self._inline.get(id(schema))
+        if check is None:
+            check = self._inline[id(schema)] = self._compile(schema)
+        return check
+
+    def _resolve(self, schema, value):
+        # Concrete object/array schema of value, or None when it is null or unknown
+        while True:
+            if "$ref" in schema:
+                schema = self.schemas[schema["$ref"].rsplit("/", 1)[-1]]
+            elif "anyOf" in schema:
+                branches = [b for b in schema["anyOf"] if b.get("type") != "null"]
+                if value is None:
+                    return None
+                by_type = self._instance_types(branches) if len(branches) > 1 else None
+                if by_type:
+                    name = by_type.get(value.get("instanceType")) if isinstance(value, dict) else None
+                    if name is None:
+                        return None
+                    schema = self.schemas[name]
+                else:
+                    schema = branches[0]
+            else:
+                return schema
+
+    def _walk(self, schema, value, trie, path, errors):
+        if None in trie:
+            # A selected subtree: everything below it is checked
+            self._inline_validator(schema)(value, path, errors)
+            return
+        concrete = self._resolve(schema, value)
+        if concrete is None:
+            # Null, or a class the discriminator does not know; the full check reports it
+            if value is not None:
+                self._inline_validator(schema)(value, path, errors)
+            return
+        for token, below in trie.items():
+            if token == "item":
+                if not isinstance(value, list):
+                    errors.add(path, f"expected array, got {type(value).__name__}")
+                    continue
+                items = concrete.get("items", {})
+                for i, item in enumerate(value):
+                    self._walk(items, item, below, (path, i), errors)
+                continue
+            if not isinstance(value, dict):
+                errors.add(path, f"expected object, got {type(value).__name__}")
+                return
+            if token not in value:
+                if token in concrete.get("required", ()):
+                    errors.add(path, f"missing required attribute {token!r}")
+                continue
+            attribute = concrete.get("properties", {}).get(token)
+            if attribute is not None:
+                self._walk(attribute, value[token], below, (path, token), errors)
+
+    def validate(self, usdm, subtrees=None, max_errors=None):
+        """
+        Check a USDM document against the schema.
+        Args:
+            usdm (dict): Loaded USDM document.
+            subtrees (list): Only check these subtrees in full, e.g.
+                "study.versions[*].studyDesigns[*].arms", plus the attributes
+                leading to them. None checks the whole document.
+            max_errors (int): Stop after this many errors.
+        Returns:
+            list: SchemaError for every problem found.
+        """
+        errors = _Errors(max_errors)
+        root = {"$ref": f"#/components/schemas/{ROOT_SCHEMA}"}
+        try:
+            if subtrees is None:
+                self._inline_validator(root)(usdm, None, errors)
+            else:
+                trie = {}
+                for subtree in subtrees:
+                    node = trie
+                    for token in parse_path(subtree):
+                        node = node.setdefault(token, {})
+                    node[None] = {}
+                self._walk(root, usdm, trie, None, errors)
+        except _TooManyErrors:
+            pass
+        return list(errors)
+
+
+@lru_cache(maxsize=None)
+def load_schema(schema_file=DEFAULT_SCHEMA_FILE):
+    """UsdmSchema for the component schemas of schema_file, loaded once per process."""
+    with open(schema_file) as f:
+        document = json.load(f)
+    return UsdmSchema(document["components"]["schemas"])
+
+
+def validate_usdm(usdm, subtrees=None, schema_file=DEFAULT_SCHEMA_FILE, max_errors=None):
+    """
+    Validate a loaded USDM document, see UsdmSchema.validate.
+    Returns:
+        list: SchemaError objects, empty when the document is valid.
+    """
+    return load_schema(schema_file).validate(usdm, subtrees, max_errors)
+
+
+def validate_usdm_file(usdm_file, subtrees=None, stream=False, schema_file=DEFAULT_SCHEMA_FILE, max_errors=None):
+    """
+    Load and validate usdm_file. With subtrees and stream only those parts
+    of the file are parsed, the quickest way to triage many documents.
+    Returns:
+        list: SchemaError objects, empty when the document is valid.
+    """
+    if subtrees is not None:
+        subtrees = STUDY_SUBTREES + [s for s in subtrees if s not in STUDY_SUBTREES]
+    usdm = load_document(usdm_file, subtrees if stream else None)
+    return validate_usdm(usdm, subtrees, schema_file, max_errors)
@@ -0,0 +1,157 @@
+import json
+from functools import lru_cache
+
+# Classification of a location in the document against the selected paths
+SKIP, PATH, FULL = 0, 1, 2
+
+
+@lru_cache(maxsize=None)
+def _ijson():
+    # Imported on first streaming load only, it is slow to import
+    try:
+        import ijson
+    except ImportError:  # Optional dependency, fall back to json.load + pruning
+        return None
+    return ijson
+
+
+def parse_path(path):
+    """
+    Split a subtree path such as "study.versions[*].studyDesigns[*].encounters"
+    into tokens, using "item" for every array step as ijson does.
+    """
+    tokens = []
+    for part in path.split("."):
+        while part.endswith("[*]"):
+            part = part[:-3]
+            if part:
+                tokens.append(part)
+            part = ""
+            tokens.append("item")
+        if part:
+            tokens.append(part)
+    return tuple(tokens)
+
+
+class _PathMatcher:
+    def __init__(self, paths):
+        self.patterns = [parse_path(p) for p in paths]
+        self._cache = {}
+
+    def classify(self, tokens):
+        tokens = tuple(tokens)
+        kind = self._cache.get(tokens)
+        if kind is None:
+            kind = SKIP
+            for pattern in self.patterns:
+                if tokens[:len(pattern)] == pattern:
+                    kind = FULL
+                    break
+                if pattern[:len(tokens)] == tokens:
+                    kind = PATH
+            self._cache[tokens] = kind
+        return kind
+
+
+def _stream_subtrees(f, matcher, ijson):
+    # Containers on the current branch: [container, tokens, kind, pending key]
+    stack = []
+    root = None
+    skip_depth = 0
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if skip_depth:
+            if event == "start_map" or event == "start_array":
+                skip_depth += 1
+            elif event == "end_map" or event == "end_array":
+                skip_depth -= 1
+            continue
+        if event == "map_key":
+            stack[-1][3] = value
+            continue
+        if event == "end_map" or event == "end_array":
+            stack.pop()
+            continue
+
+        if stack:
+            parent, parent_tokens, parent_kind, key = stack[-1]
+            tokens = parent_tokens + ((key,) if isinstance(parent, dict) else ("item",))
+            kind = FULL if parent_kind == FULL else matcher.classify(tokens)
+        else:
+            parent, key, tokens, kind = None, None, (), matcher.classify(())
+
+        is_container = event == "start_map" or event == "start_array"
+        if kind == SKIP:
+            # Unselected subtrees are tokenized but never materialized; scalar
+            # attributes of objects on a selected path are kept for context
+            if is_container:
+                skip_depth = 1
+                continue
+            if not isinstance(parent, dict):
+                continue
+
+        if event == "start_map":
+            node = {}
+        elif event == "start_array":
+            node = []
+        else:
+            node = value
+        if parent is None:
+            root = node
+        elif isinstance(parent, dict):
+            parent[key] = node
+        else:
+            parent.append(node)
+        if is_container:
+            stack.append([node, tokens, kind, None])
+    return root
+
+
+def _prune(node, tokens, matcher):
+    kind = matcher.classify(tokens)
+    if kind == FULL:
+        return node
+    if isinstance(node, dict):
+        pruned = {}
+        for key, value in node.items():
+            child_tokens = tokens + (key,)
+            if isinstance(value, (dict, list)):
+                if matcher.classify(child_tokens) != SKIP:
+                    pruned[key] = _prune(value, child_tokens, matcher)
+            else:
+                pruned[key] = value
+        return pruned
+    if isinstance(node, list):
+        return [_prune(item, tokens + ("item",), matcher) for item in node]
+    return node
+
+
+def prune_usdm(usdm, paths):
+    """
+    The parts of a loaded USDM document selected by paths, exactly as
+    load_usdm_subtrees would load them. Selected subtrees are shared with
+    usdm, not copied.
+    """
+    return _prune(usdm, (), _PathMatcher(paths))
+
+
+def load_usdm_subtrees(usdm_file, paths):
+    """
+    Load only the parts of a USDM document selected by paths.
+    Objects along each path keep their scalar attributes (id, name,
+    instanceType, ...) and the selected subtrees are loaded in full; every
+    other list or object is skipped without being built as Python objects.
+    Requires ijson for the streaming parse, otherwise the whole document is
+    loaded with json.load and pruned afterwards (same result, no memory saving).
+    Args:
+        usdm_file (str): Path to the USDM JSON file.
+        paths (list): Subtree paths, e.g. "study.versions[*].studyDesigns[*].elements".
+    Returns:
+        dict: The pruned USDM document.
+    """
+    matcher = _PathMatcher(paths)
+    ijson = _ijson()
+    if ijson is None:
+        with open(usdm_file) as f:
+            return _prune(json.load(f), (), matcher)
+    with open(usdm_file, "rb") as f:
+        return _stream_subtrees(f, matcher, ijson)